@@ -1,11 +1,12 @@
 import json
 import logging
-import re
 
-from flask import Blueprint, request
-from autoplaylistpoetry.connections import get_redis_cache
+from flask import Blueprint, Response, current_app, request, stream_with_context
+from autoplaylistpoetry.connections import get_metrics_text, get_playlist_generator, get_request_deadline, get_stats
 
-from playlist.generator import PlaylistGenerator, ApiException, spotify_uri_to_url
+from playlist.generator import ApiException, spotify_uri_to_url
+from playlist.message_tools import split_sentences
+from playlist.plthreading import generate_multiple_playlists_as_completed
 from playlist.plthreading import generate_multiple_playlists_threaded
 
 
@@ -15,28 +16,28 @@ logger = logging.getLogger(__name__)
 
 @api.route('/api/playlist', methods=['GET'])
 def api_playlist():
-    cache = get_redis_cache()
+    deadline = get_request_deadline()
+    generator = get_playlist_generator()
     message = request.args.get('message')
     try:
         if message:
-            messages = [sentence for sentence in re.split(r'[.?!/\n]', message) if len(sentence) > 0]
+            messages = split_sentences(message)
             if len(messages) > 1:
                 # If we have multiple messages, process them concurrently
                 playlist = []
                 incomplete = False
-                results = generate_multiple_playlists_threaded(messages, cache)
+                results = generate_multiple_playlists_threaded(messages, None,
+                                                               pool_size=current_app.config['GENERATOR_POOL_SIZE'],
+                                                               generator=generator, deadline=deadline)
                 for result in results:
                     if result[1]:
                         incomplete = True
                     playlist.extend(result[0])
             else:
-                pl_gen = PlaylistGenerator(cache)
-                playlist, incomplete = pl_gen.generate_playlist(messages[0])
+                playlist, incomplete = generator.generate_playlist(messages[0], deadline=deadline)
 
             if playlist:
-                generated_playlist = [{'name': item.name, 'uri': item.uri, 'url': spotify_uri_to_url(item.uri)} for item
-                                      in playlist]
-                payload = {'success': True, 'partial': incomplete, 'playlist': generated_playlist}
+                payload = {'success': True, 'partial': incomplete, 'playlist': playlist_to_json(playlist)}
             else:
                 payload = {'error': True, 'message': "Not able to generate playlist!"}
         else:
@@ -45,4 +46,98 @@ def api_playlist():
         logger.warn("An error occured with the Spotify API. Statuscode: %s", e.status)
         payload = {'error': True, 'message': "The Spotify API returned an error({})".format(str(e.status))}
 
-    return json.dumps(payload)
\ No newline at end of file
+    return json.dumps(payload)
+
+
+@api.route('/api/playlist/stream', methods=['GET'])
+def api_playlist_stream():
+    """
+    Streams the playlist of every sentence of the message as soon as it's done, as newline-delimited JSON. Every line
+    has the position of its sentence and the total number of sentences, so clients can put them in order. The last
+    line says whether the playlist is complete, or has an error if something went wrong
+    """
+    deadline = get_request_deadline()
+    generator = get_playlist_generator()
+    pool_size = current_app.config['GENERATOR_POOL_SIZE']
+    message = request.args.get('message')
+    messages = split_sentences(message) if message else []
+
+    def stream():
+        if not messages:
+            yield json.dumps({'error': True, 'message': "No message provided!"}) + '\n'
+            return
+        incomplete = False
+        try:
+            for position, (playlist, sentence_incomplete) in generate_multiple_playlists_as_completed(
+                    messages, None, pool_size=pool_size, generator=generator, deadline=deadline):
+                incomplete = incomplete or sentence_incomplete
+                yield json.dumps({'position': position, 'total': len(messages), 'sentence': messages[position],
+                                  'partial': sentence_incomplete, 'playlist': playlist_to_json(playlist)}) + '\n'
+            yield json.dumps({'success': True, 'partial': incomplete}) + '\n'
+        except ApiException as e:
+            logger.warn("An error occured with the Spotify API. Statuscode: %s", e.status)
+            yield json.dumps({'error': True,
+                              'message': "The Spotify API returned an error({})".format(str(e.status))}) + '\n'
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+
+@api.route('/api/playlists', methods=['POST'])
+def api_playlists():
+    """
+    Generates playlists for a batch of messages, posted as JSON: {"messages": [...]}. The sentences of all messages
+    are generated together, sharing cache lookups and API calls for the titles they have in common. Returns a result
+    for every message, in the same order
+    """
+    deadline = get_request_deadline()
+    generator = get_playlist_generator()
+    data = request.get_json(force=True, silent=True)
+    messages = data.get('messages') if isinstance(data, dict) else None
+    if not isinstance(messages, list) or not all(isinstance(message, basestring) for message in messages):
+        return json.dumps({'error': True, 'message': "Expected a JSON object with a list of messages!"})
+    if len(messages) > current_app.config['API_BATCH_MAX_MESSAGES']:
+        return json.dumps({'error': True, 'message': "Too many messages, the maximum is {}".format(
+            current_app.config['API_BATCH_MAX_MESSAGES'])})
+
+    # Like a single message, a message with multiple sentences can use max_chunk_length for all of them
+    sentences_per_message = [split_sentences(message) for message in messages]
+    sentences = [(sentence, len(message_sentences) > 1) for message_sentences in sentences_per_message
+                 for sentence in message_sentences]
+    try:
+        sentence_results = iter(generator.generate_playlists(sentences, deadline))
+    except ApiException as e:
+        logger.warn("An error occured with the Spotify API. Statuscode: %s", e.status)
+        return json.dumps({'error': True, 'message': "The Spotify API returned an error({})".format(str(e.status))})
+
+    results = []
+    for message_sentences in sentences_per_message:
+        playlist = []
+        incomplete = False
+        for _ in message_sentences:
+            sentence_playlist, sentence_incomplete = next(sentence_results)
+            playlist.extend(sentence_playlist)
+            incomplete = incomplete or sentence_incomplete
+        if playlist:
+            results.append({'success': True, 'partial': incomplete, 'playlist': playlist_to_json(playlist)})
+        elif message_sentences:
+            results.append({'error': True, 'message': "Not able to generate playlist!"})
+        else:
+            results.append({'error': True, 'message': "No message provided!"})
+    return json.dumps({'success': True, 'results': results})
+
+
+@api.route('/api/stats', methods=['GET'])
+def api_stats():
+    return json.dumps(get_stats())
+
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Exposes the metrics of this process in the Prometheus text format
+    """
+    return Response(get_metrics_text(), mimetype='text/plain; version=0.0.4')
+
+
+def playlist_to_json(playlist):
+    return [{'name': item.name, 'uri': item.uri, 'url': spotify_uri_to_url(item.uri)} for item in playlist]
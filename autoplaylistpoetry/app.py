@@ -1,9 +1,18 @@
 import logging.config
 
+import redis
 from flask import Flask, render_template
 
 from autoplaylistpoetry.web import web
 from autoplaylistpoetry.api import api
+from playlist.cache import MemPlaylistCache
+from playlist.metrics import get_default_metrics
+from playlist.rediscache import RedisPlaylistCache
+from playlist.resultcache import RedisResultCache
+from playlist.session import SpotifySession
+from playlist.ratelimit import TokenBucket, RedisTokenBucket
+from playlist.titleindex import TitleIndex
+from playlist.workers import BackgroundTasks
 
 
 DEFAULT_BLUEPRINTS = (
@@ -18,6 +27,11 @@ def create_app(blueprints=None):
 
     app = Flask(__name__)
     config_app(app)
+    config_metrics(app)
+    config_redis(app)
+    config_spotify_session(app)
+    config_cache(app)
+    config_title_index(app)
     config_blueprints(app, blueprints)
     config_error_pages(app)
     return app
@@ -29,6 +43,63 @@ def config_app(app):
     logging.config.dictConfig(app.config['LOGGING'])
 
 
+def config_metrics(app):
+    # Generator threads and background revalidations record to the same registry, so it's the process-wide one
+    app.extensions['metrics'] = get_default_metrics()
+
+
+def config_redis(app):
+    # One bounded, thread-safe pool per app, so requests don't pay for setting up connections
+    pool = redis.BlockingConnectionPool(max_connections=app.config['REDIS_MAX_CONNECTIONS'],
+                                        timeout=app.config['REDIS_POOL_TIMEOUT'],
+                                        host=app.config['REDIS_HOST'],
+                                        port=app.config['REDIS_PORT'],
+                                        db=app.config['REDIS_DB'],
+                                        password=app.config['REDIS_PASSWORD'],
+                                        socket_timeout=app.config['REDIS_SOCKET_TIMEOUT'],
+                                        socket_connect_timeout=app.config['REDIS_SOCKET_CONNECT_TIMEOUT'])
+    app.extensions['redis_pool'] = pool
+    app.extensions['redis_cache'] = RedisPlaylistCache(connection_pool=pool)
+    if app.config['RESULT_CACHE_MAX_AGE']:
+        app.extensions['result_cache'] = RedisResultCache(redis.StrictRedis(connection_pool=pool))
+
+
+def config_spotify_session(app):
+    # One session per app, so all requests and generator threads share the same connection pool and rate limit
+    app.extensions['spotify_session'] = SpotifySession(app.config['SPOTIFY_POOL_SIZE'],
+                                                       app.config['SPOTIFY_MAX_RETRIES'],
+                                                       app.config['SPOTIFY_BACKOFF_FACTOR'],
+                                                       app.config['SPOTIFY_TIMEOUT'],
+                                                       create_rate_limiter(app),
+                                                       app.extensions['metrics'])
+
+
+def create_rate_limiter(app):
+    rate = app.config['SPOTIFY_RATE_LIMIT']
+    burst = app.config['SPOTIFY_RATE_BURST']
+    if not rate:
+        return None
+    if app.config['SPOTIFY_RATE_LIMITER'] == 'redis':
+        database = redis.StrictRedis(connection_pool=app.extensions['redis_pool'])
+        return RedisTokenBucket(database, rate, burst)
+    return TokenBucket(rate, burst)
+
+
+def config_cache(app):
+    # The in-process cache lives as long as the app, so it's shared by all requests handled by this process
+    if app.config['CACHE_L1_SIZE'] and app.config['CACHE_L1_STALENESS']:
+        app.extensions['playlist_l1_cache'] = MemPlaylistCache(max_items=app.config['CACHE_L1_SIZE'])
+    # Revalidations of stale items run in the background, on a bounded number of threads shared by all requests
+    app.extensions['refresher'] = BackgroundTasks('revalidate', app.config['CACHE_REFRESH_WORKERS'],
+                                                  app.config['CACHE_MAX_PENDING_REFRESHES'])
+
+
+def config_title_index(app):
+    # Opening the index only maps the file into memory, so this is cheap no matter how big the index is
+    if app.config['TITLE_INDEX_PATH']:
+        app.extensions['title_index'] = TitleIndex(app.config['TITLE_INDEX_PATH'])
+
+
 def config_blueprints(app, blueprints):
     for blueprint in blueprints:
         app.register_blueprint(blueprint)
@@ -4,6 +4,52 @@ REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 REDIS_DB = 0
 REDIS_PASSWORD = None
+# All requests and generator threads of a process share one pool of at most REDIS_MAX_CONNECTIONS connections.
+# Getting a connection waits up to REDIS_POOL_TIMEOUT seconds for one to become available
+REDIS_MAX_CONNECTIONS = 50
+REDIS_POOL_TIMEOUT = 5
+REDIS_SOCKET_TIMEOUT = 5
+REDIS_SOCKET_CONNECT_TIMEOUT = 2
+
+# In-process cache in front of Redis for the hottest titles. Entries are kept for at most CACHE_L1_STALENESS seconds
+# before being read from Redis again. Set CACHE_L1_SIZE to 0 to disable
+CACHE_L1_SIZE = 10000
+CACHE_L1_STALENESS = 60
+# Serve items that expired at most CACHE_MAX_STALENESS seconds ago right away, and revalidate them with the API in the
+# background, using CACHE_REFRESH_WORKERS threads and queueing at most CACHE_MAX_PENDING_REFRESHES revalidations
+CACHE_STALE_WHILE_REVALIDATE = True
+CACHE_MAX_STALENESS = 60 * 60
+CACHE_REFRESH_WORKERS = 4
+CACHE_MAX_PENDING_REFRESHES = 1000
+# Generated playlists are cached as a whole in Redis, for at most RESULT_CACHE_MAX_AGE seconds (or
+# RESULT_CACHE_INCOMPLETE_MAX_AGE seconds for partial playlists). Set RESULT_CACHE_MAX_AGE to 0 to disable
+RESULT_CACHE_MAX_AGE = 60 * 60
+RESULT_CACHE_INCOMPLETE_MAX_AGE = 5 * 60
+
+# Title index built with build_index.py, consulted before the cache and the API. None to go without
+TITLE_INDEX_PATH = None
+
+# Point this to a stand-in for the Spotify API (ie. benchmarks/fakespotify.py) to try out the app without using the API
+SPOTIFY_SEARCH_URL = 'https://api.spotify.com/v1/search'
+SPOTIFY_POOL_SIZE = 10
+SPOTIFY_MAX_RETRIES = 3
+SPOTIFY_BACKOFF_FACTOR = 0.5
+SPOTIFY_TIMEOUT = 10
+# Calls per second (on average) and burst size allowed by the rate limiter. Use the 'redis' limiter when running
+# multiple worker processes, so they share one limit
+SPOTIFY_RATE_LIMIT = 10
+SPOTIFY_RATE_BURST = 20
+SPOTIFY_RATE_LIMITER = 'local'
+
+# Threads shared by all requests for generating playlists for multiple sentences, the time allowed per request and
+# the time allowed per sentence (None for no limit). When time runs out, the best partial playlist so far is returned
+GENERATOR_POOL_SIZE = 8
+GENERATOR_TIMEOUT = 30
+GENERATOR_MESSAGE_TIMEOUT = 10
+# Maximum number of messages in one request to the batch API. A batch has GENERATOR_TIMEOUT seconds, in which the rate
+# limiter allows about SPOTIFY_RATE_LIMIT * GENERATOR_TIMEOUT + SPOTIFY_RATE_BURST API calls (320 by default). A message
+# of a dozen words nobody asked for before takes about 20, so keep this in line with the rate limit and timeout
+API_BATCH_MAX_MESSAGES = 10
 
 LOGGING = {
     'version': 1,
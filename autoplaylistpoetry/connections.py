@@ -1,14 +1,77 @@
-from flask import g, current_app
-from playlist.rediscache import RedisPlaylistCache
+from flask import current_app
+from playlist.deadline import Deadline
+from playlist.generator import PlaylistGenerator
+from playlist.rediscache import connection_pool_stats
+from playlist.tieredcache import TieredPlaylistCache
 
 
 def get_redis_cache():
-    host = current_app.config['REDIS_HOST']
-    port = current_app.config['REDIS_PORT']
-    database = current_app.config['REDIS_DB']
-    password = current_app.config['REDIS_PASSWORD']
-    redis_cache = getattr(g, '_redis_cache', None)
-    if redis_cache is None:
-        redis_cache = g._redis_cache = RedisPlaylistCache(host, port, database, password)
-
-    return redis_cache
\ No newline at end of file
+    # The cache is app-scoped and backed by the app's connection pool, so it's safe to share between threads
+    return current_app.extensions['redis_cache']
+
+
+def get_playlist_cache():
+    """
+    Returns the cache the views should use: Redis, fronted by the app's in-process cache if that's enabled
+    """
+    l1_cache = current_app.extensions.get('playlist_l1_cache')
+    if l1_cache is None:
+        return get_redis_cache()
+    return TieredPlaylistCache(l1_cache, get_redis_cache(), current_app.config['CACHE_L1_STALENESS'])
+
+
+def get_spotify_session():
+    return current_app.extensions['spotify_session']
+
+
+def get_title_index():
+    return current_app.extensions.get('title_index')
+
+
+def get_playlist_generator():
+    """
+    Returns a PlaylistGenerator configured according to the app's config
+    """
+    return PlaylistGenerator(get_playlist_cache(), session=get_spotify_session(), title_index=get_title_index(),
+                             stale_while_revalidate=current_app.config['CACHE_STALE_WHILE_REVALIDATE'],
+                             max_staleness=current_app.config['CACHE_MAX_STALENESS'],
+                             refresher=current_app.extensions['refresher'],
+                             result_cache=current_app.extensions.get('result_cache'),
+                             max_result_age=current_app.config['RESULT_CACHE_MAX_AGE'],
+                             max_incomplete_result_age=current_app.config['RESULT_CACHE_INCOMPLETE_MAX_AGE'],
+                             search_url=current_app.config['SPOTIFY_SEARCH_URL'],
+                             metrics=get_metrics(),
+                             timeout=current_app.config['GENERATOR_MESSAGE_TIMEOUT'])
+
+
+def get_request_deadline():
+    """
+    Returns a new Deadline for generating the playlists of a request
+    """
+    return Deadline(current_app.config['GENERATOR_TIMEOUT'])
+
+
+def get_metrics():
+    return current_app.extensions['metrics']
+
+
+def get_stats():
+    stats = {'redis_pool': connection_pool_stats(current_app.extensions['redis_pool'])}
+    l1_cache = current_app.extensions.get('playlist_l1_cache')
+    if l1_cache is not None:
+        stats['l1_cache'] = l1_cache.stats()
+    return stats
+
+
+def get_metrics_text():
+    """
+    Returns the metrics in the Prometheus text format, with the gauges for the app's pools and caches brought up to date
+    """
+    metrics = get_metrics()
+    stats = get_stats()
+    for state, value in stats['redis_pool'].iteritems():
+        metrics.set_gauge('redis_pool_connections', value, state=state)
+    for stat, value in stats.get('l1_cache', {}).iteritems():
+        metrics.set_gauge('playlist_l1_cache', value, stat=stat)
+    metrics.set_gauge('playlist_pending_revalidations', len(current_app.extensions['refresher'].pending))
+    return metrics.prometheus()
@@ -1,11 +1,11 @@
 import logging.config
 import os
-import re
 
-from flask import Blueprint, send_from_directory, render_template, request
+from flask import Blueprint, current_app, send_from_directory, render_template, request
 
-from autoplaylistpoetry.connections import get_redis_cache
-from playlist.generator import PlaylistGenerator, spotify_uri_to_url, ApiException
+from autoplaylistpoetry.connections import get_playlist_generator, get_request_deadline
+from playlist.generator import spotify_uri_to_url, ApiException
+from playlist.message_tools import split_sentences
 from playlist.plthreading import generate_multiple_playlists_threaded
 
 
@@ -40,24 +40,26 @@ def create():
 
 @web.route('/generate', methods=['POST'])
 def generate():
-    cache = get_redis_cache()
+    deadline = get_request_deadline()
+    generator = get_playlist_generator()
     message = request.form['source-text']
     logger.info("Generating playlist from message: %s", message)
     try:
         if message:
-            messages = [sentence for sentence in re.split(r'[.?!/\n]', message) if len(sentence) > 0]
+            messages = split_sentences(message)
             if len(messages) > 1:
                 # If we have multiple messages, process them concurrently
                 playlist = []
                 incomplete = False
-                results = generate_multiple_playlists_threaded(messages, cache)
+                results = generate_multiple_playlists_threaded(messages, None,
+                                                               pool_size=current_app.config['GENERATOR_POOL_SIZE'],
+                                                               generator=generator, deadline=deadline)
                 for result in results:
                     if result[1]:
                         incomplete = True
                     playlist.extend(result[0])
             else:
-                pl_gen = PlaylistGenerator(cache)
-                playlist, incomplete = pl_gen.generate_playlist(messages[0])
+                playlist, incomplete = generator.generate_playlist(messages[0], deadline=deadline)
 
             if playlist:
                 heading = "This is your playlist"
@@ -0,0 +1,211 @@
+"""
+A local stand-in for the /v1/search endpoint of the Spotify Web API, for benchmarking without hitting the real API.
+
+Whether a title matches a track is decided by a hash of the title, so it's the same on every run and in every process:
+single words match with probability hit_ratio, phrases of multiple words with probability phrase_hit_ratio.
+Responses have a configurable latency and Cache-Control max-age, and conditional requests (If-Modified-Since) are
+answered with a 304 with probability not_modified_ratio. GET /stats returns the number of calls served so far.
+
+Run it on its own, ie. to point the web app at it with SPOTIFY_SEARCH_URL:
+
+    python -m benchmarks.fakespotify --port 8888 --latency 0.05
+"""
+
+__author__ = 'Daan Debie'
+
+import argparse
+import json
+import socket
+import time
+import urlparse
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Lock
+from threading import Thread
+
+DEFAULT_LATENCY = 0.0
+DEFAULT_HIT_RATIO = 0.5
+DEFAULT_PHRASE_HIT_RATIO = 0.05
+DEFAULT_MAX_AGE = 3600
+DEFAULT_NOT_MODIFIED_RATIO = 1.0
+
+
+def chance(value, salt=''):
+    """
+    Returns a number in [0, 1) derived from a hash of the value, the same in every process
+    """
+    return (zlib.crc32(salt + value.encode('utf-8')) & 0xffffffff) / float(2 ** 32)
+
+
+def title_matches(title, hit_ratio=DEFAULT_HIT_RATIO, phrase_hit_ratio=DEFAULT_PHRASE_HIT_RATIO):
+    """
+    Returns whether the stand-in has a track for the title
+    """
+    ratio = hit_ratio if len(title.split()) == 1 else phrase_hit_ratio
+    return chance(title) < ratio
+
+
+def track_uri(title):
+    return 'spotify:track:{:011d}{:011d}'.format(zlib.crc32(title.encode('utf-8')) & 0xffffffff,
+                                                 zlib.crc32(title[::-1].encode('utf-8')) & 0xffffffff)
+
+
+class FakeSpotify(object):
+    """
+    Runs the stand-in on a background thread. Pass port 0 to pick a free port
+    """
+
+    def __init__(self, port=0, latency=DEFAULT_LATENCY, hit_ratio=DEFAULT_HIT_RATIO,
+                 phrase_hit_ratio=DEFAULT_PHRASE_HIT_RATIO, max_age=DEFAULT_MAX_AGE,
+                 not_modified_ratio=DEFAULT_NOT_MODIFIED_RATIO):
+        self.latency = latency
+        self.hit_ratio = hit_ratio
+        self.phrase_hit_ratio = phrase_hit_ratio
+        self.max_age = max_age
+        self.not_modified_ratio = not_modified_ratio
+        self.calls = 0
+        self.conditional_calls = 0
+        self.not_modified = 0
+        self.lock = Lock()
+        self.server = _ThreadingHTTPServer(('127.0.0.1', port), _SearchHandler)
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/v1/search'.format(self.server.server_address[1])
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.close_connections()
+
+    def stats(self):
+        with self.lock:
+            return {'calls': self.calls, 'conditional_calls': self.conditional_calls,
+                    'not_modified': self.not_modified}
+
+    def search(self, title, conditional):
+        """
+        Returns the status code and body of the response to a search
+        """
+        with self.lock:
+            self.calls += 1
+            if conditional:
+                self.conditional_calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if conditional and chance(title, 'not-modified:') < self.not_modified_ratio:
+            with self.lock:
+                self.not_modified += 1
+            return 304, None
+        items = []
+        if title_matches(title, self.hit_ratio, self.phrase_hit_ratio):
+            items.append({'name': title.title(), 'uri': track_uri(title)})
+        return 200, {'tracks': {'items': items}}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 is below the number of concurrent connections of a benchmark. Connections that don't
+    # fit are dropped and retried a second later, which would show up in the measured times
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class):
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.connections = set()
+        self.connections_lock = Lock()
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            self.connections.add(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        with self.connections_lock:
+            self.connections.discard(request)
+        HTTPServer.shutdown_request(self, request)
+
+    def close_connections(self, timeout=1.0):
+        """
+        Closes the kept-alive connections, and waits (at most timeout seconds) for their threads to be done, so they
+        don't outlive the interpreter
+        """
+        with self.connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        give_up = time.time() + timeout
+        while self.connections and time.time() < give_up:
+            time.sleep(0.01)
+
+    def handle_error(self, request, client_address):
+        # Clients going away mid-response, ie. a benchmark that timed out, are no reason for a traceback
+        pass
+
+
+class _SearchHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real API, so pooled connections get reused
+    protocol_version = 'HTTP/1.1'
+    # Headers are written line by line, which would otherwise wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse.urlparse(self.path)
+        if url.path == '/stats':
+            return self._respond(200, fake.stats())
+        if url.path != '/v1/search':
+            return self._respond(404, {'error': 'not found'})
+        query = urlparse.parse_qs(url.query).get('q', [''])[0].decode('utf-8')
+        status, body = fake.search(query, 'If-Modified-Since' in self.headers)
+        self._respond(status, body)
+
+    def _respond(self, status, body):
+        content = json.dumps(body) if body is not None else ''
+        self.send_response(status)
+        self.send_header('Cache-Control', 'public, max-age={}'.format(self.server.fake.max_age))
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Spotify search API")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--latency", help="Seconds per response", type=float, default=DEFAULT_LATENCY)
+    parser.add_argument("--hit-ratio", help="Share of single words that match a track", type=float,
+                        default=DEFAULT_HIT_RATIO)
+    parser.add_argument("--phrase-hit-ratio", help="Share of phrases that match a track", type=float,
+                        default=DEFAULT_PHRASE_HIT_RATIO)
+    parser.add_argument("--max-age", help="max-age of the Cache-Control header", type=int, default=DEFAULT_MAX_AGE)
+    parser.add_argument("--not-modified-ratio", help="Share of conditional requests answered with a 304", type=float,
+                        default=DEFAULT_NOT_MODIFIED_RATIO)
+    args = parser.parse_args()
+
+    fake = FakeSpotify(args.port, args.latency, args.hit_ratio, args.phrase_hit_ratio, args.max_age,
+                       args.not_modified_ratio)
+    print "Serving on {}".format(fake.url)
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
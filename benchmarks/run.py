@@ -0,0 +1,237 @@
+"""
+Benchmarks playlist generation against the local Spotify stand-in. For every combination of message length, cache
+backend and path, a batch of messages is generated twice: once with a cold cache and once more with the cache as the
+first pass left it. Reported are the API calls made (and of the second pass, how many were conditional and how many
+of those got a 304), the wall time of both passes, and the peak memory of the process running them. Every combination
+runs in a fresh process.
+
+Paths:
+    segment     segmenting in memory only, with the stand-in's answers but without any API calls or cache
+    naive       the messages one after the other (generate_multiple_playlists_naive)
+    threaded    the messages concurrently (generate_multiple_playlists_threaded)
+    batch       all messages at once, resolving their titles together (PlaylistGenerator.generate_playlists)
+    processes   the messages on worker processes (generate_multiple_playlists_multiprocess), sharing the cache
+                through Redis or, for mem, through a manager process. Peak memory is of the parent process only
+
+Cache backends: none, mem (MemPlaylistCache), redis (a RedisPlaylistCache on a db that gets flushed) and fakeredis
+(a RedisPlaylistCache on fakeredis, if installed; it isn't thread-safe and can't be shared between processes, so
+it's left out of the threaded and processes paths).
+
+Usage:
+
+    python -m benchmarks.run --lengths 5,10,20 --backends none,mem,redis --latency 0.01
+"""
+
+__author__ = 'Daan Debie'
+
+import argparse
+import json
+import random
+import resource
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Process
+from multiprocessing import Queue
+
+import requests
+
+from benchmarks.fakespotify import DEFAULT_HIT_RATIO
+from benchmarks.fakespotify import DEFAULT_MAX_AGE
+from benchmarks.fakespotify import DEFAULT_NOT_MODIFIED_RATIO
+from benchmarks.fakespotify import DEFAULT_PHRASE_HIT_RATIO
+from benchmarks.fakespotify import FakeSpotify
+from benchmarks.fakespotify import title_matches
+from playlist.cache import MemPlaylistCache
+from playlist.cache import PlaylistItem
+from playlist.generator import ENGINE_DP
+from playlist.generator import PlaylistGenerator
+from playlist.generator import max_chunk_length_for
+from playlist.generator import normalise_message
+from playlist.generator import segment_message
+from playlist.plprocessing import GeneratorProcessPool
+from playlist.plprocessing import generate_multiple_playlists_multiprocess
+from playlist.plthreading import generate_multiple_playlists_naive
+from playlist.plthreading import generate_multiple_playlists_threaded
+from playlist.rediscache import RedisPlaylistCache
+from playlist.session import SpotifySession
+
+BACKENDS = ('none', 'mem', 'redis', 'fakeredis')
+PATHS = ('segment', 'naive', 'threaded', 'batch', 'processes')
+
+VOCABULARY = """
+    i you me we my your love baby heart night day time go come let it be the a to of in on all now never
+    want need know feel say tell take give hold stay run fall dance dream light fire rain sun moon star
+    home road world life way back down up out away again tonight forever yesterday tomorrow together
+    good bad crazy wild young free lonely sweet little big hey oh yeah no don't can't won't i'm you're
+""".split()
+
+
+def make_messages(count, length, seed=0):
+    """
+    Returns count messages of length words each, the same ones for the same arguments
+    """
+    generator = random.Random(seed)
+    return [' '.join(generator.choice(VOCABULARY) for _ in xrange(length)) for _ in xrange(count)]
+
+
+def make_cache(backend, args):
+    if backend == 'mem':
+        return MemPlaylistCache()
+    if backend == 'redis':
+        cache = RedisPlaylistCache(args.redis_host, args.redis_port, args.redis_db)
+    elif backend == 'fakeredis':
+        import fakeredis
+        cache = RedisPlaylistCache()
+        cache.database = fakeredis.FakeStrictRedis()
+    else:
+        return None
+    cache.database.flushdb()
+    return cache
+
+
+def peak_memory():
+    """ Peak resident memory of this process, in megabytes """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def server_stats(url):
+    return requests.get(url.replace('/v1/search', '/stats')).json()
+
+
+def make_process_pool(backend, url, args):
+    redis = None
+    if backend == 'redis':
+        redis = {'host': args.redis_host, 'port': args.redis_port, 'database': args.redis_db}
+    return GeneratorProcessPool(args.workers, redis, backend == 'mem', args.engine, search_url=url)
+
+
+def run_path(path, generator, messages, args, pool=None):
+    if path == 'segment':
+        now = datetime.utcnow()
+        for message in messages:
+            message = normalise_message(message)
+            # Resolve titles the way the stand-in would, without asking it
+            segment_message(message, lambda title: _local_item(title, args, now), max_chunk_length_for(message),
+                            args.engine)
+    elif path == 'naive':
+        generate_multiple_playlists_naive(messages, None, generator=generator)
+    elif path == 'threaded':
+        generate_multiple_playlists_threaded(messages, None, pool_size=args.workers, generator=generator)
+    elif path == 'batch':
+        generator.generate_playlists([(message, False) for message in messages])
+    elif path == 'processes':
+        generate_multiple_playlists_multiprocess(messages, pool)
+
+
+def _local_item(title, args, now):
+    if title_matches(title, args.hit_ratio, args.phrase_hit_ratio):
+        return PlaylistItem(title, title, now, now)
+    return None
+
+
+def run_case(args, url, length, backend, path, results):
+    """
+    Runs both passes of one combination, in a process of its own, and puts the measurements on the results queue
+    """
+    messages = make_messages(args.messages, length, args.seed)
+    cache = make_cache(backend, args)
+    session = SpotifySession(pool_size=args.workers)
+    generator = PlaylistGenerator(cache, args.engine, prefetch_workers=args.workers, session=session, search_url=url)
+    # Started up front, so starting the workers isn't part of the cold pass
+    pool = make_process_pool(backend, url, args) if path == 'processes' else None
+    measurement = {'length': length, 'backend': backend, 'path': path, 'start_memory': peak_memory()}
+    for run in ('cold', 'warm'):
+        before = server_stats(url)
+        start = time.time()
+        run_path(path, generator, messages, args, pool)
+        measurement[run + '_time'] = time.time() - start
+        after = server_stats(url)
+        measurement[run + '_calls'] = after['calls'] - before['calls']
+        measurement[run + '_conditional'] = after['conditional_calls'] - before['conditional_calls']
+        measurement[run + '_not_modified'] = after['not_modified'] - before['not_modified']
+    measurement['peak_memory'] = peak_memory()
+    if pool:
+        pool.close()
+    results.put(measurement)
+
+
+def print_report(measurements):
+    header = "{:>6} {:>9} {:>9} | {:>10} {:>9} | {:>10} {:>11} {:>6} {:>9} | {:>8}".format(
+        'words', 'backend', 'path', 'cold calls', 'cold s', 'warm calls', 'conditional', '304s', 'warm s', 'peak MB')
+    print header
+    print '-' * len(header)
+    for m in measurements:
+        if 'error' in m:
+            print "{:>6} {:>9} {:>9} | {}".format(m['length'], m['backend'], m['path'], m['error'])
+            continue
+        print "{:>6} {:>9} {:>9} | {:>10} {:>9.3f} | {:>10} {:>11} {:>6} {:>9.3f} | {:>8.1f}".format(
+            m['length'], m['backend'], m['path'], m['cold_calls'], m['cold_time'], m['warm_calls'],
+            m['warm_conditional'], m['warm_not_modified'], m['warm_time'], m['peak_memory'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark playlist generation against a local Spotify stand-in")
+    parser.add_argument("--lengths", help="Comma-separated message lengths, in words", default='5,10,20')
+    parser.add_argument("--backends", help="Comma-separated cache backends: " + ', '.join(BACKENDS),
+                        default='none,mem,redis')
+    parser.add_argument("--paths", help="Comma-separated paths: " + ', '.join(PATHS), default=','.join(PATHS))
+    parser.add_argument("--messages", help="Number of messages per batch", type=int, default=20)
+    # The chunker backtracks, which takes exponential time on long messages that can't be covered completely
+    parser.add_argument("--engine", help="Segmentation engine", default=ENGINE_DP)
+    parser.add_argument("--workers", help="Concurrent API calls and messages, and worker processes", type=int,
+                        default=8)
+    parser.add_argument("--seed", help="Seed for generating messages", type=int, default=0)
+    parser.add_argument("--timeout", help="Seconds allowed per combination", type=float, default=300)
+    parser.add_argument("--latency", help="Seconds per API response", type=float, default=0.01)
+    parser.add_argument("--hit-ratio", help="Share of single words that match a track", type=float,
+                        default=DEFAULT_HIT_RATIO)
+    parser.add_argument("--phrase-hit-ratio", help="Share of phrases that match a track", type=float,
+                        default=DEFAULT_PHRASE_HIT_RATIO)
+    parser.add_argument("--max-age", help="Seconds API responses may be cached; 0 makes the warm pass revalidate",
+                        type=int, default=DEFAULT_MAX_AGE)
+    parser.add_argument("--not-modified-ratio", help="Share of conditional requests answered with a 304", type=float,
+                        default=DEFAULT_NOT_MODIFIED_RATIO)
+    parser.add_argument("--redis-host", default='localhost')
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-db", help="Redis db to use; it's flushed!", type=int, default=15)
+    parser.add_argument("--json", help="Write the measurements to this file as JSON")
+    args = parser.parse_args()
+
+    fake = FakeSpotify(0, args.latency, args.hit_ratio, args.phrase_hit_ratio, args.max_age,
+                       args.not_modified_ratio).start()
+    measurements = []
+    try:
+        for length in [int(length) for length in args.lengths.split(',')]:
+            for path in args.paths.split(','):
+                # Segmenting in memory doesn't touch the cache, and fakeredis isn't thread-safe
+                backends = ['none'] if path == 'segment' else args.backends.split(',')
+                if path in ('threaded', 'processes'):
+                    backends = [backend for backend in backends if backend != 'fakeredis']
+                for backend in backends:
+                    results = Queue()
+                    process = Process(target=run_case, args=(args, fake.url, length, backend, path, results))
+                    process.start()
+                    process.join(args.timeout)
+                    if process.is_alive():
+                        process.terminate()
+                        measurement = {'length': length, 'backend': backend, 'path': path, 'error': 'timed out'}
+                    elif process.exitcode:
+                        measurement = {'length': length, 'backend': backend, 'path': path,
+                                       'error': 'failed ({})'.format(process.exitcode)}
+                    else:
+                        measurement = results.get()
+                    measurements.append(measurement)
+                    sys.stderr.write('.')
+        sys.stderr.write('\n')
+    finally:
+        fake.stop()
+
+    print_report(measurements)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(measurements, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
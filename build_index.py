@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""
+Builds or updates the title index that the generators consult before the cache and the Spotify API.
+Entries come from exported search results (JSON lines) and/or from the items in a Redis cache.
+By default, the entries are merged into the existing index; use --full to build it from scratch.
+
+"""
+
+__author__ = 'Daan Debie'
+
+import argparse
+import sys
+from itertools import chain
+
+from playlist.rediscache import RedisPlaylistCache
+from playlist.titleindex import DEFAULT_TTL
+from playlist.titleindex import TitleIndex
+from playlist.titleindex import entries_from_export
+from playlist.titleindex import fresh_for
+from playlist.titleindex import update_index
+from playlist.titleindex import write_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an index of titles for resolving them without the Spotify API")
+    parser.add_argument("index", help="Path of the index file")
+    parser.add_argument("-e", "--export", help="File with exported search results ('-' for stdin)", action='append',
+                        default=[])
+    parser.add_argument("-r", "--redis", help="Add the items in the Redis cache", action='store_true')
+    parser.add_argument("-s", "--server", help="Hostname of Redis instance", default='localhost')
+    parser.add_argument("-p", "--port", help="Port of Redis instance", type=int, default=6379)
+    parser.add_argument("-d", "--database", help="Redis db to use", type=int, default=0)
+    parser.add_argument("-w", "--password", help="Redis password to use")
+    parser.add_argument("-m", "--misses", help="Also add titles known not to match any track", action='store_true')
+    parser.add_argument("-f", "--full", help="Rebuild the index instead of updating it", action='store_true')
+    parser.add_argument("-t", "--ttl", help="Seconds the added items stay fresh for, which bounds how long results "
+                                            "using them are cached", type=int, default=DEFAULT_TTL)
+    args = parser.parse_args()
+
+    if not args.export and not args.redis:
+        parser.error("Nothing to index: pass --export and/or --redis")
+
+    sources = []
+    for path in args.export:
+        export = sys.stdin if path == '-' else open(path)
+        sources.append(entries_from_export(export, args.ttl))
+    if args.redis:
+        cache = RedisPlaylistCache(args.server, args.port, args.database, args.password)
+        sources.append(cache.scan(args.misses))
+    # Items from Redis keep the expiry of the search result they came from, which may have passed already
+    entries = fresh_for(chain(*sources), args.ttl)
+    if not args.misses:
+        entries = ((title, item) for title, item in entries if item)
+
+    if args.full:
+        write_index(args.index, entries)
+    else:
+        update_index(args.index, entries)
+
+    index = TitleIndex(args.index)
+    print "Index {} holds {} titles".format(args.index, len(index))
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,8 @@
 
 """
 A simple Command Line utility to generate Spotify playlists based on a passed message.
-Can be used for one-off invocations or as an interactive shell script.
+Can be used for one-off invocations, as an interactive shell script, or in batch mode for turning files (or stdin)
+with a message per line into JSON lines.
 Also allows the use of Redis as a caching mechanism.
 
 """
@@ -10,14 +11,34 @@ Also allows the use of Redis as a caching mechanism.
 __author__ = 'Daan Debie'
 
 import argparse
+import atexit
+import fileinput
+import json
+import os
 import sys
-import re
+from collections import deque
 from playlist.generator import PlaylistGenerator
 from playlist.generator import spotify_uri_to_url
 from playlist.cache import MemPlaylistCache
+from playlist.checkpoint import read_checkpoint
+from playlist.checkpoint import write_checkpoint
 from playlist.rediscache import RedisPlaylistCache
+from playlist.resultcache import MemResultCache, RedisResultCache
 from playlist.generator import ApiException
+from playlist.message_tools import split_sentences
+from playlist.plthreading import MAX_WAIT
+from playlist.plprocessing import GeneratorProcessPool
+from playlist.plprocessing import generate_multiple_playlists_multiprocess
 from playlist.plthreading import generate_multiple_playlists_threaded
+from playlist.session import DEFAULT_POOL_SIZE
+from playlist.session import SpotifySession
+from playlist.ratelimit import TokenBucket, RedisTokenBucket
+from playlist.titleindex import TitleIndex
+from playlist.metrics import get_default_metrics
+from playlist.workers import get_pool
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHECKPOINT_EVERY = 1000
 
 
 def main():
@@ -25,6 +46,8 @@ def main():
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("-m", "--message", help="The message you want turned into a playlist")
     group.add_argument("-i", "--interactive", help="Run this script in interactive mode",  action='store_true')
+    group.add_argument("-b", "--batch", help="Run this script in batch mode, on the messages in these files (one per "
+                                             "line, stdin if none)", nargs='*', metavar='FILE')
     parser.add_argument("-v", "--verbose", help="increase output verbosity",  action='store_true')
     parser.add_argument("-u", "--url", help="use Spotify web url instead of uri",  action='store_true')
     parser.add_argument("-r", "--redis", help="use Redis for caching",  action='store_true')
@@ -32,32 +55,84 @@ def main():
     parser.add_argument("-p", "--port", help="Port of Redis instance", type=int, default=6379)
     parser.add_argument("-d", "--database", help="Redis db to use", type=int, default=0)
     parser.add_argument("-w", "--password", help="Redis password to use")
+    parser.add_argument("-l", "--rate-limit", help="Maximum number of Spotify API calls per second", type=float)
+    parser.add_argument("-x", "--index", help="Title index (see build_index.py) to consult before the API")
+    parser.add_argument("-t", "--timeout", help="Seconds allowed per sentence, after which the best partial playlist "
+                                                "so far is used", type=float)
+    parser.add_argument("-P", "--processes", help="Generate the sentences of a message on this many worker processes "
+                                                  "instead of threads, for long messages", type=int)
+    parser.add_argument("-o", "--output", help="In batch mode, file to write the results to (stdout if none)")
+    parser.add_argument("-c", "--concurrency", help="In batch mode, number of messages generated concurrently",
+                        type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("-k", "--checkpoint", help="In batch mode, file to keep track of progress in, for resuming. "
+                                                   "Requires --output")
+    parser.add_argument("--checkpoint-every", help="In batch mode, number of lines between checkpoints",
+                        type=int, default=DEFAULT_CHECKPOINT_EVERY)
+    parser.add_argument("--stats", help="print a summary of cache lookups, API calls and their timings to stderr "
+                                        "before exiting", action='store_true')
     args = parser.parse_args()
+    batch = args.batch is not None
+    if args.checkpoint and not args.output:
+        parser.error("--checkpoint requires --output")
+    if args.processes and batch:
+        parser.error("--processes can't be used in batch mode, which runs on --concurrency threads")
+
+    if args.stats:
+        # Also when exiting because of an API error
+        atexit.register(print_stats)
 
     if args.redis:
         cache = RedisPlaylistCache(args.server, args.port, args.database, args.password)
-    elif args.interactive:
+        result_cache = RedisResultCache(cache.database)
+    elif args.interactive or batch:
         cache = MemPlaylistCache()
+        result_cache = MemResultCache()
     else:
         # If user doesn't want Redis cache, and uses the script for processing one message, in-memory caching is useless
         cache = None
+        result_cache = None
+
+    if args.rate_limit and args.redis:
+        # Share the rate limit with any other process using the same Redis instance
+        rate_limiter = RedisTokenBucket(cache.database, args.rate_limit)
+    elif args.rate_limit:
+        rate_limiter = TokenBucket(args.rate_limit)
+    else:
+        rate_limiter = None
+    # In batch mode, every message being generated can have an API call in flight
+    session = SpotifySession(pool_size=max(args.concurrency, DEFAULT_POOL_SIZE) if batch else DEFAULT_POOL_SIZE,
+                             rate_limiter=rate_limiter)
+    title_index = TitleIndex(args.index) if args.index else None
+    generator = PlaylistGenerator(cache, session=session, title_index=title_index, result_cache=result_cache,
+                                  timeout=args.timeout)
+
+    if args.processes:
+        # The workers share the cache through Redis, or otherwise through a process of its own
+        redis = dict(host=args.server, port=args.port, database=args.database, password=args.password)
+        pool = GeneratorProcessPool(args.processes, redis if args.redis else None, shared_memory=not args.redis,
+                                    timeout=args.timeout, rate_limit=args.rate_limit, title_index_path=args.index)
+        atexit.register(pool.close)
+        generate_multiple = lambda messages: generate_multiple_playlists_multiprocess(messages, pool)
+    else:
+        generate_multiple = lambda messages: generate_multiple_playlists_threaded(messages, cache, generator=generator)
 
-    if not args.interactive:
+    if batch:
+        run_batch(args, generator)
+    elif not args.interactive:
         try:
             # Split sentences into separate messages
-            messages = [message for message in re.split(r'[.?!/\n]', args.message) if len(message) > 0]
+            messages = split_sentences(args.message)
             if len(messages) > 1:
                 # If we have multiple messages, process them concurrently
                 playlist = []
                 incomplete = False
-                results = generate_multiple_playlists_threaded(messages, cache)
+                results = generate_multiple(messages)
                 for result in results:
                     if result[1]:
                         incomplete = True
                     playlist.extend(result[0])
             else:
-                pl_gen = PlaylistGenerator(cache)
-                playlist, incomplete = pl_gen.generate_playlist(messages[0])
+                playlist, incomplete = generator.generate_playlist(messages[0])
             if playlist:
                 if incomplete and args.verbose:
                     print "Only partial playlist available:"
@@ -88,19 +163,18 @@ def main():
             try:
                 print "Processing..."
                 # Split sentences into separate messages
-                messages = [message for message in re.split(r'[.?!/\n]', message) if len(message) > 0]
+                messages = split_sentences(message)
                 if len(messages) > 1:
                     # If we have multiple messages, process them concurrently
                     playlist = []
                     incomplete = False
-                    results = generate_multiple_playlists_threaded(messages, cache)
+                    results = generate_multiple(messages)
                     for result in results:
                         if result[1]:
                             incomplete = True
                         playlist.extend(result[0])
                 else:
-                    pl_gen = PlaylistGenerator(cache)
-                    playlist, incomplete = pl_gen.generate_playlist(messages[0])
+                    playlist, incomplete = generator.generate_playlist(messages[0])
                 if playlist:
                     if incomplete and args.verbose:
                         print "Only partial playlist available:"
@@ -118,6 +192,117 @@ def main():
                 sys.exit("An API error occured({})! Exiting...".format(str(e.status)))
 
 
+def run_batch(args, generator):
+    """
+    Generates a playlist for every line of the input files, writing one JSON object per line to the output, in the
+    same order. Lines are read and results written as they go, with at most a few lines per worker in flight, so any
+    number of lines can be processed. With a checkpoint file, an interrupted run resumes where it left off
+    """
+    output = BatchOutput(args.output, args.checkpoint, args.verbose)
+    pool = get_pool('batch', args.concurrency)
+    lines = fileinput.FileInput(args.batch)
+    pending = deque()
+    line_number = 0
+
+    def write_next():
+        number, result = pending.popleft()
+        # Waiting on a result without a timeout can't be interrupted with Ctrl-C in Python 2
+        while not result.ready():
+            result.wait(MAX_WAIT)
+        output.write(number, result.get())
+        if number % args.checkpoint_every == 0:
+            output.checkpoint()
+
+    try:
+        for line in lines:
+            line_number += 1
+            if line_number <= output.lines_done:
+                continue
+            pending.append((line_number, pool.apply_async(generate_line, (generator, line))))
+            if len(pending) >= 4 * args.concurrency:
+                write_next()
+        while pending:
+            write_next()
+    except ApiException as e:
+        sys.exit("An API error occured({})! Rerun to resume".format(str(e.status)))
+    except KeyboardInterrupt:
+        sys.exit("Interrupted! Rerun to resume")
+    finally:
+        lines.close()
+        output.close()
+
+
+def generate_line(generator, line):
+    """
+    Generates the playlist for a line, the same way a message passed with -m is. Returns the JSON object for it
+    """
+    messages = [message for message in split_sentences(line) if message.strip()]
+    if not messages:
+        return {'error': True, 'message': "No message provided!"}
+    playlist = []
+    incomplete = False
+    for message in messages:
+        message_playlist, message_incomplete = generator.generate_playlist(message, len(messages) > 1)
+        playlist.extend(message_playlist)
+        incomplete = incomplete or message_incomplete
+    if not playlist:
+        return {'error': True, 'message': "Not able to generate playlist!"}
+    return {'success': True, 'partial': incomplete,
+            'playlist': [{'name': item.name, 'uri': item.uri, 'url': spotify_uri_to_url(item.uri)}
+                         for item in playlist]}
+
+
+class BatchOutput(object):
+    """
+    The output of batch mode: a file (or stdout) with a JSON object per line. With a checkpoint file, the number of
+    lines done and the size of the output at that point are recorded, so a rerun can truncate the output to what was
+    written up to the checkpoint, and append to it from there
+    """
+
+    def __init__(self, path, checkpoint_path, verbose=False):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.verbose = verbose
+        # The number of lines done, and the size of the output by then
+        self.lines_done, self.offset = read_checkpoint(checkpoint_path, 2)
+        if not path:
+            self.file = sys.stdout
+        elif not self.lines_done:
+            self.file = open(path, 'w')
+        elif not os.path.exists(path):
+            sys.exit("Output file {} is missing, remove the checkpoint to start over".format(path))
+        else:
+            sys.stderr.write("Resuming after line {}\n".format(self.lines_done))
+            self.file = open(path, 'r+')
+            self.file.truncate(self.offset)
+            self.file.seek(0, os.SEEK_END)
+
+    def write(self, line_number, record):
+        record['line'] = line_number
+        data = json.dumps(record) + '\n'
+        self.file.write(data)
+        # So whoever reads the output, ie. through a pipe, gets every result as soon as it's there
+        self.file.flush()
+        self.lines_done = line_number
+        self.offset += len(data)
+
+    def checkpoint(self):
+        self.file.flush()
+        if self.path:
+            os.fsync(self.file.fileno())
+        write_checkpoint(self.checkpoint_path, self.lines_done, self.offset)
+        if self.verbose:
+            sys.stderr.write("{} lines done\n".format(self.lines_done))
+
+    def close(self):
+        self.checkpoint()
+        if self.path:
+            self.file.close()
+
+
+def print_stats():
+    sys.stderr.write(get_default_metrics().summary() + '\n')
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
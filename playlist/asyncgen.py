@@ -0,0 +1,413 @@
+"""
+Asynchronous playlist generation. Python 2 has no asyncio, so this is built on Tornado coroutines and its
+AsyncHTTPClient: a single IOLoop can have the searches of many sentences and many requests in flight at once,
+without a thread per sentence
+"""
+
+__author__ = 'Daan Debie'
+
+import json
+import logging
+import urllib
+from abc import ABCMeta
+from abc import abstractmethod
+from datetime import timedelta
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPRequest
+from tornado.ioloop import IOLoop
+
+from cache import PlaylistItem
+from cache import http_datestring_from_datetime
+from deadline import Deadline
+from deadline import DeadlineExceeded
+from generator import ApiException
+from generator import ENGINE_CHUNKER
+from generator import SEGMENT_GRACE
+from generator import SPOTIFY_API_SEARCH_TRACK_URL
+from generator import VALID_API_STATUSCODES
+from generator import expires_from_headers
+from generator import item_from_search_result
+from generator import max_chunk_length_for
+from generator import normalise_message
+from generator import segment_wave
+from ratelimit import RedisTokenBucket
+from rediscache import RedisPlaylistCache
+from session import DEFAULT_BACKOFF_FACTOR
+from session import DEFAULT_MAX_RETRIES
+from session import RETRY_STATUSCODES
+from session import retry_after_seconds
+from session import retry_delay
+
+DEFAULT_MAX_CLIENTS = 100
+DEFAULT_CACHE_WORKERS = 4
+DEFAULT_RATE_LIMITER_WORKERS = 2
+# Tornado reports connection errors and timeouts with this status code
+CONNECTION_ERROR_STATUSCODE = 599
+
+logger = logging.getLogger(__name__)
+
+# Stands in for the result of a future that wasn't done before the deadline
+_UNRESOLVED = object()
+
+
+def _completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _run_on(executor, function, *args):
+    """
+    Calls the function on the executor, or right away when there is none. Returns a Future for its result
+    """
+    if executor:
+        # Unlike executor.submit, this returns a Future that is resolved on the IOLoop's own thread
+        return IOLoop.current().run_in_executor(executor, function, *args)
+    return _completed_future(function(*args))
+
+
+@gen.coroutine
+def _within(deadline, future):
+    """
+    Resolves to the result of the future, or raises DeadlineExceeded if the deadline passes first
+    """
+    if not deadline:
+        result = yield future
+        raise gen.Return(result)
+    try:
+        result = yield gen.with_timeout(timedelta(seconds=deadline.timeout()), future)
+    except gen.TimeoutError:
+        raise DeadlineExceeded()
+    raise gen.Return(result)
+
+
+@gen.coroutine
+def _unless_late(future):
+    """
+    Resolves to the result of the future, or to _UNRESOLVED if it ran out of time
+    """
+    try:
+        result = yield future
+    except DeadlineExceeded:
+        raise gen.Return(_UNRESOLVED)
+    raise gen.Return(result)
+
+
+@gen.coroutine
+def _before(deadline, futures):
+    """
+    Resolves to the results of all futures, like yielding the list of them would. With a deadline, it resolves when
+    the deadline passes at the latest, with _UNRESOLVED in place of the results of the futures that weren't done or
+    ran out of time. Any other exception of a future is raised; futures that fail after the deadline are logged
+    """
+    if not deadline or not futures:
+        results = yield futures
+        raise gen.Return(results)
+    futures = [_unless_late(future) for future in futures]
+    try:
+        results = yield gen.with_timeout(timedelta(seconds=deadline.remaining()), gen.multi(futures))
+    except gen.TimeoutError:
+        results = [future.result() if future.done() else _UNRESOLVED for future in futures]
+    raise gen.Return(results)
+
+
+class AsyncPlaylistCache(object):
+    """
+    Abstract Base Class for caches with an asynchronous interface. All methods return Futures, and work on many
+    titles at once, so resolving a wave of titles takes a fixed number of cache round trips
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def get_many(self, keys):
+        """ Get multiple PlaylistItems from the cache, as a dictionary containing only the keys that were found """
+        pass
+
+    @abstractmethod
+    def put_many(self, items):
+        """ Put all PlaylistItems in a dictionary in the cache """
+        pass
+
+    @abstractmethod
+    def get_misses(self, keys):
+        """ Get the set of titles that are known not to match any track """
+        pass
+
+    @abstractmethod
+    def put_misses(self, keys, ttl=None):
+        """ Remember that none of the titles match a track """
+        pass
+
+    @abstractmethod
+    def remove(self, key):
+        """ Remove a PlaylistItem from cache """
+        pass
+
+
+class AsyncCacheAdapter(AsyncPlaylistCache):
+    """
+    Gives any PlaylistCache an asynchronous interface. Operations run on the given executor, or right away when
+    there is none, which is the right choice for in-memory caches that never block
+    """
+
+    def __init__(self, cache, executor=None):
+        self.cache = cache
+        self.executor = executor
+
+    def get_many(self, keys):
+        return self._run(self.cache.get_many, keys)
+
+    def put_many(self, items):
+        return self._run(self.cache.put_many, items)
+
+    def get_misses(self, keys):
+        return self._run(self.cache.get_misses, keys)
+
+    def put_misses(self, keys, ttl=None):
+        return self._run(self.cache.put_misses, keys, ttl)
+
+    def remove(self, key):
+        return self._run(self.cache.remove, key)
+
+    def _run(self, function, *args):
+        return _run_on(self.executor, function, *args)
+
+
+class AsyncRedisPlaylistCache(AsyncCacheAdapter):
+    """
+    Asynchronous Redis cache. The pipelined bulk operations of RedisPlaylistCache run on a small pool of threads;
+    since every operation covers a whole message, a few threads serve a large number of in-flight messages
+    """
+
+    def __init__(self, host='localhost', port=6379, database=0, password=None, max_workers=DEFAULT_CACHE_WORKERS,
+                 connection_pool=None):
+        AsyncCacheAdapter.__init__(self, RedisPlaylistCache(host, port, database, password,
+                                                            connection_pool=connection_pool),
+                                   ThreadPoolExecutor(max_workers))
+
+
+class AsyncPlaylistGenerator(object):
+    """
+    Asynchronous counterpart of PlaylistGenerator. Generating a playlist is a coroutine that segments the message in
+    memory, resolving its titles concurrently in waves like a PlaylistGenerator with prefetch does (cache first,
+    then non-blocking searches). The number of concurrent searches is bounded by max_clients of the AsyncHTTPClient,
+    and optionally by a RateLimiter. A RedisTokenBucket is called on a few threads of its own (or on
+    rate_limiter_executor), so its round trips don't block the IOLoop. Retries follow the same policy as the
+    SpotifySession. An optional TitleIndex is consulted before the cache and the API.
+    Generating can be given a Deadline, which bounds the searches, retries and rate limiter waits. Titles that aren't
+    resolved by then are left out, so the best (incomplete) playlist that can be made from the others is returned
+    """
+
+    def __init__(self, cache=None, engine=ENGINE_CHUNKER, http_client=None, max_clients=DEFAULT_MAX_CLIENTS,
+                 rate_limiter=None, max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 timeout=None, title_index=None, search_url=SPOTIFY_API_SEARCH_TRACK_URL, rate_limiter_executor=None):
+        self.cache = cache
+        self.title_index = title_index
+        self.search_url = search_url
+        if self.cache and not isinstance(self.cache, AsyncPlaylistCache):
+            raise AttributeError
+        self.engine = engine
+        self.http_client = http_client or AsyncHTTPClient(force_instance=True, max_clients=max_clients)
+        self.rate_limiter = rate_limiter
+        if not rate_limiter_executor and isinstance(rate_limiter, RedisTokenBucket):
+            rate_limiter_executor = ThreadPoolExecutor(DEFAULT_RATE_LIMITER_WORKERS)
+        # None for rate limiters in this process, which never block
+        self.rate_limiter_executor = rate_limiter_executor
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        # Searches in flight per title, so concurrent messages on the loop share them
+        self.in_flight = {}
+
+    @gen.coroutine
+    def generate_playlist(self, message, use_max_chunk_length=False, deadline=None):
+        """
+        Generates a Spotify playlist based on a passed message, within the deadline (if any).
+
+        resolves to a tuple (playlist, incomplete)
+        """
+
+        message = normalise_message(message)
+        pending = {message: (message, max_chunk_length_for(message, use_max_chunk_length))}
+        known = {}
+        # Segmenting in memory may take a little longer, so the titles that were resolved in time still get used
+        segment_deadline = Deadline.at(deadline.expires_at + SEGMENT_GRACE) if deadline else None
+        while True:
+            done, wanted = segment_wave(pending, known, self.engine, deadline=segment_deadline)
+            if done:
+                raise gen.Return(done[message])
+            resolved = yield self.resolve_titles(list(wanted), deadline)
+            known.update(resolved)
+            # Titles are only left out when they couldn't be resolved in time
+            if len(resolved) < len(wanted):
+                done, _ = segment_wave(pending, known, self.engine, deadline=segment_deadline, last=True)
+                raise gen.Return(done[message])
+
+    @gen.coroutine
+    def generate_multiple_playlists(self, list_of_messages, deadline=None):
+        """
+        Generates playlists for all messages concurrently, within the deadline (if any). Resolves to a list of
+        (playlist, incomplete) tuples, in the same order as the messages
+        """
+
+        results = yield [self.generate_playlist(message, True, deadline) for message in list_of_messages]
+        raise gen.Return(results)
+
+    @gen.coroutine
+    def resolve_titles(self, titles, deadline=None):
+        """
+        Resolves to a dictionary mapping every title to its PlaylistItem, or None if there is no track with that title.
+        Titles that couldn't be resolved before the deadline are left out
+        """
+
+        indexed = self.title_index.get_many(titles) if self.title_index else {}
+        titles = [title for title in titles if title not in indexed]
+        if self.cache:
+            cached_items = yield self.cache.get_many(titles)
+            misses = yield self.cache.get_misses([title for title in titles if title not in cached_items])
+        else:
+            cached_items, misses = {}, set()
+
+        expired_titles = [title for title in titles if title in cached_items and cached_items[title].is_expired()]
+        revalidated = yield _before(deadline, [self._revalidate(title, cached_items[title], deadline)
+                                               for title in expired_titles])
+        # Titles that couldn't be revalidated in time aren't searched for either, there's no time left for that
+        unresolved = set()
+        for title, item in zip(expired_titles, revalidated):
+            if item is _UNRESOLVED:
+                unresolved.add(title)
+                del cached_items[title]
+            else:
+                # None if the title doesn't match a track anymore, which _revalidate stored as a miss already
+                cached_items[title] = item
+
+        resolved = dict((title, None) for title in misses)
+        resolved.update(indexed)
+        resolved.update(cached_items)
+        unknown_titles = [title for title in titles if title not in resolved and title not in unresolved]
+        logger.debug("Fetching %d of %d titles", len(unknown_titles), len(titles))
+        items = yield _before(deadline, [self._fetch_item(title, deadline) for title in unknown_titles])
+        fetched = dict((title, item) for title, item in zip(unknown_titles, items) if item is not _UNRESOLVED)
+        resolved.update(fetched)
+
+        if self.cache:
+            yield [self.cache.put_many(dict((title, item) for title, item in fetched.iteritems() if item)),
+                   self.cache.put_misses([title for title, item in fetched.iteritems() if not item])]
+        raise gen.Return(resolved)
+
+    @gen.coroutine
+    def _fetch_item(self, title, deadline=None):
+        """
+        Does a Spotify search and resolves to the first valid result, sharing the search if one for the same title
+        is already in flight. Like SingleFlight, a shared search that the deadline of another message cut short is
+        done again
+        """
+        while True:
+            future = self.in_flight.get(title)
+            shared = future is not None
+            if not shared:
+                future = self.in_flight[title] = self._search_item(title, deadline)
+                future.add_done_callback(lambda f: self._done_in_flight(title, f))
+            try:
+                item = yield future
+            except DeadlineExceeded:
+                if shared and not (deadline and deadline.expired()):
+                    self._done_in_flight(title, future)
+                    continue
+                raise
+            raise gen.Return(item)
+
+    def _done_in_flight(self, title, future):
+        if self.in_flight.get(title) is future:
+            del self.in_flight[title]
+
+    @gen.coroutine
+    def _search_item(self, title, deadline=None):
+        response = yield self._search(title, deadline=deadline)
+        # Something bad happened with the API that we can't recover from
+        if response.code not in VALID_API_STATUSCODES:
+            raise ApiException(response.code)
+        elif response.code == 404:
+            raise gen.Return(None)
+        raise gen.Return(item_from_search_result(title, response.headers, json.loads(response.body)))
+
+    @gen.coroutine
+    def _revalidate(self, title, cached_item, deadline=None):
+        """
+        Asks the API whether an expired item is still valid, and updates the cache with the answer.
+        Resolves to the item to use from now on, or None if the title doesn't match a track anymore
+        """
+
+        logger.debug("Cache expired for '%s'", title)
+        headers = {'If-Modified-Since': http_datestring_from_datetime(cached_item.last_modified)}
+        response = yield self._search(title, headers, deadline)
+        if response.code not in VALID_API_STATUSCODES:
+            raise ApiException(response.code)
+        # If we get statuscode 304, we can still use the cached item, until the new expiry date
+        if response.code == 304:
+            logger.debug("Cache still valid for '%s'", title)
+            expires = expires_from_headers(response.headers)
+            if not expires:
+                raise gen.Return(cached_item)
+            item = PlaylistItem(cached_item.name, cached_item.uri, cached_item.last_modified, expires)
+            yield self.cache.put_many({title: item})
+            raise gen.Return(item)
+
+        logger.debug("Cache invalidated for '%s'", title)
+        # The response to the conditional request is a regular search result, so there's no need to search again
+        item = item_from_search_result(title, response.headers, json.loads(response.body)) \
+            if response.code == 200 else None
+        if item:
+            yield self.cache.put_many({title: item})
+        else:
+            yield self.cache.remove(title)
+            yield self.cache.put_misses([title])
+        raise gen.Return(item)
+
+    @gen.coroutine
+    def _search(self, title, headers=None, deadline=None):
+        """
+        Resolves to the response to a search, retrying like SpotifySession.get does. With a deadline, the rate limiter
+        and the request are given the time left, and DeadlineExceeded is raised if no response could be had in time
+        """
+        url = self.search_url + '?' + urllib.urlencode({'q': title, 'type': 'track'})
+        attempt = 0
+        while True:
+            if deadline:
+                deadline.check()
+            if self.rate_limiter:
+                wait = yield _within(deadline, _run_on(self.rate_limiter_executor, self.rate_limiter.try_acquire))
+                while wait > 0:
+                    if deadline and wait >= deadline.remaining():
+                        raise DeadlineExceeded()
+                    yield gen.sleep(wait)
+                    wait = yield _within(deadline, _run_on(self.rate_limiter_executor, self.rate_limiter.try_acquire))
+
+            timeout = deadline.timeout(self.timeout) if deadline else self.timeout
+            if deadline and not timeout:
+                # A request_timeout of 0 would mean no timeout at all
+                raise DeadlineExceeded()
+            request = HTTPRequest(url, headers=headers, request_timeout=timeout)
+            response = yield self.http_client.fetch(request, raise_error=False)
+            if response.code == CONNECTION_ERROR_STATUSCODE and deadline and deadline.expired():
+                raise DeadlineExceeded()
+            retryable = response.code in RETRY_STATUSCODES or response.code == CONNECTION_ERROR_STATUSCODE
+            if not retryable or attempt >= self.max_retries:
+                raise gen.Return(response)
+
+            if self.rate_limiter and response.code == 429:
+                yield _within(deadline, _run_on(self.rate_limiter_executor, self.rate_limiter.pause,
+                                                retry_after_seconds(response) or self.backoff_factor))
+            delay = retry_delay(response, attempt, self.backoff_factor)
+            if deadline and delay >= deadline.remaining():
+                # No time to retry, so this is the final response
+                if response.code == CONNECTION_ERROR_STATUSCODE:
+                    raise DeadlineExceeded()
+                raise gen.Return(response)
+            logger.debug("Retrying search for '%s' in %.2f seconds (%s)", title, delay, response.code)
+            yield gen.sleep(delay)
+            attempt += 1
@@ -1,8 +1,22 @@
 __author__ = 'Daan Debie'
 
+import calendar
+# strptime imports this lazily, which isn't thread-safe the first time it's called from multiple threads at once
+import _strptime
 from abc import ABCMeta
 from abc import abstractmethod
+from collections import OrderedDict
 from datetime import datetime
+from datetime import timedelta
+from threading import Lock
+
+# How long (in seconds) a title that didn't match any track is remembered as a miss
+NEGATIVE_CACHE_TTL = 60 * 60
+# How long (in seconds) an expired item is kept around, so it can still be revalidated with If-Modified-Since
+STALE_GRACE_PERIOD = 24 * 60 * 60
+# Default number of entries kept by a MemPlaylistCache, and how often it scans for expired entries
+DEFAULT_MAX_ITEMS = 10000
+PURGE_INTERVAL = timedelta(minutes=1)
 
 
 def datetime_from_http_datestring(datestring):
@@ -12,6 +26,20 @@ def datetime_from_http_datestring(datestring):
     return datetime.strptime(datestring, '%a, %d %b %Y %H:%M:%S %Z')
 
 
+def epoch_from_datetime(dt):
+    """
+    Converts a naive UTC datetime to seconds since the epoch
+    """
+    return calendar.timegm(dt.utctimetuple())
+
+
+def datetime_from_epoch(seconds):
+    """
+    Converts seconds since the epoch to a naive UTC datetime
+    """
+    return datetime.utcfromtimestamp(seconds)
+
+
 def http_datestring_from_datetime(dt):
     # HTTP datetimes are always in TZ GMT
     return dt.strftime('%a, %d %b %Y %H:%M:%S GMT')
@@ -40,8 +68,49 @@ class PlaylistCache(object):
         """ Remove a PlaylistItem from cache """
         pass
 
+    @abstractmethod
+    def put_miss(self, key, ttl=None):
+        """ Remember that a title doesn't match any track, for ttl seconds """
+        pass
+
+    @abstractmethod
+    def is_miss(self, key):
+        """ Check if a title is known not to match any track """
+        pass
+
+    def get_many(self, keys):
+        """
+        Get multiple PlaylistItems from the cache. Returns a dictionary containing only the keys that were found.
+        Subclasses should override this when they can do better than one get per key
+        """
+        items = {}
+        for key in keys:
+            item = self.get(key)
+            if item:
+                items[key] = item
+        return items
 
-class PlaylistItem:
+    def put_many(self, items):
+        """ Put all PlaylistItems in a dictionary in the cache """
+        for key, value in items.iteritems():
+            self.put(key, value)
+
+    def get_misses(self, keys):
+        """ Returns the set of titles that are known not to match any track """
+        return set(key for key in keys if self.is_miss(key))
+
+    def put_misses(self, keys, ttl=None):
+        """ Remember that none of the titles match a track, for ttl seconds """
+        for key in keys:
+            self.put_miss(key, ttl)
+
+
+class PlaylistItem(object):
+    """
+    A track matching a title. last_modified and expires are naive UTC datetimes.
+    Uses __slots__, since caches hold lots of these and a per-instance __dict__ would take up most of their memory
+    """
+    __slots__ = ('name', 'uri', 'last_modified', 'expires')
 
     def __init__(self, name, uri, last_modified, expires):
         self.name = name
@@ -52,32 +121,143 @@ class PlaylistItem:
     def is_expired(self):
         return datetime.utcnow() > self.expires
 
+    def __getstate__(self):
+        # Objects with __slots__ can't be pickled with the older pickle protocols without this
+        return self.name, self.uri, self.last_modified, self.expires
+
+    def __setstate__(self, state):
+        self.name, self.uri, self.last_modified, self.expires = state
+
     def __str__(self):
         return self.name
 
+    def __repr__(self):
+        return 'PlaylistItem({!r}, {!r}, {!r}, {!r})'.format(self.name, self.uri, self.last_modified, self.expires)
+
 
 class MemPlaylistCache(PlaylistCache):
     """
-    Naive caching implementation for in-memory caching, using a simple dictionary for storing PlaylistItems
+    In-memory cache holding at most max_items entries (PlaylistItems and misses together). When it's full, the least
+    recently used entry is evicted. Items are dropped once they're past their expiry date plus the stale grace period,
+    misses once their TTL has passed: when they're looked up, and otherwise by a scan on the first write or stats()
+    call after every PURGE_INTERVAL. Thread-safe, so one instance can be shared by all generator threads
     """
 
-    def __init__(self):
-        self.cache = {}
+    def __init__(self, negative_ttl=NEGATIVE_CACHE_TTL, max_items=DEFAULT_MAX_ITEMS,
+                 stale_grace_period=STALE_GRACE_PERIOD):
+        # Maps keys to a tuple (PlaylistItem, or None for a miss, and the time after which the entry is dropped),
+        # in order of use: least recently used first
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.negative_ttl = negative_ttl
+        self.max_items = max_items
+        self.stale_grace_period = timedelta(seconds=stale_grace_period)
+        self.last_purge = datetime.utcnow()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+        self.expiration_count = 0
 
     def get(self, key):
-        if key in self.cache:
-            return self.cache[key]
-        else:
-            return None
+        with self.lock:
+            return self._get(key, datetime.utcnow())
 
-    def put(self, key, value):
-        self.cache[key] = value
+    def put(self, key, value, max_age=None):
+        """ Put a PlaylistItem in the cache, optionally keeping it for no longer than max_age seconds """
+        with self.lock:
+            self._put(key, value, self._drop_after(value, max_age))
 
     def remove(self, key):
-        del self.cache[key]
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def get_many(self, keys):
+        with self.lock:
+            now = datetime.utcnow()
+            items = {}
+            for key in keys:
+                item = self._get(key, now)
+                if item:
+                    items[key] = item
+            return items
+
+    def put_many(self, items, max_age=None):
+        with self.lock:
+            for key, value in items.iteritems():
+                self._put(key, value, self._drop_after(value, max_age))
+
+    def put_miss(self, key, ttl=None):
+        with self.lock:
+            ttl = ttl if ttl is not None else self.negative_ttl
+            self._put(key, None, datetime.utcnow() + timedelta(seconds=ttl))
+
+    def is_miss(self, key):
+        with self.lock:
+            entry = self._lookup(key, datetime.utcnow())
+            return entry is not None and entry[0] is None
+
+    def purge_expired(self):
+        """ Drop all entries that have expired """
+        with self.lock:
+            self._purge_expired(datetime.utcnow())
+
+    def stats(self):
+        with self.lock:
+            # So the size doesn't count entries that have expired long ago
+            self._purge_expired_every_interval(datetime.utcnow())
+            return {'size': len(self.entries), 'hits': self.hit_count, 'misses': self.miss_count,
+                    'evictions': self.eviction_count, 'expirations': self.expiration_count}
+
+    def _drop_after(self, item, max_age):
+        drop_after = item.expires + self.stale_grace_period
+        if max_age is not None:
+            drop_after = min(drop_after, datetime.utcnow() + timedelta(seconds=max_age))
+        return drop_after
+
+    def _lookup(self, key, now):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        if now > entry[1]:
+            self.expiration_count += 1
+            return None
+        # Re-inserting marks the entry as most recently used
+        self.entries[key] = entry
+        return entry
+
+    def _get(self, key, now):
+        entry = self._lookup(key, now)
+        if entry is not None and entry[0] is not None:
+            self.hit_count += 1
+            return entry[0]
+        self.miss_count += 1
+        return None
+
+    def _put(self, key, item, drop_after):
+        self.entries.pop(key, None)
+        self.entries[key] = (item, drop_after)
+        # Expired entries are the first to go, so they don't take up room that live ones are evicted for
+        self._purge_expired_every_interval(datetime.utcnow())
+        while len(self.entries) > self.max_items:
+            self.entries.popitem(last=False)
+            self.eviction_count += 1
+
+    def _purge_expired_every_interval(self, now):
+        # Scanning for expired entries on every call would be too expensive
+        if now - self.last_purge > PURGE_INTERVAL:
+            self._purge_expired(now)
+
+    def _purge_expired(self, now):
+        expired_keys = [key for key, entry in self.entries.iteritems() if now > entry[1]]
+        for key in expired_keys:
+            del self.entries[key]
+        self.expiration_count += len(expired_keys)
+        self.last_purge = now
 
     def __str__(self):
         output = ""
-        for key in self.cache.iterkeys():
-            output += "* {} / {} \n".format(key, self.cache[key].uri)
-        return output
\ No newline at end of file
+        with self.lock:
+            for key, entry in self.entries.iteritems():
+                if entry[0] is not None:
+                    output += "* {} / {} \n".format(key, entry[0].uri)
+        return output
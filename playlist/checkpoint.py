@@ -0,0 +1,33 @@
+"""
+Checkpoint files, for resuming a long run over the lines of a corpus where it left off. A checkpoint holds a few
+numbers separated by spaces, like the number of lines done and how far the output got by then
+"""
+
+__author__ = 'Daan Debie'
+
+import os
+
+
+def read_checkpoint(path, count=1):
+    """
+    Returns a tuple of the count numbers in the checkpoint file, or count zeros if there is no checkpoint
+    """
+    if path and os.path.exists(path):
+        with open(path) as checkpoint:
+            numbers = tuple(int(number) for number in checkpoint.read().split())
+        if numbers:
+            if len(numbers) != count:
+                raise ValueError("Checkpoint {} holds {} numbers instead of {}".format(path, len(numbers), count))
+            return numbers
+    return (0,) * count
+
+
+def write_checkpoint(path, *numbers):
+    """
+    Replaces the checkpoint file with the given numbers. Does nothing if there's no path
+    """
+    if path:
+        # Write and rename, so an interruption never leaves a half-written checkpoint behind
+        with open(path + '.tmp', 'w') as checkpoint:
+            checkpoint.write(' '.join(str(number) for number in numbers))
+        os.rename(path + '.tmp', path)
@@ -0,0 +1,56 @@
+"""
+Deadlines for generating playlists. A deadline is passed down from a request to the generator, the segmentation
+engines and the API calls they make, so all of them stop in time and the best effort so far can be returned
+"""
+
+__author__ = 'Daan Debie'
+
+import time
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """
+    A point in time by which work has to be done, given as a number of seconds from now
+    """
+
+    def __init__(self, seconds):
+        self.expires_at = time.time() + seconds
+
+    @classmethod
+    def at(cls, timestamp):
+        deadline = cls(0)
+        deadline.expires_at = timestamp
+        return deadline
+
+    @staticmethod
+    def earliest(*deadlines):
+        """
+        Returns the deadline that expires first, ignoring None. Returns None if all of them are None
+        """
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        return min(deadlines, key=lambda deadline: deadline.expires_at) if deadlines else None
+
+    def remaining(self):
+        """ Seconds left until the deadline, 0 if it has passed """
+        return max(self.expires_at - time.time(), 0)
+
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    def check(self):
+        """ Raises DeadlineExceeded if the deadline has passed """
+        if self.expired():
+            raise DeadlineExceeded()
+
+    def timeout(self, timeout=None):
+        """
+        Returns the timeout to use for a blocking call: the time left until the deadline, or the given timeout if
+        that's shorter
+        """
+        if timeout is None:
+            return self.remaining()
+        return min(timeout, self.remaining())
@@ -3,9 +3,18 @@ import re
 from datetime import timedelta
 from datetime import datetime
 
-import requests
-
 from message_tools import MessageChunker
+from message_tools import SpanSegmenter
+from message_tools import title_from_words
+from workers import BackgroundTasks
+from workers import map_concurrently
+from metrics import get_default_metrics
+from deadline import Deadline
+from deadline import DeadlineExceeded
+from session import ApiException
+from session import get_default_session
+from singleflight import SingleFlight
+from cache import NEGATIVE_CACHE_TTL
 from cache import PlaylistCache
 from cache import PlaylistItem
 from cache import datetime_from_http_datestring
@@ -15,8 +24,239 @@ SPOTIFY_BASE_TRACK_URL = 'http://open.spotify.com/track/'
 SPOTIFY_API_SEARCH_TRACK_URL = 'https://api.spotify.com/v1/search'
 VALID_API_STATUSCODES = [200, 304, 404]
 
+# Segmentation engines: depth-first backtracking with the MessageChunker, or dynamic programming with the SpanSegmenter
+ENGINE_CHUNKER = 'chunker'
+ENGINE_DP = 'dp'
+
+DEFAULT_PREFETCH_WORKERS = 8
+# In stale-while-revalidate mode, how long (in seconds) after expiring an item may still be served while it's being
+# revalidated in the background, and how many revalidations may run and be queued at once
+DEFAULT_MAX_STALENESS = 60 * 60
+DEFAULT_REFRESH_WORKERS = 4
+DEFAULT_MAX_PENDING_REFRESHES = 1000
+# How long (in seconds) a generated playlist may be served from the result cache at most. Results also depend on the
+# titles that didn't match a track, so they're not kept longer than those are. Incomplete results are kept shorter,
+# since a later search may well complete them
+DEFAULT_MAX_RESULT_AGE = NEGATIVE_CACHE_TTL
+DEFAULT_MAX_INCOMPLETE_RESULT_AGE = 5 * 60
+# When titles are resolved up front, segmenting the message in memory may take this long (in seconds) past the
+# deadline, so the titles that were resolved in time still get used
+SEGMENT_GRACE = 0.1
+# When resolving titles in waves, how many titles starting at the word segmenting got stuck on are resolved at once:
+# that title and the next shorter ones, which the engines try next if it doesn't match a track
+WAVE_SIZE = 4
+
 logger = logging.getLogger(__name__)
 
+# Shared by all generators in the process, so concurrent sentences and requests searching for the same title
+# share a single API call. Searches are keyed on the search URL as well, so generators using different APIs (ie. the
+# benchmark's stand-in) never get each other's results
+_search_flight = SingleFlight()
+_default_refresher = BackgroundTasks('revalidate', DEFAULT_REFRESH_WORKERS, DEFAULT_MAX_PENDING_REFRESHES)
+# Stands in for the item of a title that couldn't be resolved in time
+_UNRESOLVED = object()
+
+
+def normalise_message(message):
+    """
+    Filters non-alphanumeric, non-space characters from a message
+    """
+    return re.sub(r'[^a-zA-Z0-9\s\']', '', message)
+
+
+def expires_from_headers(headers):
+    """
+    Returns when a response expires according to its Cache-Control header, or None if the header doesn't say
+    """
+    max_age_match = re.match(r'.*max-age=(?P<age>\d+)', headers.get('Cache-Control', ''))
+    if max_age_match:
+        return datetime.utcnow() + timedelta(seconds=int(max_age_match.group('age')))
+    return None
+
+
+def item_from_search_result(title, headers, decoded_result):
+    """
+    Turns the first track in a search result whose name matches the title into a PlaylistItem, which expires
+    according to the Cache-Control header of the response (right away if there's none). Returns None if no track
+    matches
+    """
+    last_modified = datetime_from_http_datestring(headers['Date'])
+    expires = expires_from_headers(headers) or datetime.utcnow()
+    track_listing = decoded_result['tracks']['items']
+
+    # Valid track is any track whose name resembles the title we're looking for
+    # Spotify Metadata API also returns tracks whose ALBUM name resembles the query...
+    valid_tracks = [track for track in track_listing if title == track['name'].lower().strip()]
+    if valid_tracks:
+        return PlaylistItem(valid_tracks[0]['name'], valid_tracks[0]['uri'], last_modified, expires)
+    else:
+        return None
+
+
+def max_chunk_length_for(message, use_max_chunk_length=False):
+    # We want our playlist to contain at least two songs, so max_chunk_length must be less than total sentence length
+    # can be overridden with the use_max_chunk_length
+    if use_max_chunk_length:
+        return len(message.split())
+    return len(message.split()) - 1
+
+
+def segment_message(message, resolve, max_chunk_length, engine=ENGINE_CHUNKER, metrics=None, deadline=None):
+    """
+    Breaks a normalised message down into titles with the given segmentation engine, using the resolve function to
+    turn a title into a PlaylistItem (or None). Returns a tuple (playlist, incomplete), where an incomplete playlist
+    is the best effort in case the message couldn't be covered completely.
+    When the deadline passes, or resolve raises DeadlineExceeded, the best effort so far is returned as incomplete.
+    With Metrics, the titles tried, the times the chunker backtracked and the times time ran out are counted
+    """
+
+    if metrics:
+        resolve = _counting_spans(resolve, metrics)
+    if engine == ENGINE_DP:
+        segmenter = SpanSegmenter(message, resolve, max_chunk_length)
+        playlist, words_covered = segmenter.segment(deadline)
+        if segmenter.timed_out and metrics:
+            metrics.increment('playlist_deadline_exceeded_total')
+        incomplete = not playlist or words_covered < len(message.split())
+        return playlist, incomplete
+
+    chunker = MessageChunker(message, max_chunk_length)
+    playlist = []
+    discarded_playlists = []
+    index = 0
+    words_covered = 0
+    timed_out = False
+    try:
+        for chunk in chunker:
+            if deadline and deadline.expired():
+                timed_out = True
+                break
+            if not chunk:
+                # The current list of (remaining) groups is depleted, so we're backtracking
+                if metrics:
+                    metrics.increment('playlist_backtracks_total')
+                discarded_playlists.append([item for item in playlist])
+                words_covered -= len(playlist.pop().name.split())
+                index -= 1
+                continue
+
+            title = title_from_words(chunk[index])
+            item = resolve(title)
+            if item:
+                playlist.append(item)
+                # Keep track of how many words are covered by our current playlist
+                words_covered += len(chunk[index])
+                index += 1
+                chunker.progress()
+    except DeadlineExceeded:
+        timed_out = True
+    if timed_out:
+        if metrics:
+            metrics.increment('playlist_deadline_exceeded_total')
+        # Out of time, so the playlist we were working on is a candidate for the best effort as well
+        discarded_playlists.append(playlist)
+    if timed_out or not playlist or words_covered < len(message.split()):
+        # Apperently no complete playlist could be constructed, so we're taking the best effort
+        incomplete = True
+        sorted_playlists = sorted(discarded_playlists, key=len, reverse=True)
+        playlist = sorted_playlists[0] if sorted_playlists else playlist
+    else:
+        incomplete = False
+    return playlist, incomplete
+
+
+def segment_wave(pending, known, engine=ENGINE_CHUNKER, metrics=None, deadline=None, last=False):
+    """
+    Segments every message in pending, a dictionary mapping keys to (message, max_chunk_length) tuples, as far as the
+    titles in known (a dictionary mapping titles to their PlaylistItem or None) allow. Returns a tuple of a dictionary
+    with the results of the messages that could be segmented, and the set of titles to resolve for the next wave: for
+    every other message, the title it got stuck on and the shorter titles starting at the same word.
+    Resolving those and segmenting again until all messages are done only ever resolves titles that segmenting gets
+    to, instead of all candidate titles, whose number grows with the square of the length of a message.
+    With last, the titles that aren't known are taken to have run out of time, so every message gets the best effort
+    that the known titles allow
+    """
+
+    def resolve(title):
+        if title in known:
+            return known[title]
+        if last:
+            raise DeadlineExceeded()
+        raise _TitleNeeded(title)
+
+    results = {}
+    wanted = set()
+    for key, (message, max_chunk_length) in pending.iteritems():
+        # Only the wave in which a message is done counts, so every title tried is counted once
+        counts = _Counts() if metrics else None
+        try:
+            results[key] = segment_message(message, resolve, max_chunk_length, engine, counts, deadline)
+        except _TitleNeeded as e:
+            words = e.title.split()
+            for length in range(len(words), max(0, len(words) - WAVE_SIZE), -1):
+                title = title_from_words(words[:length])
+                if title not in known:
+                    wanted.add(title)
+            continue
+        if counts:
+            counts.add_to(metrics)
+    return results, wanted
+
+
+class _TitleNeeded(Exception):
+    """
+    Raised while segmenting in a wave, when a title is needed that hasn't been resolved yet
+    """
+
+    def __init__(self, title):
+        Exception.__init__(self, title)
+        self.title = title
+
+
+class _Counts(object):
+    """
+    Holds on to the counts of segmenting a message, until it's known whether they count
+    """
+
+    def __init__(self):
+        self.counts = []
+
+    def increment(self, name, amount=1, **labels):
+        self.counts.append((name, amount, labels))
+
+    def add_to(self, metrics):
+        for name, amount, labels in self.counts:
+            metrics.increment(name, amount, **labels)
+
+
+def _with_grace(deadline):
+    return Deadline.at(deadline.expires_at + SEGMENT_GRACE) if deadline else None
+
+
+def _counting_spans(resolve, metrics):
+    def resolve_span(title):
+        metrics.increment('playlist_spans_tried_total')
+        return resolve(title)
+    return resolve_span
+
+
+def result_key(message, engine, use_max_chunk_length):
+    """
+    Returns the key a result is cached under: the normalised message, and everything else that affects the result
+    """
+    return '{}:{}:{}'.format(engine, int(bool(use_max_chunk_length)), ' '.join(message.lower().split()))
+
+
+def result_expiry(playlist, incomplete, max_age, max_incomplete_age):
+    """
+    Returns until when a result can be cached: until the first of its items expires, and at most max_age seconds (or
+    max_incomplete_age for incomplete results)
+    """
+    expires = datetime.utcnow() + timedelta(seconds=max_incomplete_age if incomplete else max_age)
+    for item in playlist:
+        expires = min(expires, item.expires)
+    return expires
+
 
 def spotify_uri_to_url(uri):
     uri_match = re.match(r'spotify:track:(?P<id>\w{22})', uri)
@@ -28,86 +268,302 @@ def spotify_uri_to_url(uri):
 class PlaylistGenerator(object):
     """
     Class for generating Spotify playlists using the Spotify Metadata API.
-    It optionally caches the queries using a PlaylistCache object that is passed to the constructor
+    It optionally caches the queries using a PlaylistCache object that is passed to the constructor.
+    With prefetch enabled, titles are resolved concurrently in waves (see segment_wave): the message is segmented in
+    memory as far as the titles resolved so far allow, and the titles it got stuck on are resolved together.
+    All API calls go through a SpotifySession; unless one is passed in, the process-wide session is used.
+    An optional TitleIndex is consulted before the cache and the API.
+    In stale-while-revalidate mode, expired items that expired at most max_staleness seconds ago are used right away,
+    and revalidated in the background by the refresher (a BackgroundTasks), instead of making the caller wait for it.
+    With a ResultCache, generated playlists are cached as a whole, so a message that has been seen before takes a
+    single lookup.
+    What it does and how long that takes is recorded in a Metrics; by default the process-wide one.
+    Generating can be given a Deadline, and every call can be limited to timeout seconds. Once time runs out, no more
+    titles are tried, API calls in flight are cut short, and the best (incomplete) playlist so far is returned
 
     """
 
-    def __init__(self, cache=None):
+    def __init__(self, cache=None, engine=ENGINE_CHUNKER, prefetch=False, prefetch_workers=DEFAULT_PREFETCH_WORKERS,
+                 session=None, title_index=None, stale_while_revalidate=False, max_staleness=DEFAULT_MAX_STALENESS,
+                 refresher=None, result_cache=None, max_result_age=DEFAULT_MAX_RESULT_AGE,
+                 max_incomplete_result_age=DEFAULT_MAX_INCOMPLETE_RESULT_AGE, search_url=SPOTIFY_API_SEARCH_TRACK_URL,
+                 metrics=None, timeout=None):
         self.cache = cache
+        self.title_index = title_index
+        self.session = session or get_default_session()
         # I know we're all consenting adults here, but still, we really need a PlaylistCache instance here...
         if self.cache and not isinstance(self.cache, PlaylistCache):
             raise AttributeError
+        if engine not in (ENGINE_CHUNKER, ENGINE_DP):
+            raise ValueError("Unknown segmentation engine: {}".format(engine))
+        self.engine = engine
+        self.prefetch = prefetch
+        self.prefetch_workers = prefetch_workers
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_staleness = timedelta(seconds=max_staleness)
+        self.refresher = refresher or _default_refresher
+        self.result_cache = result_cache
+        self.max_result_age = max_result_age
+        self.max_incomplete_result_age = max_incomplete_result_age
+        # Can point to a stand-in for the Spotify API, ie. for benchmarking
+        self.search_url = search_url
+        self.metrics = metrics or get_default_metrics()
+        self.timeout = timeout
 
-    def generate_playlist(self, message, use_max_chunk_length=False):
+    def generate_playlist(self, message, use_max_chunk_length=False, deadline=None):
         """
-        Generates a Spotify playlist based on a passed message.
+        Generates a Spotify playlist based on a passed message, within the deadline (if any).
 
         returns a list containing PlaylistItem(s)
         """
 
-        # Filter non-alphanumeric, non-space characters
-        message = re.sub(r'[^a-zA-Z0-9\s\']', '', message)
-        # We want our playlist to contain at least two songs, so max_chunk_length must be less than total sentence length
-        # can be overridden with the use_max_chunk_length
-        if use_max_chunk_length:
-            max_chunk_length = len(message.split())
-        else:
-            max_chunk_length = len(message.split()) - 1
-        chunker = MessageChunker(message, max_chunk_length)
-        playlist = []
-        discarded_playlists = []
-        index = 0
-        words_covered = 0
-        for chunk in chunker:
-            if not chunk:
-                # The current list of (remaining) groups is depleted, so we're backtracking
-                discarded_playlists.append([item for item in playlist])
-                words_covered -= len(playlist.pop().name.split())
-                index -= 1
-                continue
+        deadline = self._call_deadline(deadline)
+        with self.metrics.timer('playlist_generate_seconds'):
+            message = normalise_message(message)
+            if self.result_cache:
+                key = result_key(message, self.engine, use_max_chunk_length)
+                with self.metrics.timer('playlist_cache_seconds', cache='results', operation='get'):
+                    result = self.result_cache.get(key)
+                self.metrics.increment('playlist_result_cache_lookups_total', result='hit' if result else 'miss')
+                if result:
+                    logger.debug("Result cache hit for '%s'", message)
+                    return result
+
+            max_chunk_length = max_chunk_length_for(message, use_max_chunk_length)
+            if self.prefetch:
+                result = self._segment_in_waves({message: (message, max_chunk_length)}, deadline)[message]
+            else:
+                resolve = lambda title: self._resolve_title(title, deadline)
+                result = segment_message(message, resolve, max_chunk_length, self.engine, self.metrics, deadline)
+
+            # Results cut short by the deadline say nothing about the message, so they aren't cached
+            if self.result_cache and not (deadline and deadline.expired()):
+                expires = result_expiry(result[0], result[1], self.max_result_age, self.max_incomplete_result_age)
+                # Results with items that are expired already (ie. served while being revalidated) aren't cached
+                if expires > datetime.utcnow():
+                    self._store_result(key, result, expires)
+            return result
+
+    def generate_playlists(self, messages, deadline=None):
+        """
+        Generates playlists for many messages at once, given as (message, use_max_chunk_length) tuples. Identical
+        messages are only generated once, and the titles of all messages are resolved together in waves (see
+        segment_wave), so every distinct title takes one cache probe or API call no matter how many messages it occurs
+        in. The messages are generated side by side, so the deadline applies to all of them together, and so does
+        this generator's timeout when there is no deadline.
+
+        returns a list of (playlist, incomplete) tuples, in the same order as the messages
+        """
+
+        keys = []
+        pending = {}
+        for message, use_max_chunk_length in messages:
+            message = normalise_message(message)
+            key = result_key(message, self.engine, use_max_chunk_length)
+            keys.append(key)
+            pending[key] = (message, max_chunk_length_for(message, use_max_chunk_length))
+
+        results = self._cached_results(pending.keys())
+        for key in results:
+            del pending[key]
+        if self.result_cache:
+            self.metrics.increment('playlist_result_cache_lookups_total', len(results), result='hit')
+            self.metrics.increment('playlist_result_cache_lookups_total', len(pending), result='miss')
+
+        deadline = deadline or self._call_deadline(None)
+        generated = self._segment_in_waves(pending, deadline)
+        results.update(generated)
+
+        # Results cut short by the deadline say nothing about the messages, so they aren't cached
+        if self.result_cache and not (deadline and deadline.expired()):
+            now = datetime.utcnow()
+            for key, result in generated.iteritems():
+                expires = result_expiry(result[0], result[1], self.max_result_age, self.max_incomplete_result_age)
+                if expires > now:
+                    self._store_result(key, result, expires)
+        return [results[key] for key in keys]
+
+    def cached_results(self, messages, use_max_chunk_length=False):
+        """
+        Looks up the results for all messages in the result cache at once. Returns a list with the (playlist,
+        incomplete) result for every message, or None for messages that aren't in the cache
+        """
+
+        if not self.result_cache:
+            return [None] * len(messages)
+        keys = [result_key(normalise_message(message), self.engine, use_max_chunk_length) for message in messages]
+        results = self._cached_results(list(set(keys)))
+        # Misses are counted when the messages are generated
+        self.metrics.increment('playlist_result_cache_lookups_total', len(results), result='hit')
+        return [results.get(key) for key in keys]
+
+    def _cached_results(self, keys):
+        if not self.result_cache:
+            return {}
+        with self.metrics.timer('playlist_cache_seconds', cache='results', operation='get_many'):
+            return self.result_cache.get_many(keys)
 
-            title = " ".join(chunk[index]).strip().lower()
+    def _store_result(self, key, result, expires):
+        with self.metrics.timer('playlist_cache_seconds', cache='results', operation='put'):
+            self.result_cache.put(key, result, expires)
 
-            if self.cache:
+    def _segment_in_waves(self, pending, deadline=None):
+        """
+        Segments messages, given as a dictionary mapping keys to (message, max_chunk_length) tuples, resolving their
+        titles in waves. Returns a dictionary with the (playlist, incomplete) result of every message. Messages that
+        aren't done by the deadline get the best effort that the titles resolved by then allow
+        """
+        pending = dict(pending)
+        results = {}
+        known = {}
+        segment_deadline = _with_grace(deadline)
+        while pending:
+            done, wanted = segment_wave(pending, known, self.engine, self.metrics, segment_deadline)
+            results.update(done)
+            for key in done:
+                del pending[key]
+            if not pending:
+                break
+            logger.debug("Resolving %d titles for %d messages", len(wanted), len(pending))
+            resolved = self.resolve_titles(list(wanted), deadline)
+            known.update(resolved)
+            # Titles are only left out when they couldn't be resolved in time
+            if len(resolved) < len(wanted):
+                done, _ = segment_wave(pending, known, self.engine, self.metrics, segment_deadline, last=True)
+                results.update(done)
+                break
+        return results
+
+    def _call_deadline(self, deadline):
+        """
+        Returns the earliest of the given deadline and the deadline following from this generator's timeout
+        """
+        return Deadline.earliest(deadline, Deadline(self.timeout) if self.timeout else None)
+
+    def _resolve_title(self, title, deadline=None):
+        """
+        Looks up a title in the cache (if any) and otherwise queries the API.
+        Returns the matching PlaylistItem, or None if there is no track with that title.
+        Raises DeadlineExceeded if the API can't be asked in time
+        """
+
+        if self.title_index:
+            known, item = self.title_index.lookup(title)
+            self.metrics.increment('playlist_title_index_lookups_total', result='hit' if known else 'miss')
+            if known:
+                return item
+        known, item = self._lookup_title_in_cache(title, deadline)
+        if known:
+            return item
+        return self._fetch_title(title, deadline)
+
+    def resolve_titles(self, titles, deadline=None):
+        """
+        Resolves all titles, querying the API concurrently for the ones the cache doesn't know about.
+        Returns a dictionary mapping every title to its PlaylistItem, or None if there is no track with that title.
+        Titles that couldn't be resolved before the deadline are left out
+        """
+
+        resolved = self.title_index.get_many(titles) if self.title_index else {}
+        if self.title_index:
+            self.metrics.increment('playlist_title_index_lookups_total', len(resolved), result='hit')
+            self.metrics.increment('playlist_title_index_lookups_total', len(titles) - len(resolved), result='miss')
+        titles = [title for title in titles if title not in resolved]
+        unknown_titles = []
+        if self.cache:
+            # Probe the cache for all titles at once instead of one by one
+            with self.metrics.timer('playlist_cache_seconds', cache='titles', operation='get_many'):
+                cached_items = self.cache.get_many(titles)
+            with self.metrics.timer('playlist_cache_seconds', cache='titles', operation='get_misses'):
+                misses = self.cache.get_misses([title for title in titles if title not in cached_items])
+        else:
+            cached_items, misses = {}, set()
+        for title in titles:
+            if title in cached_items:
                 try:
-                    item = self._fetch_item_from_cache(title)
-                except ApiException:
-                    raise
-                if item:
-                    playlist.append(item)
-                    words_covered += len(chunk[index])
-                    index += 1
-                    chunker.progress()
+                    item = self._validate_cached_item(title, cached_items[title], deadline)
+                except DeadlineExceeded:
                     continue
+                # None means the title doesn't match a track anymore, and _revalidate stored that as a miss already
+                resolved[title] = item
+                continue
+            elif title in misses:
+                logger.debug("Negative cache hit for '%s'", title)
+                self.metrics.increment('playlist_cache_lookups_total', result='negative_hit')
+                resolved[title] = None
+                continue
+            elif self.cache:
+                self.metrics.increment('playlist_cache_lookups_total', result='miss')
+            unknown_titles.append(title)
+
+        logger.debug("Prefetching %d of %d titles", len(unknown_titles), len(titles))
+        items = map_concurrently(lambda title: self._fetch_item_before(title, deadline), unknown_titles,
+                                 self.prefetch_workers, name='prefetch')
+        fetched = dict((title, item) for title, item in zip(unknown_titles, items) if item is not _UNRESOLVED)
+        resolved.update(fetched)
+        if self.cache:
+            with self.metrics.timer('playlist_cache_seconds', cache='titles', operation='put_many'):
+                self.cache.put_many(dict((title, item) for title, item in fetched.iteritems() if item))
+            with self.metrics.timer('playlist_cache_seconds', cache='titles', operation='put_misses'):
+                self.cache.put_misses([title for title, item in fetched.iteritems() if not item])
+        return resolved
+
+    def _fetch_item_before(self, title, deadline):
+        """
+        Like _fetch_item_from_api, but returns _UNRESOLVED instead of raising DeadlineExceeded
+        """
+        try:
+            return self._fetch_item_from_api(title, deadline)
+        except DeadlineExceeded:
+            return _UNRESOLVED
+
+    def _lookup_title_in_cache(self, title, deadline=None):
+        """
+        Returns a tuple (known, item). known is False if the cache can't tell whether there's a track with this title
+        """
+
+        if not self.cache:
+            return False, None
+        item = self._fetch_item_from_cache(title, deadline)
+        if item:
+            return True, item
+        with self.metrics.timer('playlist_cache_seconds', cache='titles', operation='is_miss'):
+            miss = self.cache.is_miss(title)
+        if miss:
+            logger.debug("Negative cache hit for '%s'", title)
+            self.metrics.increment('playlist_cache_lookups_total', result='negative_hit')
+            return True, None
+        self.metrics.increment('playlist_cache_lookups_total', result='miss')
+        return False, None
 
-            try:
-                item = self._fetch_item_from_api(title)
-            except ApiException:
-                raise
+    def _fetch_title(self, title, deadline=None):
+        """
+        Queries the API for a title and stores the result, or the fact that there was no match, in the cache
+        """
+
+        item = self._fetch_item_from_api(title, deadline)
+        if self.cache:
+            self._store_item(title, item)
+        return item
+
+    def _store_item(self, title, item):
+        with self.metrics.timer('playlist_cache_seconds', cache='titles', operation='put'):
             if item:
-                if self.cache:
-                    self.cache.put(title, item)
-                playlist.append(item)
-                # Keep track of how many words are covered by our current playlist
-                words_covered += len(chunk[index])
-                index += 1
-                chunker.progress()
-        if not playlist or words_covered < len(message.split()):
-            # Apperently no complete playlist could be constructed, so we're taking the best effort
-            incomplete = True
-            sorted_playlists = sorted(discarded_playlists, key=len, reverse=True)
-            playlist = sorted_playlists[0] if sorted_playlists else playlist
-        else:
-            incomplete = False
-        return playlist, incomplete
+                self.cache.put(title, item)
+            else:
+                # Most titles don't match a track, so remember that to avoid asking the API again
+                self.cache.put_miss(title)
 
-    @staticmethod
-    def _fetch_item_from_api(title):
+    def _fetch_item_from_api(self, title, deadline=None):
         """
-        Does a Spotify Metadata search and returns the first valid result
+        Does a Spotify Metadata search and returns the first valid result.
+        If another thread is already searching for the same title with the same API, its result is used instead
         """
+        return _search_flight.do((self.search_url, title), self._search_item, title, deadline, deadline=deadline)
+
+    def _search_item(self, title, deadline=None):
         params = {'q': title, 'type': 'track'}
-        r = requests.get(SPOTIFY_API_SEARCH_TRACK_URL, params=params)
+        r = self.session.get(self.search_url, params=params, deadline=deadline)
 
         # Something bad happened with the API that we can't recover from
         if r.status_code not in VALID_API_STATUSCODES:
@@ -115,57 +571,67 @@ class PlaylistGenerator(object):
         elif r.status_code == 404:
             return None
 
-        last_modified = datetime_from_http_datestring(r.headers['Date'])
-        max_age_match = re.match(r'.*max-age=(?P<age>\d+)', r.headers['Cache-Control'])
-        if max_age_match:
-            max_age = int(max_age_match.group('age'))
-        else:
-            max_age = None
-        expires = datetime.utcnow() + timedelta(seconds=max_age)
-        decoded_result = r.json()
-        track_listing = decoded_result['tracks']['items']
-
-        # Valid track is any track whose name resembles the title we're looking for
-        # Spotify Metadata API also returns tracks whose ALBUM name resembles the query...
-        valid_tracks = [track for track in track_listing if title == track['name'].lower().strip()]
-        if valid_tracks:
-            return PlaylistItem(valid_tracks[0]['name'], valid_tracks[0]['uri'], last_modified, expires)
-        else:
-            return None
+        return item_from_search_result(title, r.headers, r.json())
 
-    def _fetch_item_from_cache(self, title):
+    def _fetch_item_from_cache(self, title, deadline=None):
         """
         Looks up the title in cache, validates it and returns it if valid
         """
 
-        # Get item from cache
-        cached_item = self.cache.get(title)
+        with self.metrics.timer('playlist_cache_seconds', cache='titles', operation='get'):
+            cached_item = self.cache.get(title)
+        return self._validate_cached_item(title, cached_item, deadline)
+
+    def _validate_cached_item(self, title, cached_item, deadline=None):
+        """
+        Returns the cached item if it's still valid, revalidating it with the API if it's expired
+        """
+
         # If it's not expired, go with it
         if cached_item and not cached_item.is_expired():
             logger.debug("Cache hit for '%s'", title)
+            self.metrics.increment('playlist_cache_lookups_total', result='hit')
+            return cached_item
+        elif cached_item and self.stale_while_revalidate and \
+                datetime.utcnow() - cached_item.expires <= self.max_staleness:
+            logger.debug("Cache expired for '%s', revalidating in the background", title)
+            self.metrics.increment('playlist_cache_lookups_total', result='stale')
+            self.refresher.submit(title, self._revalidate, title, cached_item)
             return cached_item
         # If it's expired, query the API using if-modified-since to see if cache is still valid
         elif cached_item:
             logger.debug("Cache expired for '%s'", title)
-            modified_since = http_datestring_from_datetime(cached_item.last_modified)
-            params = {'q': title, 'type': 'track'}
-            headers = {'If-Modified-Since': modified_since}
-            r = requests.get(SPOTIFY_API_SEARCH_TRACK_URL, params=params, headers=headers)
-
-            # Something bad happened with the API that we can't recover from
-            if r.status_code not in VALID_API_STATUSCODES:
-                raise ApiException(r.status_code)
-            # If we get statuscode 304, we can still use the cached item
-            if r.status_code == 304:
-                logger.debug("Cache still valid for '%s'", title)
-                return cached_item
-            else:
-                logger.debug("Cache invalidated for '%s'", title)
-                self.cache.remove(title)
-                return None
+            self.metrics.increment('playlist_cache_lookups_total', result='expired')
+            return self._revalidate(title, cached_item, deadline)
 
+    def _revalidate(self, title, cached_item, deadline=None):
+        """
+        Asks the API whether an expired item is still valid, and updates the cache with the answer.
+        Returns the item to use from now on, or None if the title doesn't match a track anymore
+        """
 
-class ApiException(Exception):
-    def __init__(self, status):
-        self.status = status
+        modified_since = http_datestring_from_datetime(cached_item.last_modified)
+        params = {'q': title, 'type': 'track'}
+        headers = {'If-Modified-Since': modified_since}
+        r = self.session.get(self.search_url, params=params, headers=headers, deadline=deadline)
 
+        # Something bad happened with the API that we can't recover from
+        if r.status_code not in VALID_API_STATUSCODES:
+            raise ApiException(r.status_code)
+        # If we get statuscode 304, we can still use the cached item, until the new expiry date
+        if r.status_code == 304:
+            logger.debug("Cache still valid for '%s'", title)
+            self.metrics.increment('playlist_revalidations_total', result='not_modified')
+            expires = expires_from_headers(r.headers)
+            if not expires:
+                return cached_item
+            item = PlaylistItem(cached_item.name, cached_item.uri, cached_item.last_modified, expires)
+        else:
+            logger.debug("Cache invalidated for '%s'", title)
+            # The response to the conditional request is a regular search result, so there's no need to search again
+            item = item_from_search_result(title, r.headers, r.json()) if r.status_code == 200 else None
+            self.metrics.increment('playlist_revalidations_total', result='modified' if item else 'gone')
+            if not item:
+                self.cache.remove(title)
+        self._store_item(title, item)
+        return item
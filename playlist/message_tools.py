@@ -4,6 +4,10 @@ Tools for generating different word-combinations from a message
 
 __author__ = 'Daan Debie'
 
+import re
+
+from deadline import DeadlineExceeded
+
 
 def get_nested_list_len(lst):
     """
@@ -16,6 +20,40 @@ def get_nested_list_len(lst):
     return ls_len
 
 
+def split_sentences(text):
+    """
+    Splits a text into the separate sentences that are turned into playlists, dropping empty ones
+    """
+    return [sentence for sentence in re.split(r'[.?!/\n]', text) if len(sentence) > 0]
+
+
+def title_from_words(word_list):
+    """
+    Turns a group of words into the normalised title that's used for looking up tracks
+    """
+    return " ".join(word_list).strip().lower()
+
+
+def candidate_titles(message, max_chunk_length=None):
+    """
+    Returns every distinct title a message can be broken down into, ie. all groups of consecutive words.
+    Like in the MessageChunker, max_chunk_length only limits the first group of the message
+    """
+    word_list = message.split()
+    titles = []
+    seen = set()
+    for start in range(len(word_list)):
+        longest = len(word_list) - start
+        if start == 0 and max_chunk_length and max_chunk_length < longest:
+            longest = max_chunk_length
+        for length in range(longest, 0, -1):
+            title = title_from_words(word_list[start:start + length])
+            if title not in seen:
+                seen.add(title)
+                titles.append(title)
+    return titles
+
+
 def generate_smaller_sublists(word_list, max_chunk_length=None):
     """
     This function takes (a part of) a list and returns a new list containing all small sublists of
@@ -97,5 +135,104 @@ class MessageChunker(object):
         last_prefix_group_length = len(self.prefix.pop())
         index = prefix_length - last_prefix_group_length
         self.max_chunk_length = last_prefix_group_length - 1
-        self.chunks = generate_smaller_sublists(self.word_list[index:], self.max_chunk_length)
-        self.counter = 0
\ No newline at end of file
+        # A group of one word can't shrink, so there's nothing left to try from here and the next call backtracks
+        # further. generate_smaller_sublists would take a max_chunk_length of 0 to mean no maximum at all, and start
+        # over with the largest group
+        if self.max_chunk_length:
+            self.chunks = generate_smaller_sublists(self.word_list[index:], self.max_chunk_length)
+        else:
+            self.chunks = []
+        self.counter = 0
+
+
+class SpanSegmenter(object):
+    """
+    Alternative to the MessageChunker that finds the grouping of words using dynamic programming over word positions.
+    Every span (start, length) is passed to the resolve function at most once, and for every position the best cover
+    of the rest of the message is remembered, so the same tail of a message is never explored twice.
+    Like the MessageChunker it prefers groups as large as possible, and max_chunk_length only applies to the first
+    group. If no full cover exists, the cover of the longest coverable prefix is returned instead.
+    When segmenting is cut short by a deadline, the best cover found so far is returned, and timed_out is set.
+
+    """
+    def __init__(self, message, resolve, max_chunk_length=None):
+        self.word_list = message.split()
+        self.resolve = resolve
+        if max_chunk_length:
+            self.max_chunk_length = max_chunk_length
+        else:
+            self.max_chunk_length = len(self.word_list)
+        self.spans = {}
+        self.covers = {}
+        self.timed_out = False
+
+    def segment(self, deadline=None):
+        """
+        Returns a tuple containing the list of resolved items for the best cover and the number of words it covers.
+        The resolve function may raise DeadlineExceeded to cut segmenting short, as does passing the (optional)
+        deadline
+        """
+
+        word_count = len(self.word_list)
+        self.covers[word_count] = ([], 0)
+        # Each frame holds a position, the next span length to try from there and the best cover found so far.
+        # An explicit stack keeps long messages from hitting the recursion limit
+        stack = [[0, self._longest_span(0), ([], 0)]]
+        while stack:
+            frame = stack[-1]
+            position, length, best = frame
+            if length == 0 or position + best[1] == word_count:
+                # Either all spans have been tried, or the rest of the message is covered completely
+                self.covers[position] = best
+                stack.pop()
+                continue
+
+            if deadline and deadline.expired():
+                return self._best_cover_so_far(stack)
+            try:
+                item = self._resolve_span(position, length)
+            except DeadlineExceeded:
+                return self._best_cover_so_far(stack)
+            if item is None:
+                frame[1] -= 1
+                continue
+
+            next_position = position + length
+            if next_position not in self.covers:
+                stack.append([next_position, self._longest_span(next_position), ([], 0)])
+                continue
+
+            rest, rest_covered = self.covers[next_position]
+            if length + rest_covered > best[1]:
+                frame[2] = ([item] + rest, length + rest_covered)
+            frame[1] -= 1
+
+        return self.covers[0]
+
+    def _best_cover_so_far(self, stack):
+        """
+        Returns the best cover of a prefix of the message that can be put together from the stack: the spans that led
+        to a frame, followed by the best cover found from that frame's position on
+        """
+        self.timed_out = True
+        best = ([], 0)
+        path = []
+        for position, length, (rest, rest_covered) in stack:
+            if position + rest_covered > best[1]:
+                best = (path + rest, position + rest_covered)
+            # Every frame but the last is trying the span that led to the next frame
+            path = path + [self.spans.get((position, length))]
+        return best
+
+    def _longest_span(self, position):
+        remaining = len(self.word_list) - position
+        if position == 0:
+            return min(self.max_chunk_length, remaining)
+        return remaining
+
+    def _resolve_span(self, position, length):
+        key = (position, length)
+        if key not in self.spans:
+            title = title_from_words(self.word_list[position:position + length])
+            self.spans[key] = self.resolve(title)
+        return self.spans[key]
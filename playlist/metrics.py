@@ -0,0 +1,223 @@
+"""
+In-process metrics for playlist generation: counters, gauges and latency histograms recorded by the generator and the
+Spotify session, so the time spent on a slow playlist can be attributed to backtracking, cache probes, revalidations
+or searches. They can be exported in the Prometheus text format, or summarised for humans
+"""
+
+__author__ = 'Daan Debie'
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+# Upper bounds (in seconds) of the buckets of latency histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# What's recorded, and where
+HELP = {
+    'playlist_generate_seconds': "Time taken by generate_playlist, including the result cache",
+    'playlist_result_cache_lookups_total': "Result cache lookups, by result (hit or miss)",
+    'playlist_spans_tried_total': "Titles (spans of words) the segmentation engines tried to resolve",
+    'playlist_backtracks_total': "Times the chunker dropped the last title of its playlist to try another grouping",
+    'playlist_deadline_exceeded_total': "Messages whose segmentation was cut short by a deadline",
+    'playlist_title_index_lookups_total': "Title index lookups, by result (hit or miss)",
+    'playlist_cache_lookups_total': "Title cache lookups, by result (hit, stale, expired, negative_hit or miss)",
+    'playlist_cache_seconds': "Time taken by cache operations, by cache (titles or results) and operation",
+    'playlist_revalidations_total': "Revalidations of expired items with the API, by result (not_modified, modified "
+                                    "or gone)",
+    'spotify_api_requests_total': "Requests to the Spotify API, by status code (or error or timeout) and whether "
+                                  "they were conditional",
+    'spotify_api_request_seconds': "Time taken by requests to the Spotify API, by whether they were conditional",
+    'spotify_api_retries_total': "Requests to the Spotify API that were retried",
+    'redis_pool_connections': "Connections of the Redis connection pool, by state (max_connections, open, idle or "
+                              "in_use)",
+    'playlist_l1_cache': "Size and hit, miss, eviction and expiration counts of the in-process cache",
+    'playlist_pending_revalidations': "Revalidations running or queued in the background",
+}
+
+_default_metrics = None
+_default_metrics_lock = Lock()
+
+
+def get_default_metrics():
+    """
+    Returns the process-wide Metrics, creating it on first use
+    """
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics()
+        return _default_metrics
+
+
+class Histogram(object):
+    """
+    Counts observations per bucket, where every bucket has an upper bound. Not thread-safe by itself
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'total', 'maximum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last count is for observations above the upper bound of the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count, histogram.total, histogram.maximum = self.count, self.total, self.maximum
+        return histogram
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket the q-quantile falls in, or the maximum if that's lower
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return min(bound, self.maximum)
+        return self.maximum
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of counters, gauges and histograms. A metric is identified by its name and its labels, which
+    are passed as keyword arguments
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.types = {}
+        self.values = {}
+        self.lock = Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.types[name] = COUNTER
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.types[name] = GAUGE
+            self.values[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.types[name] = HISTOGRAM
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Context manager observing the time taken by its block in the named histogram, also when it raises
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def get(self, name, **labels):
+        """
+        Returns the value of a counter or gauge (0 if it has never been recorded), or a copy of a histogram
+        """
+        with self.lock:
+            value = self.values.get((name, _label_key(labels)), 0)
+            return value.copy() if isinstance(value, Histogram) else value
+
+    def reset(self):
+        with self.lock:
+            self.types.clear()
+            self.values.clear()
+
+    def prometheus(self):
+        """
+        Returns all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for name, metric_type, series in self._sorted_series():
+            if name in HELP:
+                lines.append('# HELP {} {}'.format(name, HELP[name]))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for labels, value in series:
+                if metric_type != HISTOGRAM:
+                    lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(value.buckets + (float('inf'),), value.counts):
+                    cumulative += count
+                    bucket_labels = labels + (('le', '+Inf' if bound == float('inf') else repr(bound)),)
+                    lines.append('{}_bucket{} {}'.format(name, _format_labels(bucket_labels), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_value(value.total)))
+                lines.append('{}_count{} {}'.format(name, _format_labels(labels), value.count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        Returns a human readable summary of all metrics, one per line. Quantiles of histograms are upper bounds
+        """
+        lines = []
+        for name, metric_type, series in self._sorted_series():
+            for labels, value in series:
+                metric = name + _format_labels(labels)
+                if metric_type == HISTOGRAM:
+                    lines.append('{:<70} count {}, mean {:.1f} ms, p50 <= {:.1f} ms, p95 <= {:.1f} ms, max {:.1f} '
+                                 'ms'.format(metric, value.count, 1000 * value.total / value.count,
+                                             1000 * value.quantile(0.5), 1000 * value.quantile(0.95),
+                                             1000 * value.maximum))
+                else:
+                    lines.append('{:<70} {}'.format(metric, _format_value(value)))
+        return '\n'.join(lines)
+
+    def _sorted_series(self):
+        """
+        Returns a sorted list of (name, type, [(labels, value), ...]) with copies of the values, taken under the lock
+        """
+        with self.lock:
+            by_name = {}
+            for (name, labels), value in self.values.iteritems():
+                if isinstance(value, Histogram):
+                    value = value.copy()
+                by_name.setdefault(name, []).append((labels, value))
+            types = dict(self.types)
+        return [(name, types[name], sorted(series)) for name, series in sorted(by_name.iteritems())]
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.iteritems()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, _escape(value)) for key, value in labels) + '}'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,190 @@
+"""
+Generating the playlists of many sentences on a pool of worker processes, so segmenting long sentences, which is
+CPU-bound, scales across cores instead of being serialised by the GIL like on a pool of threads.
+Every worker process has a PlaylistGenerator of its own. They share their cache through Redis, or through a manager
+process holding an in-memory cache
+"""
+
+__author__ = 'Daan Debie'
+
+import logging
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+from multiprocessing.managers import BaseManager
+
+from cache import MemPlaylistCache
+from cache import PlaylistCache
+from deadline import Deadline
+from generator import ENGINE_CHUNKER
+from generator import PlaylistGenerator
+from generator import SPOTIFY_API_SEARCH_TRACK_URL
+from plthreading import DEADLINE_GRACE
+from plthreading import MAX_WAIT
+from ratelimit import DEFAULT_CAPACITY
+from ratelimit import RedisTokenBucket
+from ratelimit import TokenBucket
+from rediscache import RedisPlaylistCache
+from resultcache import MemResultCache
+from resultcache import RedisResultCache
+from resultcache import ResultCache
+from session import SpotifySession
+from titleindex import TitleIndex
+
+logger = logging.getLogger(__name__)
+
+# The generator of this process, when it's a worker of a GeneratorProcessPool
+_worker_generator = None
+
+
+class GeneratorProcessPool(object):
+    """
+    A pool of worker processes that generate playlists, by default one per core. How the generator of every worker is
+    set up is given as settings, since generators themselves can't be passed to another process:
+    - redis: a dictionary with the host, port, database and password of a Redis instance to cache items and results
+      in, and to keep the rate limit in
+    - shared_memory: without Redis, cache items and results in a manager process all workers talk to
+    Without Redis, the rate limit and the bursts it allows are split evenly across the workers.
+    Without either, nothing is cached. Every worker keeps its own Metrics. Call close() when done with the pool
+    """
+
+    def __init__(self, processes=None, redis=None, shared_memory=False, engine=ENGINE_CHUNKER, timeout=None,
+                 rate_limit=None, title_index_path=None, search_url=SPOTIFY_API_SEARCH_TRACK_URL):
+        self.manager = None
+        caches = None
+        if shared_memory and not redis:
+            self.manager = _CacheManager()
+            self.manager.start()
+            caches = (self.manager.PlaylistCache(), self.manager.ResultCache())
+        self.processes = processes or cpu_count()
+        settings = {'redis': redis, 'caches': caches, 'processes': self.processes, 'engine': engine,
+                    'timeout': timeout, 'rate_limit': rate_limit, 'title_index_path': title_index_path,
+                    'search_url': search_url}
+        self.pool = Pool(self.processes, _init_worker, (settings,))
+
+    def apply_async(self, function, args=()):
+        return self.pool.apply_async(function, args)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        if self.manager:
+            self.manager.shutdown()
+
+
+def generate_multiple_playlists_multiprocess(list_of_messages, pool, timeout=None, deadline=None):
+    """
+    Generates a playlist for each message on a GeneratorProcessPool. Like generate_multiple_playlists_threaded, results
+    are (playlist, incomplete) tuples in the same order as the messages, an ApiException raised while generating any
+    of the playlists is propagated, and a timeout (in seconds) or a Deadline applies to all messages together
+    """
+    deadline = Deadline.earliest(deadline, Deadline(timeout) if timeout else None)
+    # We're processing multiple sentences, almost guaranteeing multiple playlist entries,
+    # se we can use max_chunk_length
+    pending = [pool.apply_async(_generate_playlist, (message, deadline)) for message in list_of_messages]
+
+    give_up = Deadline.at(deadline.expires_at + DEADLINE_GRACE) if deadline else None
+    results = []
+    for position, result in enumerate(pending):
+        # Waiting on a result without a timeout can't be interrupted with Ctrl-C in Python 2
+        while not result.ready() and not (give_up and give_up.expired()):
+            result.wait(give_up.remaining() if give_up else MAX_WAIT)
+        if result.ready():
+            # Re-raises the exception raised in the worker, if any
+            results.append(result.get())
+        else:
+            logger.warn("Timed out generating playlist for message %d", position)
+            results.append(([], True))
+    return results
+
+
+class ManagedPlaylistCache(PlaylistCache):
+    """
+    A PlaylistCache talking to a cache in a manager process, through its proxy
+    """
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def get(self, key):
+        return self.proxy.get(key)
+
+    def put(self, key, value):
+        self.proxy.put(key, value)
+
+    def remove(self, key):
+        self.proxy.remove(key)
+
+    def put_miss(self, key, ttl=None):
+        self.proxy.put_miss(key, ttl)
+
+    def is_miss(self, key):
+        return self.proxy.is_miss(key)
+
+    def get_many(self, keys):
+        return self.proxy.get_many(keys)
+
+    def put_many(self, items):
+        self.proxy.put_many(items)
+
+    def get_misses(self, keys):
+        return self.proxy.get_misses(keys)
+
+    def put_misses(self, keys, ttl=None):
+        self.proxy.put_misses(keys, ttl)
+
+
+class ManagedResultCache(ResultCache):
+    """
+    A ResultCache talking to a cache in a manager process, through its proxy
+    """
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def get_many(self, keys):
+        return self.proxy.get_many(keys)
+
+    def put(self, key, result, expires):
+        self.proxy.put(key, result, expires)
+
+
+class _CacheManager(BaseManager):
+    pass
+
+
+# Both caches are thread-safe, so the manager can serve all workers at once
+_CacheManager.register('PlaylistCache', MemPlaylistCache)
+_CacheManager.register('ResultCache', MemResultCache)
+
+
+def _init_worker(settings):
+    # Runs in every worker process once, when it's started
+    global _worker_generator
+    redis = settings['redis']
+    cache, result_cache, rate_limiter = None, None, None
+    if redis:
+        cache = RedisPlaylistCache(**redis)
+        result_cache = RedisResultCache(cache.database)
+        if settings['rate_limit']:
+            rate_limiter = RedisTokenBucket(cache.database, settings['rate_limit'])
+    else:
+        if settings['caches']:
+            cache = ManagedPlaylistCache(settings['caches'][0])
+            result_cache = ManagedResultCache(settings['caches'][1])
+        if settings['rate_limit']:
+            # Not shared, so every worker gets its part of the rate limit and of the bursts it allows, which need
+            # room for at least one call
+            processes = settings['processes']
+            rate_limiter = TokenBucket(float(settings['rate_limit']) / processes,
+                                       max(1.0, float(DEFAULT_CAPACITY) / processes))
+    title_index = TitleIndex(settings['title_index_path']) if settings['title_index_path'] else None
+    # A session of its own, so no connections are shared with the parent process
+    session = SpotifySession(rate_limiter=rate_limiter)
+    _worker_generator = PlaylistGenerator(cache, settings['engine'], session=session, title_index=title_index,
+                                          result_cache=result_cache, search_url=settings['search_url'],
+                                          timeout=settings['timeout'])
+
+
+def _generate_playlist(message, deadline):
+    # Runs in a worker process
+    return _worker_generator.generate_playlist(message, True, deadline)
@@ -1,61 +1,95 @@
 __author__ = 'Daan Debie'
 
-from threading import Thread
+import logging
+import sys
+from Queue import Empty
 from Queue import Queue
+
+from deadline import Deadline
 from generator import PlaylistGenerator
+from workers import get_pool
+
+DEFAULT_POOL_SIZE = 8
+# Without a timeout, how long (in seconds) to block on the queue at a time. Waiting on a Queue without a timeout
+# can't be interrupted with Ctrl-C in Python 2
+MAX_WAIT = 60
+# How long (in seconds) past the deadline to wait for the best effort of messages that were cut short
+DEADLINE_GRACE = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+def generate_multiple_playlists_threaded(list_of_messages, cache, session=None, timeout=None,
+                                         pool_size=DEFAULT_POOL_SIZE, title_index=None, generator=None, deadline=None):
+    """
+    Generates a playlist for each message concurrently, on a process-wide pool of pool_size threads that is reused
+    across calls, so the number of threads stays bounded no matter how many messages are passed.
+    Results are returned in the same order as the messages. An ApiException raised while generating any of the
+    playlists is propagated. If a timeout (in seconds) or a Deadline is given, it applies to all messages together:
+    messages that run out of time are returned as the best (incomplete) effort so far, and messages that haven't
+    handed that in shortly after the deadline as empty and incomplete.
+    An already configured PlaylistGenerator can be passed instead of the cache, session and title_index. If it has a
+    result cache, that's consulted for all messages at once, and only the messages it doesn't know are generated.
+    """
+    results = [None] * len(list_of_messages)
+    for position, result in generate_multiple_playlists_as_completed(list_of_messages, cache, session, timeout,
+                                                                     pool_size, title_index, generator, deadline):
+        results[position] = result
+    return results
 
 
-class PLGeneratorThread(Thread):
+def generate_multiple_playlists_as_completed(list_of_messages, cache, session=None, timeout=None,
+                                             pool_size=DEFAULT_POOL_SIZE, title_index=None, generator=None,
+                                             deadline=None):
     """
-    Class that provides threaded playlist generation. It takes one sentence off a queue and
-    processes them. Results are stored in the Thread object itself.
-    One of these Threads should be created for each message to be processed. Because of the average
-    long running time of querying the API, race conditions or deadlocks should be rare to non-existant. Should one of
-    the threads fail in some way, however, not all messages will be processed.
+    Like generate_multiple_playlists_threaded, but yields a (position, (playlist, incomplete)) tuple for each message
+    as soon as its playlist is done, where position is the index of the message. Playlists from the result cache
+    come first. Shortly after the deadline has passed, all remaining messages are yielded as empty and incomplete
     """
+    generator = generator or PlaylistGenerator(cache, session=session, title_index=title_index)
+    deadline = Deadline.earliest(deadline, Deadline(timeout) if timeout else None)
+    pool = get_pool('messages', pool_size)
+    done = Queue()
+    # We're processing multiple sentences, almost guaranteeing multiple playlist entries,
+    # se we can use max_chunk_length
+    cached = generator.cached_results(list_of_messages, True)
+    remaining = set()
+    for position, (message, result) in enumerate(zip(list_of_messages, cached)):
+        if result:
+            yield position, result
+        else:
+            remaining.add(position)
+            pool.apply_async(_generate_playlist, (generator, position, message, done, deadline))
+
+    give_up = Deadline.at(deadline.expires_at + DEADLINE_GRACE) if deadline else None
+    while remaining:
+        try:
+            position, result, error = done.get(True, give_up.remaining() if give_up else MAX_WAIT)
+        except Empty:
+            if give_up and give_up.expired():
+                break
+            continue
+        remaining.discard(position)
+        if error:
+            # Re-raise with the traceback of the pool thread
+            raise error[0], error[1], error[2]
+        yield position, result
+
+    for position in sorted(remaining):
+        logger.warn("Timed out generating playlist for message %d", position)
+        yield position, ([], True)
+
 
-    def __init__(self, queue, generator):
-        Thread.__init__(self)
-        self.queue = queue
-        self.generator = generator
-        self.payload = None
-        self.incomplete = True # If the Thread fails somehow, it should be considered incomplete
-        self.playlist = None
-        self.position = None
-
-    def run(self):
-        self.payload = self.queue.get()
-        self.position = self.payload[1]
-        print "running thread {}".format(str(self.position))
-        # We're processing multiple sentences, almost guaranteeing multiple playlist entries,
-        # se we can use max_chunk_length
-        self.playlist, self.incomplete = self.generator.generate_playlist(self.payload[0], True)
-        self.queue.task_done()
-
-
-def generate_multiple_playlists_threaded(list_of_messages, cache):
-    queue = Queue()
-    generator = PlaylistGenerator(cache)
-    # spawn a pool of threads, and pass them queue instance
-    threads = [PLGeneratorThread(queue, generator) for message in list_of_messages]
-    for thread in threads:
-        thread.setDaemon(True)
-        thread.start()
-
-    # populate queue with data, also providing a position so we can sort them back later
-    for x in range(len(list_of_messages)):
-        queue.put((list_of_messages[x], x))
-
-    # wait on the queue until everything has been processed
-    # NOTE: if a thread fails somehow (as in: doesn't execute at all), deadlock could occur, because part of the queue
-    # won't be processed.
-    queue.join()
-
-    return [(thread.playlist, thread.incomplete) for thread in sorted(threads, key=lambda thread: thread.position)]
-
-
-def generate_multiple_playlists_naive(list_of_messages, cache):
-    generator = PlaylistGenerator(cache)
+def _generate_playlist(generator, position, message, done, deadline):
+    # Runs on the pool. The result, or the exception, is handed back through the done queue, since Python 2's pools
+    # have no way of reporting exceptions of tasks nobody is waiting on
+    try:
+        done.put((position, generator.generate_playlist(message, True, deadline), None))
+    except Exception:
+        done.put((position, None, sys.exc_info()))
+
+
+def generate_multiple_playlists_naive(list_of_messages, cache, session=None, title_index=None, generator=None):
+    generator = generator or PlaylistGenerator(cache, session=session, title_index=title_index)
     results = [generator.generate_playlist(message) for message in list_of_messages]
     return results
-
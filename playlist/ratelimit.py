@@ -0,0 +1,130 @@
+"""
+Token bucket rate limiters for keeping the calls to the Spotify API under its rate limit
+"""
+
+__author__ = 'Daan Debie'
+
+import time
+from abc import ABCMeta
+from abc import abstractmethod
+from threading import Lock
+
+from deadline import DeadlineExceeded
+
+DEFAULT_RATE = 10
+DEFAULT_CAPACITY = 20
+
+
+class RateLimiter(object):
+    """
+    Abstract Base Class for rate limiters. acquire() blocks until a call is allowed, so under load requests
+    are queued briefly instead of being rejected by the API. Non-blocking callers can use try_acquire()
+    """
+    __metaclass__ = ABCMeta
+
+    def acquire(self, deadline=None):
+        """ Block until a call may be made. Raises DeadlineExceeded if that won't be before the (optional) deadline """
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            if deadline and wait >= deadline.remaining():
+                raise DeadlineExceeded()
+            time.sleep(wait)
+
+    @abstractmethod
+    def try_acquire(self):
+        """ Take a token if possible. Returns 0 if it did, otherwise the number of seconds to wait """
+        pass
+
+    @abstractmethod
+    def pause(self, seconds):
+        """ Don't allow any calls for the next number of seconds, ie. when the API sends a Retry-After header """
+        pass
+
+
+class TokenBucket(RateLimiter):
+    """
+    In-process token bucket that allows `rate` calls per second on average, with bursts of up to `capacity` calls.
+    Thread-safe, so it can be shared by all threads of a process
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_CAPACITY):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.timestamp = time.time()
+        self.paused_until = 0
+        self.lock = Lock()
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.time()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class RedisTokenBucket(RateLimiter):
+    """
+    Token bucket kept in Redis, so multiple worker processes (and hosts) share one rate limit.
+    Taking a token is done atomically by a Lua script. The database is a redis client, so the bucket can share the
+    connection of a RedisPlaylistCache (its `database` attribute)
+    """
+
+    ACQUIRE_SCRIPT = """
+        local paused = redis.call('PTTL', KEYS[2])
+        if paused > 0 then
+            return paused
+        end
+        local rate = tonumber(ARGV[1])
+        local capacity = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+        local tokens = tonumber(bucket[1]) or capacity
+        local timestamp = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = math.ceil((1 - tokens) / rate * 1000)
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'timestamp', tostring(now))
+        redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+        return wait
+    """
+
+    # A pause never shortens a longer one that another process or host started
+    PAUSE_SCRIPT = """
+        if redis.call('PTTL', KEYS[1]) < tonumber(ARGV[1]) then
+            redis.call('SET', KEYS[1], 1, 'PX', ARGV[1])
+        end
+    """
+
+    def __init__(self, database, rate=DEFAULT_RATE, capacity=DEFAULT_CAPACITY, key='ratelimit:spotify'):
+        self.database = database
+        self.rate = rate
+        self.capacity = capacity
+        self.key = key
+        self.pause_key = key + ':paused'
+        self.script = database.register_script(self.ACQUIRE_SCRIPT)
+        self.pause_script = database.register_script(self.PAUSE_SCRIPT)
+
+    def try_acquire(self):
+        wait = self.script(keys=[self.key, self.pause_key], args=[self.rate, self.capacity, repr(time.time())])
+        return wait / 1000.0
+
+    def pause(self, seconds):
+        milliseconds = int(seconds * 1000)
+        if milliseconds > 0:
+            self.pause_script(keys=[self.pause_key], args=[milliseconds])
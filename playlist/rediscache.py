@@ -1,32 +1,171 @@
+import logging
+
 import redis
 from cache import PlaylistCache
-from cache import PlaylistItem
-from datetime import datetime
+from cache import NEGATIVE_CACHE_TTL
+from cache import STALE_GRACE_PERIOD
+from cache import epoch_from_datetime
+from resultcache import RedisResultCache
+from serialization import decode_item
+from serialization import decode_legacy_fields
+from serialization import encode_item
+
+logger = logging.getLogger(__name__)
+
+
+def connection_pool_stats(pool):
+    """
+    Returns the usage of a redis BlockingConnectionPool: how many connections it may open, how many are open,
+    and how many of those are idle or in use
+    """
+    connections = len(pool._connections)
+    idle = len([connection for connection in list(pool.pool.queue) if connection is not None])
+    return {'max_connections': pool.max_connections, 'open': connections, 'idle': idle, 'in_use': connections - idle}
 
 
 class RedisPlaylistCache(PlaylistCache):
     """
-    Caching implementation based on Redis. It uses Redis hashes to store multiple values present in a PlaylistItem
-    on one key
+    Caching implementation based on Redis. Every PlaylistItem is stored as a single compact binary value (see
+    playlist.serialization). Items in the older format, a Redis hash per item, are still read, and rewritten in the
+    current format as they're read. Misses are stored as separate keys with a Redis-native expiry.
+    Every operation takes a single round trip, and items expire server-side once they're past their expiry date
+    plus the stale_grace_period (during which they can still be revalidated)
     """
 
-    def __init__(self, host='localhost', port=6379, database=0, password=None):
-        self.database = redis.StrictRedis(host=host, port=port, db=database, password=password)
+    MISS_PREFIX = 'miss:'
 
-    def get(self, key):
-        if self.database.exists(key):
-            last_modified = self.database.hget(key, 'last_modified')
-            expires = datetime.strptime(self.database.hget(key, 'expires'), '%Y-%m-%d %H:%M:%S.%f')
-            item = PlaylistItem(self.database.hget(key, 'name'), self.database.hget(key, 'uri'), last_modified, expires)
-            return item
+    def __init__(self, host='localhost', port=6379, database=0, password=None, negative_ttl=NEGATIVE_CACHE_TTL,
+                 stale_grace_period=STALE_GRACE_PERIOD, connection_pool=None):
+        if connection_pool:
+            # Connection settings come from the (shared) pool
+            self.database = redis.StrictRedis(connection_pool=connection_pool)
         else:
-            return None
+            self.database = redis.StrictRedis(host=host, port=port, db=database, password=password)
+        self.negative_ttl = negative_ttl
+        self.stale_grace_period = stale_grace_period
+
+    def get(self, key):
+        try:
+            return self._decode(key, self.database.get(key))
+        except redis.ResponseError as e:
+            if not self._is_legacy_item(e):
+                raise
+            return self._migrate([key]).get(key)
 
     def put(self, key, value):
-        self.database.hset(key, 'name', value.name)
-        self.database.hset(key, 'uri', value.uri)
-        self.database.hset(key, 'last_modified', value.last_modified)
-        self.database.hset(key, 'expires', value.expires)
+        pipe = self.database.pipeline()
+        self._queue_put(pipe, key, value)
+        pipe.execute()
 
     def remove(self, key):
-        self.database.delete(key)
\ No newline at end of file
+        self.database.delete(key)
+
+    def put_miss(self, key, ttl=None):
+        self.database.setex(self.MISS_PREFIX + key, ttl or self.negative_ttl, 1)
+
+    def is_miss(self, key):
+        return self.database.exists(self.MISS_PREFIX + key)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        items = {}
+        legacy_keys = []
+        for key, value in self._get_values(keys):
+            if isinstance(value, redis.ResponseError):
+                if not self._is_legacy_item(value):
+                    raise value
+                legacy_keys.append(key)
+                continue
+            item = self._decode(key, value)
+            if item:
+                items[key] = item
+        if legacy_keys:
+            items.update(self._migrate(legacy_keys))
+        return items
+
+    def put_many(self, items):
+        pipe = self.database.pipeline(transaction=False)
+        for key, value in items.iteritems():
+            self._queue_put(pipe, key, value)
+        pipe.execute()
+
+    def get_misses(self, keys):
+        if not keys:
+            return set()
+        flags = self.database.mget([self.MISS_PREFIX + key for key in keys])
+        return set(key for key, flag in zip(keys, flags) if flag is not None)
+
+    def put_misses(self, keys, ttl=None):
+        pipe = self.database.pipeline(transaction=False)
+        for key in keys:
+            pipe.setex(self.MISS_PREFIX + key, ttl or self.negative_ttl, 1)
+        pipe.execute()
+
+    def scan(self, include_misses=False, batch_size=1000):
+        """
+        Iterates over all items in the cache as (key, PlaylistItem) tuples, and optionally over all misses as
+        (key, None) tuples. Doesn't block the server like KEYS, but may skip or repeat keys that change meanwhile
+        """
+        batch = []
+        for key in self.database.scan_iter(count=batch_size):
+            # Results of a RedisResultCache sharing the database
+            if key.startswith(RedisResultCache.RESULT_PREFIX):
+                continue
+            if key.startswith(self.MISS_PREFIX):
+                if include_misses:
+                    yield key[len(self.MISS_PREFIX):], None
+                continue
+            batch.append(key)
+            if len(batch) >= batch_size:
+                for item in self.get_many(batch).iteritems():
+                    yield item
+                batch = []
+        for item in self.get_many(batch).iteritems():
+            yield item
+
+    def _queue_put(self, pipe, key, value):
+        # SET replaces the value whatever its type, so this also overwrites items in the legacy format
+        pipe.set(key, encode_item(value))
+        pipe.expireat(key, epoch_from_datetime(value.expires) + self.stale_grace_period)
+        pipe.delete(self.MISS_PREFIX + key)
+
+    def _get_values(self, keys):
+        """
+        Returns (key, value) tuples. Instead of a value, there's a ResponseError for keys holding a legacy hash
+        """
+        pipe = self.database.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+        return zip(keys, pipe.execute(raise_on_error=False))
+
+    def _migrate(self, keys):
+        """
+        Reads the items in the legacy format stored on the keys, and rewrites them in the current format.
+        Returns a dictionary with the items that were found
+        """
+        pipe = self.database.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        # Skip hashes that aren't items at all
+        items = dict((key, decode_legacy_fields(fields)) for key, fields in zip(keys, pipe.execute())
+                     if 'uri' in fields)
+        if items:
+            logger.debug("Migrating %d items to the current format", len(items))
+            self.put_many(items)
+        return items
+
+    @staticmethod
+    def _decode(key, value):
+        if value is None:
+            return None
+        try:
+            return decode_item(value)
+        except ValueError as e:
+            # Probably written by a newer version; treat it as not cached rather than failing
+            logger.warning("Can't decode cached item for '%s': %s", key, e)
+            return None
+
+    @staticmethod
+    def _is_legacy_item(error):
+        return str(error).startswith('WRONGTYPE')
@@ -0,0 +1,96 @@
+"""
+Caches for generated playlists, so a sentence that has been turned into a playlist before takes a single lookup
+instead of segmenting it again. A result is kept until the first of its items expires, or for at most a given time,
+since it also depends on titles that didn't match any track back then
+"""
+
+__author__ = 'Daan Debie'
+
+import logging
+from abc import ABCMeta
+from abc import abstractmethod
+
+from cache import MemPlaylistCache
+from cache import epoch_from_datetime
+from serialization import decode_result
+from serialization import encode_result
+
+DEFAULT_MAX_RESULTS = 10000
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache(object):
+    """
+    Abstract Base Class for caches of (playlist, incomplete) results
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def get_many(self, keys):
+        """ Get multiple results from the cache, as a dictionary containing only the keys that were found """
+        pass
+
+    @abstractmethod
+    def put(self, key, result, expires):
+        """ Put a result in the cache, until the expires datetime """
+        pass
+
+    def get(self, key):
+        """ Get a result from the cache, or None """
+        return self.get_many([key]).get(key)
+
+
+class CachedResult(object):
+    __slots__ = ('result', 'expires')
+
+    def __init__(self, result, expires):
+        self.result = result
+        self.expires = expires
+
+
+class MemResultCache(ResultCache):
+    """
+    In-memory result cache, holding at most max_results results. Thread-safe
+    """
+
+    def __init__(self, max_results=DEFAULT_MAX_RESULTS):
+        # Results are dropped as soon as they expire, there's nothing to revalidate
+        self.results = MemPlaylistCache(max_items=max_results, stale_grace_period=0)
+
+    def get_many(self, keys):
+        return dict((key, cached.result) for key, cached in self.results.get_many(keys).iteritems())
+
+    def put(self, key, result, expires):
+        self.results.put(key, CachedResult(result, expires))
+
+
+class RedisResultCache(ResultCache):
+    """
+    Result cache in Redis, storing every result as a single value (see playlist.serialization) that Redis expires.
+    The database is a redis client, so it can share the connections of a RedisPlaylistCache
+    """
+
+    RESULT_PREFIX = 'result:'
+
+    def __init__(self, database):
+        self.database = database
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        results = {}
+        for key, value in zip(keys, self.database.mget([self.RESULT_PREFIX + key for key in keys])):
+            if value is None:
+                continue
+            try:
+                results[key] = decode_result(value)
+            except ValueError as e:
+                logger.warning("Can't decode cached result for '%s': %s", key, e)
+        return results
+
+    def put(self, key, result, expires):
+        pipe = self.database.pipeline()
+        pipe.set(self.RESULT_PREFIX + key, encode_result(*result))
+        pipe.expireat(self.RESULT_PREFIX + key, epoch_from_datetime(expires))
+        pipe.execute()
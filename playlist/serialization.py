@@ -0,0 +1,98 @@
+"""
+Compact binary encoding of PlaylistItems, for caches that store an item as a single value, and of generated playlists.
+An encoded item is a fixed-size header (format, last_modified and expires as seconds since the epoch, and the
+length of the name) followed by the UTF-8 encoded name and the uri. The format byte in front of every value tells
+items and playlists apart, and which version of their format they're in. Readers refuse formats they don't know
+about, so neither can be mistaken for the other and the formats can be changed later without misreading old values
+"""
+
+__author__ = 'Daan Debie'
+
+import struct
+from datetime import datetime
+
+from cache import PlaylistItem
+from cache import datetime_from_epoch
+from cache import epoch_from_datetime
+
+ITEM_FORMAT = 1
+# Playlists were written with format 1 at first, like items, so those are refused now
+RESULT_FORMAT = 2
+# format, last_modified, expires, length of the name
+HEADER = struct.Struct('>BIIH')
+# format, incomplete, number of items; every item is preceded by its length
+RESULT_HEADER = struct.Struct('>BBH')
+RESULT_ITEM_LENGTH = struct.Struct('>H')
+# How datetimes were written by the hash-based format that preceded this one (with or without microseconds)
+LEGACY_DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+
+def encode_item(item):
+    """
+    Encodes a PlaylistItem into a byte string
+    """
+    name = item.name.encode('utf-8') if isinstance(item.name, unicode) else item.name
+    uri = item.uri.encode('utf-8') if isinstance(item.uri, unicode) else item.uri
+    header = HEADER.pack(ITEM_FORMAT, epoch_from_datetime(item.last_modified), epoch_from_datetime(item.expires),
+                         len(name))
+    return header + name + uri
+
+
+def decode_item(value):
+    """
+    Decodes a byte string created by encode_item into a PlaylistItem. Raises a ValueError if it isn't one
+    """
+    if len(value) < HEADER.size:
+        raise ValueError("Encoded PlaylistItem too short")
+    value_format, last_modified, expires, name_length = HEADER.unpack_from(value)
+    if value_format != ITEM_FORMAT:
+        raise ValueError("Unknown PlaylistItem format: {}".format(value_format))
+    name_end = HEADER.size + name_length
+    return PlaylistItem(value[HEADER.size:name_end].decode('utf-8'), value[name_end:],
+                        datetime_from_epoch(last_modified), datetime_from_epoch(expires))
+
+
+def decode_legacy_fields(fields):
+    """
+    Turns the fields of a PlaylistItem stored in the old, hash-based format into a PlaylistItem
+    """
+    return PlaylistItem(fields['name'].decode('utf-8'), fields['uri'], _parse_legacy_datetime(fields['last_modified']),
+                        _parse_legacy_datetime(fields['expires']))
+
+
+def _parse_legacy_datetime(value):
+    for date_format in LEGACY_DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError("Can't parse legacy datetime: {}".format(value))
+
+
+def encode_result(playlist, incomplete):
+    """
+    Encodes a generated playlist, a list of PlaylistItems, and whether it's incomplete into a byte string
+    """
+    encoded_items = [encode_item(item) for item in playlist]
+    return RESULT_HEADER.pack(RESULT_FORMAT, incomplete, len(encoded_items)) + \
+        ''.join(RESULT_ITEM_LENGTH.pack(len(encoded_item)) + encoded_item for encoded_item in encoded_items)
+
+
+def decode_result(value):
+    """
+    Decodes a byte string created by encode_result into a tuple (playlist, incomplete). Raises a ValueError if it
+    isn't one
+    """
+    if len(value) < RESULT_HEADER.size:
+        raise ValueError("Encoded result too short")
+    value_format, incomplete, count = RESULT_HEADER.unpack_from(value)
+    if value_format != RESULT_FORMAT:
+        raise ValueError("Unknown result format: {}".format(value_format))
+    playlist = []
+    offset = RESULT_HEADER.size
+    for _ in xrange(count):
+        length = RESULT_ITEM_LENGTH.unpack_from(value, offset)[0]
+        offset += RESULT_ITEM_LENGTH.size
+        playlist.append(decode_item(value[offset:offset + length]))
+        offset += length
+    return playlist, bool(incomplete)
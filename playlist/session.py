@@ -0,0 +1,160 @@
+"""
+A shared HTTP session for talking to the Spotify Web API, with connection pooling, keep-alive and retries
+"""
+
+__author__ = 'Daan Debie'
+
+import logging
+import time
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from deadline import DeadlineExceeded
+from metrics import get_default_metrics
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUSCODES = [429, 500, 502, 503, 504]
+
+logger = logging.getLogger(__name__)
+
+_default_session = None
+_default_session_lock = Lock()
+
+
+def get_default_session():
+    """
+    Returns the process-wide SpotifySession, creating it on first use
+    """
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = SpotifySession()
+        return _default_session
+
+
+class SpotifySession(object):
+    """
+    Wraps a requests Session so all API calls reuse a bounded pool of keep-alive connections instead of doing a new
+    TLS handshake for every search. Responses with a status code in RETRY_STATUSCODES, and failed connections, are
+    retried with exponential backoff, honouring the Retry-After header when the API sends one.
+    An optional RateLimiter is consulted before every call, and paused when the API says we're over its rate limit.
+    The status code and duration of every request are recorded in a Metrics (the process-wide one by default).
+    One instance can (and should) be shared between threads.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR, timeout=None, rate_limiter=None, metrics=None):
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics or get_default_metrics()
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.session = requests.Session()
+        # At most pool_size connections per host are kept alive, for as many hosts as requests pools by default. The
+        # pool doesn't block when they're all in use: requests 2.3 doesn't give back the connection of a request that
+        # timed out, so a blocking pool would run dry (and hang) once deadlines have cut short pool_size requests. The
+        # number of concurrent calls is bounded by the callers' worker pools and the rate limiter instead
+        adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=False)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, params=None, headers=None, deadline=None):
+        """
+        Does a GET request, retrying when the API is unavailable or rate limiting us.
+        After the last retry, the final response is returned as is. ApiUnavailable is raised if the request timed out,
+        or if the connection still failed after the last retry.
+        With a deadline, the request times out when the deadline passes, and isn't retried if there's no time left for
+        it. DeadlineExceeded is raised if no response could be had in time
+        """
+        attempt = 0
+        conditional = bool(headers and 'If-Modified-Since' in headers)
+        while True:
+            if deadline:
+                deadline.check()
+            if self.rate_limiter:
+                self.rate_limiter.acquire(deadline)
+            timeout = deadline.timeout(self.timeout) if deadline else self.timeout
+            start = time.time()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=timeout)
+            except requests.Timeout:
+                self._record(start, 'timeout', conditional)
+                if deadline and timeout != self.timeout:
+                    # It was the deadline that set the timeout
+                    raise DeadlineExceeded()
+                raise ApiUnavailable('timeout')
+            except requests.ConnectionError:
+                self._record(start, 'error', conditional)
+                if deadline and deadline.expired():
+                    raise DeadlineExceeded()
+                if attempt >= self.max_retries:
+                    raise ApiUnavailable('connection error')
+                response = None
+            else:
+                self._record(start, response.status_code, conditional)
+
+            if response is not None and (response.status_code not in RETRY_STATUSCODES or
+                                         attempt >= self.max_retries):
+                return response
+
+            if self.rate_limiter and response is not None and response.status_code == 429:
+                # Hold back every thread (or process) sharing the rate limiter, not just this one
+                self.rate_limiter.pause(retry_after_seconds(response) or self.backoff_factor)
+            delay = retry_delay(response, attempt, self.backoff_factor)
+            if deadline and delay >= deadline.remaining():
+                # No time to retry, so this is the final response
+                if response is None:
+                    raise DeadlineExceeded()
+                return response
+            logger.debug("Retrying request to %s in %.2f seconds (%s)", url, delay,
+                         response.status_code if response is not None else "connection error")
+            self.metrics.increment('spotify_api_retries_total')
+            time.sleep(delay)
+            attempt += 1
+
+    def _record(self, start, status, conditional):
+        self.metrics.observe('spotify_api_request_seconds', time.time() - start, conditional=str(conditional).lower())
+        self.metrics.increment('spotify_api_requests_total', status=status, conditional=str(conditional).lower())
+
+    def close(self):
+        self.session.close()
+
+
+def retry_after_seconds(response):
+    """
+    Returns the number of seconds the Retry-After header of a response asks us to wait, or None
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after and retry_after.strip().isdigit():
+        return int(retry_after)
+    return None
+
+
+def retry_delay(response, attempt, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+    """
+    Returns the number of seconds to wait before retrying: exponential backoff, or longer if Retry-After says so.
+    response is None when the connection failed
+    """
+    delay = backoff_factor * (2 ** attempt)
+    if response is not None:
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+    return delay
+
+
+class ApiException(Exception):
+    def __init__(self, status):
+        # Passing the status on makes the exception picklable, so it can be raised in a worker process
+        super(ApiException, self).__init__(status)
+        self.status = status
+
+
+class ApiUnavailable(ApiException):
+    """
+    Raised when the API couldn't be reached or didn't answer in time. The status is 'timeout' or 'connection error'
+    """
@@ -0,0 +1,67 @@
+"""
+Coalescing of identical calls that are in flight at the same time
+"""
+
+__author__ = 'Daan Debie'
+
+import sys
+from threading import Event
+from threading import Lock
+
+from deadline import DeadlineExceeded
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Makes sure there's only one outstanding call per key. Threads asking for a key that's already being worked on
+    wait for that call to finish and share its result, or its exception. Nothing is remembered once a call is done,
+    that's what the cache is for. Waiting threads give up with DeadlineExceeded when their deadline passes, and make
+    the call again when it was the deadline of the calling thread that cut it short
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Calls function(*args), or waits for the call for the same key that's in flight. Takes an optional deadline
+        keyword argument
+        """
+        deadline = kwargs.get('deadline')
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self.calls[key] = _Call()
+            if leader:
+                break
+
+            if not call.done.wait(deadline.remaining() if deadline else None):
+                raise DeadlineExceeded()
+            if call.exc_info:
+                if issubclass(call.exc_info[0], DeadlineExceeded) and not (deadline and deadline.expired()):
+                    # The call ran out of the time of the thread that made it, not of ours
+                    continue
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            return call.result
+
+        try:
+            call.result = function(*args)
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
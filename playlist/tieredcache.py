@@ -0,0 +1,74 @@
+from cache import PlaylistCache
+
+DEFAULT_STALENESS = 60
+
+
+class TieredPlaylistCache(PlaylistCache):
+    """
+    Composite cache that keeps a small in-process MemPlaylistCache (L1) in front of a shared cache such as
+    RedisPlaylistCache (L2). Reads go to L1 first and fall through to L2, copying what they find into L1.
+    Writes go to both. Entries are kept in L1 for at most `staleness` seconds, so changes made in L2 by other
+    processes are picked up within that window
+    """
+
+    def __init__(self, l1, l2, staleness=DEFAULT_STALENESS):
+        self.l1 = l1
+        self.l2 = l2
+        self.staleness = staleness
+
+    def get(self, key):
+        item = self.l1.get(key)
+        if item is None:
+            item = self.l2.get(key)
+            if item is not None:
+                self.l1.put(key, item, self.staleness)
+        return item
+
+    def put(self, key, value):
+        self.l2.put(key, value)
+        self.l1.put(key, value, self.staleness)
+
+    def remove(self, key):
+        self.l2.remove(key)
+        self.l1.remove(key)
+
+    def put_miss(self, key, ttl=None):
+        self.l2.put_miss(key, ttl)
+        self.l1.put_miss(key, self._l1_ttl(ttl))
+
+    def is_miss(self, key):
+        if self.l1.is_miss(key):
+            return True
+        if self.l2.is_miss(key):
+            self.l1.put_miss(key, self.staleness)
+            return True
+        return False
+
+    def get_many(self, keys):
+        items = self.l1.get_many(keys)
+        missing_keys = [key for key in keys if key not in items]
+        if missing_keys:
+            l2_items = self.l2.get_many(missing_keys)
+            self.l1.put_many(l2_items, self.staleness)
+            items.update(l2_items)
+        return items
+
+    def put_many(self, items):
+        self.l2.put_many(items)
+        self.l1.put_many(items, self.staleness)
+
+    def get_misses(self, keys):
+        misses = self.l1.get_misses(keys)
+        unknown_keys = [key for key in keys if key not in misses]
+        if unknown_keys:
+            l2_misses = self.l2.get_misses(unknown_keys)
+            self.l1.put_misses(l2_misses, self.staleness)
+            misses.update(l2_misses)
+        return misses
+
+    def put_misses(self, keys, ttl=None):
+        self.l2.put_misses(keys, ttl)
+        self.l1.put_misses(keys, self._l1_ttl(ttl))
+
+    def _l1_ttl(self, ttl):
+        return min(ttl if ttl is not None else self.l1.negative_ttl, self.staleness)
@@ -0,0 +1,224 @@
+"""
+An offline index of titles, so the spans of a message can be resolved locally instead of by asking the Spotify API.
+
+The index is a single file of records sorted by title, preceded by a table with the offset of every record. It's
+memory-mapped when opened, so opening it takes constant time no matter how big it is, and the OS keeps the pages that
+are actually used in memory. Looking up a title is a binary search over the offset table.
+Every record holds an encoded PlaylistItem, or nothing for a title that's known not to match any track
+"""
+
+__author__ = 'Daan Debie'
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from datetime import datetime
+from datetime import timedelta
+
+from cache import PlaylistItem
+from cache import datetime_from_epoch
+from message_tools import title_from_words
+from serialization import decode_item
+from serialization import encode_item
+
+MAGIC = 'PLTI'
+FORMAT_VERSION = 1
+# magic, version, number of records
+HEADER = struct.Struct('>4sBI')
+OFFSET = struct.Struct('>I')
+# length of the title, length of the encoded item (0 for a miss)
+RECORD = struct.Struct('>HH')
+# How long the items of a freshly built index are considered fresh for, in seconds
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+
+class TitleIndex(object):
+    """
+    Read-only view of an index file. Like the caches, it tells apart titles it doesn't know about from titles it knows
+    don't match any track. Can be shared by all threads of a process
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as index_file:
+            self.map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.map.close()
+            raise ValueError("{} is not a title index of version {}".format(path, FORMAT_VERSION))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """ Iterates over all (title, PlaylistItem or None) tuples, in order of title """
+        for position in xrange(self.count):
+            yield self._record(position)
+
+    def lookup(self, title):
+        """
+        Returns a tuple (known, item). known is False if the title isn't in the index
+        """
+        title = _encode_title(title)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self._offset(middle)
+            title_length = RECORD.unpack_from(self.map, offset)[0]
+            start = offset + RECORD.size
+            middle_title = self.map[start:start + title_length]
+            if middle_title < title:
+                low = middle + 1
+            elif middle_title > title:
+                high = middle
+            else:
+                return True, self._record(middle)[1]
+        return False, None
+
+    def get_many(self, titles):
+        """
+        Returns a dictionary mapping the titles that are in the index to their PlaylistItem, or None if they're known
+        not to match any track
+        """
+        found = {}
+        for title in titles:
+            known, item = self.lookup(title)
+            if known:
+                found[title] = item
+        return found
+
+    def close(self):
+        self.map.close()
+
+    def _offset(self, position):
+        return OFFSET.unpack_from(self.map, HEADER.size + position * OFFSET.size)[0]
+
+    def _record(self, position):
+        offset = self._offset(position)
+        title_length, item_length = RECORD.unpack_from(self.map, offset)
+        start = offset + RECORD.size
+        title = self.map[start:start + title_length].decode('utf-8')
+        item = decode_item(self.map[start + title_length:start + title_length + item_length]) if item_length else None
+        return title, item
+
+
+def write_index(path, entries):
+    """
+    Writes (title, PlaylistItem or None) tuples to a new index file. Entries with the same title are kept once, the
+    last one winning. The file is replaced atomically, so processes that have the old index open keep using it
+    """
+    latest = {}
+    for title, item in entries:
+        latest[_encode_title(title)] = item
+    _write_sorted(path, sorted(latest.iteritems()))
+
+
+def update_index(path, entries):
+    """
+    Merges (title, PlaylistItem or None) tuples into an existing index file, or creates it if there isn't one.
+    New entries replace existing ones for the same title. Only the new entries are held in memory: the existing index
+    is streamed, since both are sorted
+    """
+    if not os.path.exists(path):
+        return write_index(path, entries)
+    latest = {}
+    for title, item in entries:
+        latest[_encode_title(title)] = item
+    index = TitleIndex(path)
+    try:
+        existing = ((_encode_title(title), item) for title, item in index)
+        _write_sorted(path, _merge(existing, sorted(latest.iteritems())))
+    finally:
+        index.close()
+
+
+def entries_from_export(lines, ttl=DEFAULT_TTL):
+    """
+    Reads exported search results: JSON objects, one per line, with a title and the name and uri of the matching track
+    (or no uri if the title doesn't match any track). Titles are normalised like the words of a message. last_modified
+    and expires can be given in seconds since the epoch. last_modified defaults to now, expires to ttl seconds from now
+    """
+    now = datetime.utcnow().replace(microsecond=0)
+    fresh_until = now + timedelta(seconds=ttl)
+    for line in lines:
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        # Titles are looked up the way the generators normalise them
+        title = title_from_words(result['title'].split())
+        if not result.get('uri'):
+            yield title, None
+            continue
+        last_modified = datetime_from_epoch(result['last_modified']) if 'last_modified' in result else now
+        expires = datetime_from_epoch(result['expires']) if 'expires' in result else fresh_until
+        yield title, PlaylistItem(result.get('name', result['title']), result['uri'], last_modified, expires)
+
+
+def fresh_for(entries, ttl=DEFAULT_TTL):
+    """
+    Makes the items of (title, PlaylistItem or None) tuples expire no sooner than ttl seconds from now. The index
+    serves its items whether they have expired or not, so their expiry only bounds how long the results they end up
+    in are cached
+    """
+    fresh_until = datetime.utcnow().replace(microsecond=0) + timedelta(seconds=ttl)
+    for title, item in entries:
+        if item and item.expires < fresh_until:
+            item = PlaylistItem(item.name, item.uri, item.last_modified, fresh_until)
+        yield title, item
+
+
+def _encode_title(title):
+    return title.encode('utf-8') if isinstance(title, unicode) else title
+
+
+def _merge(existing, new):
+    """
+    Merges two iterators of (title, item) tuples sorted by title, preferring the new entry when both have a title
+    """
+    existing, new = iter(existing), iter(new)
+    current_existing, current_new = next(existing, None), next(new, None)
+    while current_existing is not None or current_new is not None:
+        if current_new is None or (current_existing is not None and current_existing[0] < current_new[0]):
+            yield current_existing
+            current_existing = next(existing, None)
+        else:
+            if current_existing is not None and current_existing[0] == current_new[0]:
+                current_existing = next(existing, None)
+            yield current_new
+            current_new = next(new, None)
+
+
+def _write_sorted(path, entries):
+    """
+    Writes (title, item) tuples, sorted by title, to an index file. Records are written to a scratch file first,
+    since the offset table in front of them can only be written once all of them are known
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    offsets = array('I')
+    with tempfile.TemporaryFile(dir=directory) as records:
+        position = 0
+        for title, item in entries:
+            encoded_item = encode_item(item) if item else ''
+            records.write(RECORD.pack(len(title), len(encoded_item)) + title + encoded_item)
+            offsets.append(position)
+            position += RECORD.size + len(title) + len(encoded_item)
+
+        records_start = HEADER.size + len(offsets) * OFFSET.size
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as index_file:
+                index_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(offsets)))
+                for offset in offsets:
+                    index_file.write(OFFSET.pack(records_start + offset))
+                records.seek(0)
+                shutil.copyfileobj(records, index_file)
+            # mkstemp only makes the file readable for its owner
+            os.chmod(temporary_path, 0644)
+            os.rename(temporary_path, path)
+        except:
+            os.remove(temporary_path)
+            raise
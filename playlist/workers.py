@@ -0,0 +1,103 @@
+"""
+Shared, bounded pools of worker threads for doing I/O bound work concurrently
+"""
+
+__author__ = 'Daan Debie'
+
+import logging
+import os
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+# Keys of the background tasks pending per pool name
+_pending = {}
+_pools_pid = os.getpid()
+_pools_lock = Lock()
+
+
+def get_pool(name, size):
+    """
+    Returns the process-wide ThreadPool with the given name and size, creating it on first use.
+    Pools live as long as the process, so they can be reused across messages and requests
+    """
+    with _pools_lock:
+        _forget_parent_pools()
+        pool = _pools.get((name, size))
+        if pool is None:
+            pool = _pools[(name, size)] = ThreadPool(size)
+        return pool
+
+
+def _pending_tasks(name):
+    """
+    Returns the process-wide set of keys of the background tasks pending on the pools with the given name. Call with
+    _pools_lock held
+    """
+    _forget_parent_pools()
+    return _pending.setdefault(name, set())
+
+
+def _forget_parent_pools():
+    global _pools, _pending, _pools_pid
+    if _pools_pid != os.getpid():
+        # The threads of the pools don't survive a fork, so a forked process (ie. a worker of a process pool)
+        # needs pools of its own. The tasks pending in the parent will never finish here
+        _pools = {}
+        _pending = {}
+        _pools_pid = os.getpid()
+
+
+def map_concurrently(function, items, workers, name='default'):
+    """
+    Applies function to every item using at most `workers` threads and returns the results in the same order.
+    Exceptions raised by function are propagated to the caller
+    """
+    if not items:
+        return []
+    if len(items) == 1:
+        return [function(items[0])]
+    return get_pool(name, workers).map(function, items)
+
+
+class BackgroundTasks(object):
+    """
+    Runs tasks on a shared pool of `workers` threads without waiting for them to finish. A task is skipped when one
+    with the same key is still pending, or when there are max_pending tasks pending already, so the backlog stays
+    bounded. Which tasks are pending is kept per name, so all instances with the same name (ie. the refresher of the
+    app and the default one of the generators) skip each other's tasks. Exceptions raised by tasks are logged
+    """
+
+    def __init__(self, name, workers, max_pending):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+
+    @property
+    def pending(self):
+        """ The keys of the tasks pending for this name """
+        with _pools_lock:
+            return set(_pending_tasks(self.name))
+
+    def submit(self, key, function, *args):
+        """
+        Schedules function(*args) to run in the background. Returns False if the task was skipped
+        """
+        with _pools_lock:
+            pending = _pending_tasks(self.name)
+            if key in pending or len(pending) >= self.max_pending:
+                return False
+            pending.add(key)
+        get_pool(self.name, self.workers).apply_async(self._run, (key, function) + args)
+        return True
+
+    def _run(self, key, function, *args):
+        try:
+            function(*args)
+        except Exception:
+            logger.exception("Background task for '%s' failed", key)
+        finally:
+            with _pools_lock:
+                _pending_tasks(self.name).discard(key)
@@ -0,0 +1,106 @@
+__author__ = 'Daan Debie'
+
+import json
+import logging
+import unittest
+
+from autoplaylistpoetry import create_app
+from benchmarks.fakespotify import FakeSpotify
+from playlist.cache import MemPlaylistCache
+from playlist.session import SpotifySession
+from tests.test_session import closed_port
+
+
+def create_test_app(search_url):
+    """
+    Returns the app, talking to the stand-in without a rate limit, and with in-process caches instead of Redis
+    """
+    app = create_app()
+    # The app's logging config shows everything down to DEBUG
+    logging.getLogger().setLevel(logging.WARN)
+    app.config['TESTING'] = True
+    app.config['SPOTIFY_SEARCH_URL'] = search_url
+    app.extensions['spotify_session'] = SpotifySession(max_retries=0)
+    app.extensions['redis_cache'] = MemPlaylistCache()
+    app.extensions.pop('result_cache', None)
+    return app
+
+
+class BatchApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSpotify(latency=0).start()
+        self.app = create_test_app(self.fake.url)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def post(self, data):
+        response = self.client.post('/api/playlists', data=json.dumps(data), content_type='application/json')
+        return json.loads(response.data)
+
+    def test_results_like_single_messages(self):
+        messages = ['love you baby tonight we dance in the rain', 'hold the light. stay with me', 'stay']
+        payload = self.post({'messages': messages})
+        self.assertTrue(payload['success'])
+        singles = [json.loads(self.client.get('/api/playlist', query_string={'message': message}).data)
+                   for message in messages]
+        self.assertEqual(singles, payload['results'])
+
+    def test_empty_message(self):
+        payload = self.post({'messages': ['', 'love']})
+        self.assertEqual({'error': True, 'message': "No message provided!"}, payload['results'][0])
+        self.assertTrue(payload['results'][1]['success'])
+
+    def test_too_many_messages(self):
+        payload = self.post({'messages': ['love'] * (self.app.config['API_BATCH_MAX_MESSAGES'] + 1)})
+        self.assertTrue(payload['error'])
+        self.assertEqual(0, self.fake.stats()['calls'])
+
+    def test_not_a_list_of_messages(self):
+        for data in ({'messages': 'love'}, {'messages': [1]}, ['love']):
+            self.assertTrue(self.post(data)['error'])
+
+
+class StreamApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSpotify(latency=0).start()
+        self.client = create_test_app(self.fake.url).test_client()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def stream(self, message):
+        response = self.client.get('/api/playlist/stream', query_string={'message': message})
+        self.assertEqual('application/x-ndjson', response.mimetype)
+        self.assertTrue(response.data.endswith('\n'))
+        return [json.loads(line) for line in response.data.split('\n')[:-1]]
+
+    def test_a_line_per_sentence_then_success(self):
+        sentences = ['love you baby tonight', 'hold the light', 'stay']
+        lines = self.stream('. '.join(sentences))
+        self.assertEqual(len(sentences) + 1, len(lines))
+        self.assertEqual([0, 1, 2], sorted(line['position'] for line in lines[:-1]))
+        playlists = {}
+        for line in lines[:-1]:
+            self.assertEqual(len(sentences), line['total'])
+            self.assertEqual(sentences[line['position']].strip(), line['sentence'].strip())
+            playlists[line['position']] = line['playlist']
+        single = json.loads(self.client.get('/api/playlist', query_string={'message': '. '.join(sentences)}).data)
+        self.assertEqual(single['playlist'], sum((playlists[position] for position in range(3)), []))
+        self.assertEqual({'success': True, 'partial': any(line['partial'] for line in lines[:-1])}, lines[-1])
+
+    def test_no_message(self):
+        self.assertEqual([{'error': True, 'message': "No message provided!"}], self.stream(''))
+
+    def test_api_error_ends_the_stream(self):
+        self.client = create_test_app('http://127.0.0.1:{}/v1/search'.format(closed_port())).test_client()
+        lines = self.stream('love you. baby')
+        self.assertTrue(lines[-1]['error'])
+        self.assertNotIn('success', lines[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
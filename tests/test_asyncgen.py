@@ -0,0 +1,150 @@
+__author__ = 'Daan Debie'
+
+import threading
+import unittest
+from datetime import datetime
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPResponse
+from tornado.ioloop import IOLoop
+
+from benchmarks.fakespotify import FakeSpotify
+from playlist.asyncgen import AsyncCacheAdapter
+from playlist.asyncgen import AsyncPlaylistGenerator
+from playlist.cache import MemPlaylistCache
+from playlist.deadline import Deadline
+from playlist.generator import ApiException
+from playlist.generator import PlaylistGenerator
+from playlist.ratelimit import RedisTokenBucket
+from playlist.ratelimit import TokenBucket
+from playlist.session import SpotifySession
+from tests.test_generator import WaveTest
+from tests.test_generator import expired_item
+from tests.test_generator import matched_title
+from tests.test_generator import names
+from tests.test_generator import unmatched_title
+from tests.test_plprocessing import redis_test_database
+
+
+class AsyncRevalidationTest(unittest.TestCase):
+
+    def start(self, not_modified_ratio):
+        self.fake = FakeSpotify(not_modified_ratio=not_modified_ratio).start()
+        self.cache = MemPlaylistCache()
+        self.generator = AsyncPlaylistGenerator(AsyncCacheAdapter(self.cache), search_url=self.fake.url)
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def resolve(self, title):
+        return IOLoop.current().run_sync(lambda: self.generator.resolve_titles([title]))[title]
+
+    def test_not_modified_extends_expiry(self):
+        self.start(not_modified_ratio=1)
+        title = matched_title()
+        self.cache.put(title, expired_item(title))
+        item = self.resolve(title)
+        self.assertGreater(item.expires, datetime.utcnow())
+        self.assertFalse(self.cache.get(title).is_expired())
+        self.resolve(title)
+        self.assertEqual(1, self.fake.stats()['calls'])
+
+    def test_modified_item_comes_from_the_response(self):
+        self.start(not_modified_ratio=0)
+        title = matched_title()
+        self.cache.put(title, expired_item(title))
+        item = self.resolve(title)
+        self.assertFalse(item.is_expired())
+        self.assertEqual(1, self.fake.stats()['calls'])
+
+    def test_gone_item_is_not_searched_again(self):
+        self.start(not_modified_ratio=0)
+        title = unmatched_title()
+        self.cache.put(title, expired_item(title))
+        self.assertIsNone(self.resolve(title))
+        self.assertEqual(1, self.fake.stats()['calls'])
+        self.assertTrue(self.cache.is_miss(title))
+
+
+class ThreadRecordingBucket(RedisTokenBucket):
+
+    def __init__(self, database):
+        RedisTokenBucket.__init__(self, database)
+        self.threads = set()
+
+    def try_acquire(self):
+        self.threads.add(threading.current_thread())
+        return RedisTokenBucket.try_acquire(self)
+
+
+class AsyncRateLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        database = redis_test_database(self)
+        self.fake = FakeSpotify().start()
+        self.addCleanup(self.fake.stop)
+        self.rate_limiter = ThreadRecordingBucket(database)
+
+    def test_redis_rate_limiter_is_called_off_the_loop(self):
+        generator = AsyncPlaylistGenerator(rate_limiter=self.rate_limiter, search_url=self.fake.url)
+        IOLoop.current().run_sync(lambda: generator.resolve_titles(['love', 'baby']))
+        self.assertEqual(2, self.fake.stats()['calls'])
+        self.assertTrue(self.rate_limiter.threads)
+        self.assertNotIn(threading.current_thread(), self.rate_limiter.threads)
+
+
+class AsyncWaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fakes = [FakeSpotify().start(), FakeSpotify().start()]
+
+    def tearDown(self):
+        for fake in self.fakes:
+            fake.stop()
+
+    def test_like_lazy(self):
+        lazy = PlaylistGenerator(session=SpotifySession(), search_url=self.fakes[0].url)
+        waves = AsyncPlaylistGenerator(search_url=self.fakes[1].url)
+        for message in WaveTest.messages:
+            self.assertEqual(names(lazy.generate_playlist(message)),
+                             names(IOLoop.current().run_sync(lambda: waves.generate_playlist(message))))
+        lazy_calls, wave_calls = [fake.stats()['calls'] for fake in self.fakes]
+        self.assertLessEqual(wave_calls, lazy_calls + len(WaveTest.messages[0].split()))
+
+
+class FailingClient(object):
+    """ Answers the search for 'love' right away with an error, and never answers other searches """
+
+    def fetch(self, request, raise_error=True):
+        future = Future()
+        if 'q=love' in request.url:
+            future.set_result(HTTPResponse(request, 400))
+        return future
+
+
+class AsyncDeadlineTest(unittest.TestCase):
+
+    def test_failed_search_is_raised(self):
+        generator = AsyncPlaylistGenerator(http_client=FailingClient())
+        with self.assertRaises(ApiException):
+            IOLoop.current().run_sync(lambda: generator.resolve_titles(['love', 'baby'], Deadline(0.2)))
+
+    def test_rate_limiter_waits_stop_at_the_deadline(self):
+        fake = FakeSpotify(latency=0).start()
+        self.addCleanup(fake.stop)
+        generator = AsyncPlaylistGenerator(rate_limiter=TokenBucket(rate=1, capacity=1), search_url=fake.url)
+
+        @gen.coroutine
+        def resolve_and_wait():
+            resolved = yield generator.resolve_titles(['love', 'baby'], Deadline(0.3))
+            # Long enough for a search that kept waiting for the rate limiter to be done
+            yield gen.sleep(1.2)
+            raise gen.Return(resolved)
+
+        self.assertEqual(1, len(IOLoop.current().run_sync(resolve_and_wait)))
+        self.assertEqual(1, fake.stats()['calls'])
+
+
+if __name__ == '__main__':
+    unittest.main()
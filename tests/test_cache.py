@@ -0,0 +1,98 @@
+__author__ = 'Daan Debie'
+
+import time
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+from playlist.cache import MemPlaylistCache
+from playlist.cache import PURGE_INTERVAL
+from playlist.cache import PlaylistItem
+from tests.test_generator import expired_item
+
+
+def fresh_item(title):
+    now = datetime.utcnow()
+    return PlaylistItem(title.title(), 'spotify:track:' + title, now, now + timedelta(hours=1))
+
+
+class NegativeCacheTests(object):
+    """ Tests of remembering misses, for every kind of cache. setUp puts an empty cache in self.cache """
+
+    # A TTL short enough to wait for, in seconds. Redis only takes whole seconds
+    short_ttl = 1
+
+    def test_miss_is_remembered(self):
+        self.cache.put_miss('baby')
+        self.cache.put_misses(['rain'])
+        self.assertTrue(self.cache.is_miss('baby'))
+        self.assertFalse(self.cache.is_miss('love'))
+        self.assertEqual({'baby', 'rain'}, self.cache.get_misses(['baby', 'love', 'rain']))
+        self.assertIsNone(self.cache.get('baby'))
+
+    def test_miss_expires(self):
+        self.cache.put_miss('baby', self.short_ttl)
+        self.cache.put_misses(['rain'], self.short_ttl)
+        time.sleep(self.short_ttl + 0.1)
+        self.assertFalse(self.cache.is_miss('baby'))
+        self.assertEqual(set(), self.cache.get_misses(['baby', 'rain']))
+
+    def test_put_clears_miss(self):
+        self.cache.put_miss('love')
+        self.cache.put_misses(['rain'])
+        self.cache.put('love', fresh_item('love'))
+        self.cache.put_many({'rain': fresh_item('rain')})
+        self.assertFalse(self.cache.is_miss('love'))
+        self.assertEqual(set(), self.cache.get_misses(['love', 'rain']))
+        self.assertEqual('Love', self.cache.get('love').name)
+
+
+class MemPlaylistCacheTest(NegativeCacheTests, unittest.TestCase):
+
+    short_ttl = 0.1
+
+    def setUp(self):
+        self.cache = MemPlaylistCache(max_items=2, stale_grace_period=0)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put('love', fresh_item('love'))
+        self.cache.put_miss('baby')
+        self.cache.get('love')
+        self.cache.put('rain', fresh_item('rain'))
+        self.assertIsNotNone(self.cache.get('love'))
+        self.assertFalse(self.cache.is_miss('baby'))
+        self.assertIsNotNone(self.cache.get('rain'))
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_expired_entries_are_dropped(self):
+        self.cache.put('love', expired_item('love'))
+        self.cache.put_miss('baby', 0)
+        self.assertIsNone(self.cache.get('love'))
+        self.assertFalse(self.cache.is_miss('baby'))
+        self.assertEqual(2, self.cache.stats()['expirations'])
+
+    def test_expired_entries_are_purged_when_not_full(self):
+        self.cache = MemPlaylistCache(stale_grace_period=0)
+        self.cache.put('love', expired_item('love'))
+        self.cache.put_miss('baby', 0)
+        self.cache.last_purge -= PURGE_INTERVAL * 2
+        self.cache.put('rain', fresh_item('rain'))
+        self.assertEqual(1, self.cache.stats()['size'])
+        self.cache.put('love', expired_item('love'))
+        self.cache.last_purge -= PURGE_INTERVAL * 2
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['size'])
+        self.assertEqual(3, stats['expirations'])
+        self.assertEqual(0, stats['evictions'])
+
+    def test_hits_and_misses_are_counted(self):
+        self.cache.put('love', fresh_item('love'))
+        self.cache.get('love')
+        self.cache.get_many(['love', 'baby'])
+        self.cache.get('rain')
+        stats = self.cache.stats()
+        self.assertEqual((2, 2), (stats['hits'], stats['misses']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+__author__ = 'Daan Debie'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from playlist.checkpoint import read_checkpoint
+from playlist.checkpoint import write_checkpoint
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing_checkpoint_is_all_zeros(self):
+        self.assertEqual((0, 0), read_checkpoint(self.path, 2))
+        self.assertEqual((0, 0), read_checkpoint(None, 2))
+
+    def test_numbers_are_read_back(self):
+        write_checkpoint(self.path, 12, 3456)
+        self.assertEqual((12, 3456), read_checkpoint(self.path, 2))
+        write_checkpoint(self.path, 13, 3500)
+        self.assertEqual((13, 3500), read_checkpoint(self.path, 2))
+        self.assertEqual(['checkpoint'], os.listdir(self.directory))
+
+    def test_checkpoint_with_other_numbers_is_refused(self):
+        write_checkpoint(self.path, 12)
+        self.assertRaises(ValueError, read_checkpoint, self.path, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+__author__ = 'Daan Debie'
+
+import threading
+import time
+import unittest
+
+from tornado.ioloop import IOLoop
+
+from benchmarks.fakespotify import FakeSpotify
+from playlist.asyncgen import AsyncPlaylistGenerator
+from playlist.deadline import Deadline
+from playlist.deadline import DeadlineExceeded
+from playlist.generator import PlaylistGenerator
+from playlist.session import SpotifySession
+from playlist.singleflight import SingleFlight
+
+MESSAGE = 'love you baby tonight we dance in the rain'
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def test_timeout_is_the_time_left_at_most(self):
+        self.assertEqual(1, Deadline(10).timeout(1))
+        self.assertLessEqual(Deadline(10).timeout(), 10)
+        self.assertEqual(0, Deadline(-1).timeout(1))
+
+    def test_earliest(self):
+        soon, later = Deadline(1), Deadline(10)
+        self.assertIs(soon, Deadline.earliest(later, None, soon))
+        self.assertIsNone(Deadline.earliest(None, None))
+
+    def test_check(self):
+        Deadline(10).check()
+        self.assertRaises(DeadlineExceeded, Deadline(-1).check)
+
+
+class SingleFlightDeadlineTest(unittest.TestCase):
+
+    def test_call_cut_short_by_another_deadline_is_made_again(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def out_of_time():
+            started.set()
+            release.wait()
+            raise DeadlineExceeded()
+
+        leader = threading.Thread(target=self.assertRaises, args=(DeadlineExceeded, flight.do, 'love', out_of_time))
+        leader.start()
+        started.wait()
+        results = []
+        follower = threading.Thread(target=lambda: results.append(flight.do('love', lambda: 'Love',
+                                                                            deadline=Deadline(10))))
+        follower.start()
+        # Give the follower the time to start waiting for the leader's call
+        time.sleep(0.1)
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(['Love'], results)
+
+
+class GeneratorDeadlineTest(unittest.TestCase):
+    """ Against a stand-in that takes longer to answer a search than the deadline allows """
+
+    def setUp(self):
+        self.fake = FakeSpotify(latency=0.5).start()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def assert_partial_in_time(self, generate):
+        start = time.time()
+        playlist, incomplete = generate()
+        self.assertLess(time.time() - start, 1.0)
+        self.assertTrue(incomplete)
+
+    def test_deadline(self):
+        generator = PlaylistGenerator(session=SpotifySession(), search_url=self.fake.url)
+        self.assert_partial_in_time(lambda: generator.generate_playlist(MESSAGE, deadline=Deadline(0.2)))
+
+    def test_timeout(self):
+        generator = PlaylistGenerator(session=SpotifySession(), search_url=self.fake.url, timeout=0.2)
+        self.assert_partial_in_time(lambda: generator.generate_playlist(MESSAGE))
+
+    def test_prefetch(self):
+        generator = PlaylistGenerator(prefetch=True, session=SpotifySession(), search_url=self.fake.url)
+        self.assert_partial_in_time(lambda: generator.generate_playlist(MESSAGE, deadline=Deadline(0.2)))
+
+    def test_async(self):
+        generator = AsyncPlaylistGenerator(search_url=self.fake.url)
+        self.assert_partial_in_time(lambda: IOLoop.current().run_sync(
+            lambda: generator.generate_playlist(MESSAGE, deadline=Deadline(0.2))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+__author__ = 'Daan Debie'
+
+import threading
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+from benchmarks.fakespotify import FakeSpotify
+from benchmarks.fakespotify import title_matches
+from playlist.cache import MemPlaylistCache
+from playlist.cache import PlaylistItem
+from playlist.deadline import Deadline
+from playlist.generator import ENGINE_CHUNKER
+from playlist.generator import ENGINE_DP
+from playlist.generator import PlaylistGenerator
+from playlist.session import SpotifySession
+
+
+def expired_item(title):
+    an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+    return PlaylistItem(title.title(), 'spotify:track:' + title, an_hour_ago, an_hour_ago)
+
+
+def names(result):
+    playlist, incomplete = result
+    return [item.name for item in playlist], incomplete
+
+
+def matched_title():
+    """ Returns a title the stand-in has a track for """
+    return next(title for title in ('love', 'baby', 'heart', 'night', 'fire', 'rain') if title_matches(title))
+
+
+def unmatched_title():
+    """ Returns a title the stand-in has no track for """
+    return next(title for title in ('love', 'baby', 'heart', 'night', 'fire', 'rain') if not title_matches(title))
+
+
+class SearchFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fakes = [FakeSpotify(latency=0.2).start(), FakeSpotify(latency=0.2).start()]
+
+    def tearDown(self):
+        for fake in self.fakes:
+            fake.stop()
+
+    def test_searches_with_different_apis_are_not_shared(self):
+        generators = [PlaylistGenerator(search_url=fake.url) for fake in self.fakes]
+        threads = [threading.Thread(target=generator.resolve_titles, args=(['love'],)) for generator in generators]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([1, 1], [fake.stats()['calls'] for fake in self.fakes])
+
+
+class RevalidationTest(unittest.TestCase):
+
+    def setUp(self):
+        # Conditional requests are answered with a regular search result
+        self.fake = FakeSpotify(not_modified_ratio=0).start()
+        self.cache = MemPlaylistCache()
+        self.generator = PlaylistGenerator(self.cache, search_url=self.fake.url)
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_gone_item_is_not_searched_again(self):
+        title = unmatched_title()
+        self.cache.put(title, expired_item(title))
+        self.assertEqual({title: None}, self.generator.resolve_titles([title]))
+        self.assertEqual(1, self.fake.stats()['calls'])
+        self.assertTrue(self.cache.is_miss(title))
+
+
+class BatchDeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        # Slower than the time allowed per message
+        self.fake = FakeSpotify(latency=0.5).start()
+        self.generator = PlaylistGenerator(search_url=self.fake.url, timeout=0.3)
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_timeout_applies_to_every_message(self):
+        title = matched_title()
+        results = self.generator.generate_playlists([(title, False), (title + ' ' + title, False)], Deadline(5))
+        self.assertEqual([False, False], [incomplete for playlist, incomplete in results])
+        self.assertEqual([1, 2], [len(playlist) for playlist, incomplete in results])
+
+
+
+class WaveTest(unittest.TestCase):
+
+    messages = ['love you baby tonight we dance in the rain forever and ever', 'hold the light', 'stay']
+
+    def setUp(self):
+        self.fakes = [FakeSpotify().start(), FakeSpotify().start()]
+
+    def tearDown(self):
+        for fake in self.fakes:
+            fake.stop()
+
+    def generators(self, engine):
+        lazy = PlaylistGenerator(engine=engine, session=SpotifySession(), search_url=self.fakes[0].url)
+        waves = PlaylistGenerator(engine=engine, prefetch=True, session=SpotifySession(), search_url=self.fakes[1].url)
+        return lazy, waves
+
+    def assert_like_lazy(self, engine):
+        lazy, waves = self.generators(engine)
+        expected = [names(lazy.generate_playlist(message)) for message in self.messages]
+        self.assertEqual(expected, [names(waves.generate_playlist(message)) for message in self.messages])
+        # Only titles that segmenting gets to are looked up, and a few shorter ones here and there, instead of all
+        # titles a message can be broken down into
+        lazy_calls, wave_calls = [fake.stats()['calls'] for fake in self.fakes]
+        self.assertLessEqual(wave_calls, lazy_calls + len(self.messages[0].split()))
+
+    def test_chunker(self):
+        self.assert_like_lazy(ENGINE_CHUNKER)
+
+    def test_dp(self):
+        self.assert_like_lazy(ENGINE_DP)
+
+    def test_batch(self):
+        lazy, waves = self.generators(ENGINE_DP)
+        expected = [names(lazy.generate_playlist(message)) for message in self.messages]
+        self.assertEqual(expected, [names(result) for result in
+                                    waves.generate_playlists([(message, False) for message in self.messages])])
+
+
+if __name__ == '__main__':
+    unittest.main()
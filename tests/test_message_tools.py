@@ -0,0 +1,94 @@
+__author__ = 'Daan Debie'
+
+import unittest
+from datetime import datetime
+
+from playlist.cache import PlaylistItem
+from playlist.deadline import Deadline
+from playlist.deadline import DeadlineExceeded
+from playlist.generator import ENGINE_CHUNKER
+from playlist.generator import ENGINE_DP
+from playlist.generator import segment_message
+
+# Fail instead of hanging when segmenting doesn't terminate
+MAX_RESOLVES = 1000
+
+
+def resolver(titles, out_of_time_at=None):
+    """
+    Returns a resolve function that only knows the given titles, and fails when it's called too often. It raises
+    DeadlineExceeded when asked for the title out_of_time_at
+    """
+    now = datetime.utcnow()
+    calls = []
+
+    def resolve(title):
+        calls.append(title)
+        if len(calls) > MAX_RESOLVES:
+            raise AssertionError("Still segmenting after {} titles".format(MAX_RESOLVES))
+        if title == out_of_time_at:
+            raise DeadlineExceeded()
+        return PlaylistItem(title, 'spotify:track:' + title, now, now) if title in titles else None
+    return resolve
+
+
+class MessageChunkerTest(unittest.TestCase):
+
+    def test_backtracking_past_single_word_group_terminates(self):
+        # Used to loop forever: backtracking past 'c' started over with the largest group from there
+        playlist, incomplete = segment_message('a b c d e', resolver({'a', 'b', 'c', 'e'}), 4, ENGINE_CHUNKER)
+        self.assertTrue(incomplete)
+        self.assertEqual(['a', 'b', 'c'], [item.name for item in playlist])
+
+    def test_complete_cover(self):
+        playlist, incomplete = segment_message('a b c d e', resolver({'a b', 'c', 'd e'}), 4, ENGINE_CHUNKER)
+        self.assertFalse(incomplete)
+        self.assertEqual(['a b', 'c', 'd e'], [item.name for item in playlist])
+
+
+class EnginesTest(unittest.TestCase):
+    """ The SpanSegmenter and the MessageChunker, given the same messages and titles """
+
+    def segment(self, message, titles, max_chunk_length=None, out_of_time_at=None, deadline=None):
+        """ Returns the names and incompleteness of the playlist of every engine """
+        results = {}
+        for engine in (ENGINE_CHUNKER, ENGINE_DP):
+            playlist, incomplete = segment_message(message, resolver(titles, out_of_time_at), max_chunk_length,
+                                                   engine, deadline=deadline)
+            results[engine] = ([item.name for item in playlist], incomplete)
+        return results
+
+    def assert_engines_agree(self, expected, *args, **kwargs):
+        self.assertEqual({ENGINE_CHUNKER: expected, ENGINE_DP: expected}, self.segment(*args, **kwargs))
+
+    def test_complete_cover_after_backtracking(self):
+        self.assert_engines_agree((['a', 'b c d'], False), 'a b c d', {'a b c', 'a', 'b c d'})
+
+    def test_largest_groups_first(self):
+        self.assert_engines_agree((['a b', 'c d'], False), 'a b c d', {'a', 'b', 'c', 'd', 'a b', 'c d'})
+
+    def test_max_chunk_length_only_limits_the_first_group(self):
+        self.assert_engines_agree((['a', 'b c d'], False), 'a b c d', {'a', 'a b', 'b c d'}, 1)
+
+    def test_dp_covers_the_most_words(self):
+        # Without a complete cover, the chunker takes the attempt with the most groups, and the DP the longest prefix
+        results = self.segment('a b c d', {'a b c', 'a', 'b'})
+        self.assertEqual((['a', 'b'], True), results[ENGINE_CHUNKER])
+        self.assertEqual((['a b c'], True), results[ENGINE_DP])
+
+    def test_best_effort_when_out_of_time(self):
+        self.assert_engines_agree((['a', 'b'], True), 'a b c d', {'a', 'b', 'c', 'd'}, out_of_time_at='c d')
+
+    def test_expired_deadline(self):
+        self.assert_engines_agree(([], True), 'a b c d', {'a', 'b', 'c', 'd'}, deadline=Deadline(0))
+
+    def test_empty_message(self):
+        self.assert_engines_agree(([], True), '', {'a'})
+
+    def test_one_word(self):
+        self.assert_engines_agree((['a'], False), 'a', {'a'})
+        self.assert_engines_agree(([], True), 'a', set())
+
+
+if __name__ == '__main__':
+    unittest.main()
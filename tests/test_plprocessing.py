@@ -0,0 +1,78 @@
+__author__ = 'Daan Debie'
+
+import os
+import unittest
+
+import redis
+
+from benchmarks.fakespotify import FakeSpotify
+from playlist.generator import ENGINE_DP
+from playlist.plprocessing import GeneratorProcessPool
+from playlist.plprocessing import generate_multiple_playlists_multiprocess
+from playlist.plthreading import generate_multiple_playlists_threaded
+from playlist.generator import PlaylistGenerator
+
+# The tests that need Redis empty the database this names (ie. REDIS_TEST_DB=15), and are skipped when it isn't set
+REDIS_TEST_DB = 'REDIS_TEST_DB'
+
+
+def redis_test_database(test):
+    """
+    Returns a client for the Redis database the tests may empty, emptied now and again when the test is done.
+    Skips the test if there's no such database
+    """
+    number = os.environ.get(REDIS_TEST_DB)
+    if not number:
+        test.skipTest("Set {} to a Redis database the tests may empty".format(REDIS_TEST_DB))
+    database = redis.StrictRedis(db=int(number))
+    try:
+        database.flushdb()
+    except redis.ConnectionError:
+        test.skipTest("Redis isn't running")
+    test.addCleanup(database.flushdb)
+    return database
+
+
+def names(results):
+    return [([item.name for item in playlist], incomplete) for playlist, incomplete in results]
+
+
+class GeneratorProcessPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSpotify().start()
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool:
+            self.pool.close()
+        self.fake.stop()
+
+    def assert_cache_shared(self):
+        generate_multiple_playlists_multiprocess(['love you baby tonight'], self.pool)
+        before = self.fake.stats()['calls']
+        # Every title of these was looked up for the first message, by whichever worker generated it
+        results = generate_multiple_playlists_multiprocess(['you baby', 'baby tonight', 'love you'] * 4, self.pool)
+        self.assertEqual(before, self.fake.stats()['calls'])
+        self.assertEqual(12, len(results))
+
+    def test_shared_memory_cache(self):
+        self.pool = GeneratorProcessPool(2, shared_memory=True, engine=ENGINE_DP, search_url=self.fake.url)
+        self.assert_cache_shared()
+
+    def test_redis_cache(self):
+        database = redis_test_database(self)
+        self.pool = GeneratorProcessPool(2, redis={'database': database.connection_pool.connection_kwargs['db']},
+                                         engine=ENGINE_DP, search_url=self.fake.url)
+        self.assert_cache_shared()
+
+    def test_results_in_order_like_threaded(self):
+        self.pool = GeneratorProcessPool(2, engine=ENGINE_DP, search_url=self.fake.url)
+        messages = ['hold the light', 'run away tonight', 'baby you', 'stay', 'dream of fire and rain']
+        generator = PlaylistGenerator(engine=ENGINE_DP, search_url=self.fake.url)
+        self.assertEqual(names(generate_multiple_playlists_threaded(messages, None, generator=generator)),
+                         names(generate_multiple_playlists_multiprocess(messages, self.pool)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+__author__ = 'Daan Debie'
+
+import unittest
+
+from playlist import plprocessing
+from playlist.generator import ENGINE_CHUNKER
+from playlist.generator import SPOTIFY_API_SEARCH_TRACK_URL
+from playlist.ratelimit import RedisTokenBucket
+from tests.test_plprocessing import redis_test_database
+
+
+class RedisTokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = RedisTokenBucket(redis_test_database(self))
+
+    def test_shorter_pause_keeps_longer_one(self):
+        self.bucket.pause(10)
+        self.bucket.pause(1)
+        self.assertGreater(self.bucket.try_acquire(), 5)
+
+    def test_longer_pause_extends_shorter_one(self):
+        self.bucket.pause(1)
+        self.bucket.pause(10)
+        self.assertGreater(self.bucket.try_acquire(), 5)
+
+
+class WorkerRateLimitTest(unittest.TestCase):
+
+    def rate_limiter(self, processes):
+        plprocessing._init_worker({'redis': None, 'caches': None, 'processes': processes, 'engine': ENGINE_CHUNKER,
+                                   'timeout': None, 'rate_limit': 10, 'title_index_path': None,
+                                   'search_url': SPOTIFY_API_SEARCH_TRACK_URL})
+        self.addCleanup(setattr, plprocessing, '_worker_generator', None)
+        return plprocessing._worker_generator.session.rate_limiter
+
+    def test_rate_and_bursts_are_split(self):
+        rate_limiter = self.rate_limiter(4)
+        self.assertEqual((2.5, 5), (rate_limiter.rate, rate_limiter.capacity))
+
+    def test_every_worker_can_make_calls(self):
+        self.assertEqual(1, self.rate_limiter(64).capacity)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+__author__ = 'Daan Debie'
+
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+from playlist.cache import PlaylistItem
+from playlist.rediscache import RedisPlaylistCache
+from playlist.resultcache import RedisResultCache
+from tests.test_cache import NegativeCacheTests
+from tests.test_plprocessing import redis_test_database
+from tests.test_serialization import ascii_item
+
+
+class ScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = RedisPlaylistCache(connection_pool=redis_test_database(self).connection_pool)
+
+    def test_results_are_not_items(self):
+        now = datetime.utcnow().replace(microsecond=0)
+        item = PlaylistItem('Love', 'spotify:track:1', now, now + timedelta(hours=1))
+        self.cache.put('love', item)
+        self.cache.put_miss('baby')
+        RedisResultCache(self.cache.database).put('chunker:0:love', ([ascii_item()], False), now + timedelta(hours=1))
+        self.assertEqual(['love'], [key for key, item in self.cache.scan()])
+        self.assertEqual([('baby', None), ('love', 'Love')],
+                         sorted((key, item and item.name) for key, item in self.cache.scan(include_misses=True)))
+
+
+class RedisNegativeCacheTest(NegativeCacheTests, unittest.TestCase):
+
+    def setUp(self):
+        self.cache = RedisPlaylistCache(connection_pool=redis_test_database(self).connection_pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+__author__ = 'Daan Debie'
+
+import unittest
+from datetime import datetime
+
+from playlist.cache import PlaylistItem
+from playlist.cache import datetime_from_epoch
+from playlist.serialization import decode_item
+from playlist.serialization import decode_result
+from playlist.serialization import encode_item
+from playlist.serialization import encode_result
+
+
+def item():
+    now = datetime.utcnow().replace(microsecond=0)
+    return PlaylistItem(u'Love', 'spotify:track:1', now, now)
+
+
+def ascii_item():
+    """ An item whose encoding is all ASCII, so its bytes still decode as text when they're read the wrong way """
+    # 0x41414141, 'AAAA'
+    a_while_ago = datetime_from_epoch(1094795585)
+    return PlaylistItem(u'Love', 'spotify:track:1', a_while_ago, a_while_ago)
+
+
+class SerializationTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(('Love', 'spotify:track:1'), (decode_item(encode_item(item())).name,
+                                                        decode_item(encode_item(item())).uri))
+        playlist, incomplete = decode_result(encode_result([item(), item()], True))
+        self.assertEqual((2, True), (len(playlist), incomplete))
+
+    def test_item_is_not_a_result(self):
+        self.assertRaises(ValueError, decode_result, encode_item(ascii_item()))
+
+    def test_result_is_not_an_item(self):
+        self.assertRaises(ValueError, decode_item, encode_result([ascii_item()], False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+__author__ = 'Daan Debie'
+
+import socket
+import unittest
+
+from benchmarks.fakespotify import FakeSpotify
+from playlist.session import ApiException
+from playlist.session import ApiUnavailable
+from playlist.session import SpotifySession
+
+
+def closed_port():
+    """ Returns a port nothing is listening on """
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+
+class UnavailableTest(unittest.TestCase):
+
+    def test_timeout(self):
+        fake = FakeSpotify(latency=0.5).start()
+        self.addCleanup(fake.stop)
+        with self.assertRaises(ApiUnavailable) as raised:
+            SpotifySession(timeout=0.1).get(fake.url, params={'q': 'love', 'type': 'track'})
+        self.assertEqual('timeout', raised.exception.status)
+
+    def test_connection_error_after_retries(self):
+        session = SpotifySession(max_retries=1, backoff_factor=0.01)
+        with self.assertRaises(ApiException) as raised:
+            session.get('http://127.0.0.1:{}/v1/search'.format(closed_port()))
+        self.assertEqual('connection error', raised.exception.status)
+
+
+class HostsTest(unittest.TestCase):
+
+    def test_pools_of_many_hosts_are_kept(self):
+        fakes = [FakeSpotify(latency=0).start() for _ in range(3)]
+        for fake in fakes:
+            self.addCleanup(fake.stop)
+        session = SpotifySession()
+        for _ in range(2):
+            for fake in fakes:
+                session.get(fake.url, params={'q': 'love', 'type': 'track'})
+        self.assertEqual(3, len(session.session.adapters['http://'].poolmanager.pools))
+
+
+if __name__ == '__main__':
+    unittest.main()
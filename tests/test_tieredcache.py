@@ -0,0 +1,60 @@
+__author__ = 'Daan Debie'
+
+import time
+import unittest
+
+from playlist.cache import MemPlaylistCache
+from playlist.tieredcache import TieredPlaylistCache
+from tests.test_cache import NegativeCacheTests
+from tests.test_cache import fresh_item
+
+
+class TieredPlaylistCacheTest(NegativeCacheTests, unittest.TestCase):
+
+    short_ttl = 0.1
+
+    def setUp(self):
+        self.l1 = MemPlaylistCache()
+        self.l2 = MemPlaylistCache()
+        self.cache = TieredPlaylistCache(self.l1, self.l2, staleness=0.2)
+
+    def test_l1_hit(self):
+        self.cache.put('love', fresh_item('love'))
+        self.cache.put_miss('baby')
+        # Gone from L2, but still in L1
+        self.l2.remove('love')
+        self.l2.put_miss('baby', 0)
+        self.assertEqual('Love', self.cache.get('love').name)
+        self.assertEqual(['love'], self.cache.get_many(['love']).keys())
+        self.assertTrue(self.cache.is_miss('baby'))
+        self.assertEqual({'baby'}, self.cache.get_misses(['baby']))
+
+    def test_l2_fills_l1(self):
+        self.l2.put_many({'love': fresh_item('love'), 'rain': fresh_item('rain')})
+        self.l2.put_misses(['baby', 'fire'])
+        self.assertEqual('Love', self.cache.get('love').name)
+        self.assertEqual(['rain'], self.cache.get_many(['rain']).keys())
+        self.assertTrue(self.cache.is_miss('baby'))
+        self.assertEqual({'fire'}, self.cache.get_misses(['fire']))
+        self.assertEqual(['love', 'rain'], sorted(self.l1.get_many(['love', 'rain'])))
+        self.assertEqual({'baby', 'fire'}, self.l1.get_misses(['baby', 'fire']))
+
+    def test_l1_is_stale_for_at_most_staleness(self):
+        self.cache.put('love', fresh_item('love'))
+        self.cache.put_miss('baby')
+        self.l2.remove('love')
+        self.l2.put_miss('baby', 0)
+        time.sleep(0.3)
+        self.assertIsNone(self.cache.get('love'))
+        self.assertFalse(self.cache.is_miss('baby'))
+
+
+    def test_miss_with_ttl_of_zero_is_not_kept(self):
+        self.cache.put_miss('baby', 0)
+        self.cache.put_misses(['rain'], 0)
+        self.assertFalse(self.cache.is_miss('baby'))
+        self.assertEqual(set(), self.cache.get_misses(['rain']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+__author__ = 'Daan Debie'
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+from playlist.cache import PlaylistItem
+from playlist.generator import ENGINE_CHUNKER
+from playlist.generator import PlaylistGenerator
+from playlist.generator import result_key
+from playlist.resultcache import MemResultCache
+from playlist.titleindex import TitleIndex
+from playlist.titleindex import entries_from_export
+from playlist.titleindex import fresh_for
+from playlist.titleindex import write_index
+
+
+class IndexedResultTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'titles.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_result_cached(self, entries):
+        write_index(self.path, entries)
+        index = TitleIndex(self.path)
+        self.addCleanup(index.close)
+        result_cache = MemResultCache()
+        generator = PlaylistGenerator(title_index=index, result_cache=result_cache)
+        results = [generator.generate_playlist('love') for _ in range(3)]
+        self.assertEqual(['Love'] * 3, [playlist[0].name for playlist, incomplete in results])
+        self.assertIsNotNone(result_cache.get(result_key('love', ENGINE_CHUNKER, False)))
+
+    def test_results_from_exported_titles_are_cached(self):
+        self.assert_result_cached(entries_from_export(['{"title": "love", "name": "Love", "uri": "spotify:track:1"}']))
+
+    def test_results_from_expired_titles_are_cached(self):
+        an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+        item = PlaylistItem('Love', 'spotify:track:1', an_hour_ago, an_hour_ago)
+        self.assert_result_cached(fresh_for([('love', item)]))
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'titles.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_titles_are_normalised(self):
+        write_index(self.path, entries_from_export(['{"title": " Love  Me TENDER", "name": "Love Me Tender", '
+                                                    '"uri": "spotify:track:1"}',
+                                                    '{"title": "HOLD"}']))
+        index = TitleIndex(self.path)
+        self.addCleanup(index.close)
+        known, item = index.lookup('love me tender')
+        self.assertTrue(known)
+        self.assertEqual(('Love Me Tender', 'spotify:track:1'), (item.name, item.uri))
+        self.assertEqual((True, None), index.lookup('hold'))
+        self.assertEqual((False, None), index.lookup(' Love  Me TENDER'))
+
+
+if __name__ == '__main__':
+    unittest.main()
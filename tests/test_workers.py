@@ -0,0 +1,42 @@
+__author__ = 'Daan Debie'
+
+import time
+import unittest
+from threading import Event
+
+from playlist.workers import BackgroundTasks
+
+
+class BackgroundTasksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.release = Event()
+        # Like the refresher of the app and the default one of the generators
+        self.tasks = BackgroundTasks('test', 2, 1)
+        self.other_tasks = BackgroundTasks('test', 4, 10)
+        # Tasks pending with the same name would be skipped in the next test
+        self.addCleanup(self.wait_until_done)
+
+    def wait_until_done(self):
+        self.release.set()
+        for _ in range(100):
+            if not self.tasks.pending:
+                return
+            time.sleep(0.01)
+        self.fail("Background tasks still pending")
+
+    def test_same_name_shares_pending_tasks(self):
+        self.assertTrue(self.tasks.submit('love', self.release.wait))
+        self.assertFalse(self.other_tasks.submit('love', self.release.wait))
+        self.assertEqual({'love'}, self.other_tasks.pending)
+        self.wait_until_done()
+        self.assertTrue(self.other_tasks.submit('love', self.release.wait))
+
+    def test_max_pending_counts_tasks_of_the_same_name(self):
+        self.assertTrue(self.other_tasks.submit('love', self.release.wait))
+        self.assertFalse(self.tasks.submit('baby', self.release.wait))
+        self.assertFalse(BackgroundTasks('other test', 1, 1).pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+Warms up the Redis cache, so the apps don't start out with a cold cache after a flush or a fresh deploy.
+Reads a corpus or a log of past messages (one or more per line), and looks up every title the messages can be broken
+down into, the same way the generator would, storing the results in Redis.
+Progress is written to stderr. With a checkpoint file, an interrupted run can be resumed where it left off.
+
+"""
+
+__author__ = 'Daan Debie'
+
+import argparse
+import fileinput
+import sys
+import time
+
+from playlist.checkpoint import read_checkpoint
+from playlist.checkpoint import write_checkpoint
+from playlist.generator import ApiException
+from playlist.generator import PlaylistGenerator
+from playlist.generator import normalise_message
+from playlist.message_tools import candidate_titles
+from playlist.message_tools import split_sentences
+from playlist.ratelimit import RedisTokenBucket
+from playlist.rediscache import RedisPlaylistCache
+from playlist.session import SpotifySession
+
+
+def titles_from_line(line, max_words=None):
+    """
+    Returns the candidate titles of all sentences on a line, of at most max_words words
+    """
+    titles = []
+    for sentence in split_sentences(line):
+        message = normalise_message(sentence)
+        titles.extend(title for title in candidate_titles(message)
+                      if not max_words or len(title.split()) <= max_words)
+    return titles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm up the Redis cache with the titles in a corpus of messages")
+    parser.add_argument("corpus", help="Files with messages, one or more per line (stdin if none)", nargs='*')
+    parser.add_argument("-s", "--server", help="Hostname of Redis instance", default='localhost')
+    parser.add_argument("-p", "--port", help="Port of Redis instance", type=int, default=6379)
+    parser.add_argument("-d", "--database", help="Redis db to use", type=int, default=0)
+    parser.add_argument("-w", "--password", help="Redis password to use")
+    parser.add_argument("-l", "--rate-limit", help="Maximum number of Spotify API calls per second", type=float,
+                        default=10)
+    parser.add_argument("-c", "--concurrency", help="Number of concurrent Spotify API calls", type=int, default=8)
+    parser.add_argument("-b", "--batch-size", help="Number of titles looked up per batch", type=int, default=1000)
+    parser.add_argument("-n", "--max-words", help="Skip titles with more words than this", type=int)
+    parser.add_argument("-k", "--checkpoint", help="File to keep track of progress in, for resuming")
+    args = parser.parse_args()
+
+    cache = RedisPlaylistCache(args.server, args.port, args.database, args.password)
+    # The rate limit is kept in Redis, so it's shared with any app using the same instance and the Redis rate limiter
+    session = SpotifySession(pool_size=args.concurrency, rate_limiter=RedisTokenBucket(cache.database, args.rate_limit))
+    generator = PlaylistGenerator(cache, prefetch_workers=args.concurrency, session=session)
+
+    skip, = read_checkpoint(args.checkpoint)
+    if skip:
+        sys.stderr.write("Resuming after line {}\n".format(skip))
+    lines_done = 0
+    titles_done = 0
+    tracks_found = 0
+    batch = set()
+    start = time.time()
+
+    def resolve_batch():
+        resolved = generator.resolve_titles(list(batch))
+        batch.clear()
+        write_checkpoint(args.checkpoint, lines_done)
+        return len(resolved), len([item for item in resolved.itervalues() if item])
+
+    try:
+        for line in fileinput.input(args.corpus):
+            lines_done += 1
+            if lines_done <= skip:
+                continue
+            batch.update(titles_from_line(line, args.max_words))
+            if len(batch) >= args.batch_size:
+                resolved, found = resolve_batch()
+                titles_done += resolved
+                tracks_found += found
+                sys.stderr.write("{} lines, {} titles, {} tracks ({:.1f} titles/s)\n".format(
+                    lines_done, titles_done, tracks_found, titles_done / (time.time() - start)))
+        if batch:
+            resolved, found = resolve_batch()
+            titles_done += resolved
+            tracks_found += found
+        else:
+            write_checkpoint(args.checkpoint, lines_done)
+    except ApiException as e:
+        sys.exit("An API error occured({})! Rerun to resume".format(str(e.status)))
+    except KeyboardInterrupt:
+        sys.exit("Interrupted! Rerun to resume")
+
+    sys.stderr.write("Done: {} lines, {} titles, {} tracks in {:.0f} seconds\n".format(
+        lines_done, titles_done, tracks_found, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()